@@ -3,7 +3,10 @@ import numpy as np
 import cv2
 
 def normalize_image(image):
-    return (image - np.min(image)) / (np.max(image) - np.min(image))
+    # Retired: per-array min/max gives every image its own scale. Satellite data is normalized with the
+    # dataset-wide FittedNormalizer (client/src/normalization.py) in preprocessing, training and live inference.
+    raise NotImplementedError("Per-image min/max normalization is retired; use client/src/normalization.py "
+                              "(load_normalizer / frame_normalizer) so every path applies the fitted statistics")
 
 def save_image(image, path):
     cv2.imwrite(path, image)
@@ -0,0 +1,136 @@
+import math
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import default_collate
+
+# Training-time augmentation for (image, mask) segmentation batches, on CPU inside DataLoader workers.
+#
+# Augmentation runs in the collate function, i.e. in the worker that assembles each batch, and works on the
+# whole batch at once:
+#   - geometric (image and mask identically): flips, 90-degree rotations, random crops (zoom-in) and a small
+#     rotation/shift are composed into one affine matrix per sample and applied with a single
+#     affine_grid/grid_sample call per batch (bilinear for the image, nearest for the mask, same grid);
+#   - photometric (image only): per-sample, per-channel contrast/brightness jitter and Gaussian sensor noise.
+# Randomness comes from a torch.Generator seeded from torch.initial_seed(), which DataLoader sets to
+# base_seed + worker_id in every worker, so a DataLoader built with a seeded `generator` reproduces the
+# same augmentations run after run. Rotations assume square patches.
+
+
+def seed_worker(worker_id):
+    """DataLoader worker_init_fn: derive NumPy's global seed from the worker's torch seed as well."""
+    np.random.seed(torch.initial_seed() % 2 ** 32)
+
+
+class SegmentationAugmenter:
+    """Batch augmentation; call it on (images (N, C, H, W) float, masks (N, 1, H, W) float)."""
+
+    def __init__(self, hflip_p=0.5, vflip_p=0.5, rot90_p=0.5, crop_scale=(0.8, 1.0), max_rotation=10.0, max_shift=0.05,
+                 brightness=0.05, contrast=0.1, noise_std=0.01, photometric_p=0.8):
+        self.hflip_p = hflip_p
+        self.vflip_p = vflip_p
+        self.rot90_p = rot90_p
+        self.crop_scale = crop_scale
+        self.max_rotation = max_rotation
+        self.max_shift = max_shift
+        self.brightness = brightness
+        self.contrast = contrast
+        self.noise_std = noise_std
+        self.photometric_p = photometric_p
+        self._generator = None
+        self._seed = None
+
+    @property
+    def generator(self):
+        seed = torch.initial_seed()  # Differs per DataLoader worker
+        if self._generator is None or self._seed != seed:
+            self._generator = torch.Generator().manual_seed(seed)
+            self._seed = seed
+        return self._generator
+
+    def _uniform(self, n, low, high):
+        return torch.rand(n, generator=self.generator) * (high - low) + low
+
+    def affine_matrices(self, n, square=True):
+        """(n, 2, 3) output->input sampling matrices in normalized coordinates."""
+        g = self.generator
+        angle = self._uniform(n, -self.max_rotation, self.max_rotation) * (math.pi / 180)
+        cos, sin = torch.cos(angle), torch.sin(angle)
+        if square and self.rot90_p > 0:
+            # Quarter turns from exact integer cos/sin, so pure flips/rotations land on pixel centres
+            quarter_turns = torch.randint(1, 4, (n,), generator=g) * (torch.rand(n, generator=g) < self.rot90_p)
+            cos_q = torch.tensor([1.0, 0.0, -1.0, 0.0])[quarter_turns]
+            sin_q = torch.tensor([0.0, 1.0, 0.0, -1.0])[quarter_turns]
+            cos, sin = cos * cos_q - sin * sin_q, sin * cos_q + cos * sin_q
+        scale = self._uniform(n, *self.crop_scale)
+        flip_x = 1 - 2 * (torch.rand(n, generator=g) < self.hflip_p).float()
+        flip_y = 1 - 2 * (torch.rand(n, generator=g) < self.vflip_p).float()
+        # The sampled region may move anywhere that keeps the crop inside the patch, plus the small shift
+        reach = (1 - scale) + self.max_shift
+        shift = (torch.rand(n, 2, generator=g) * 2 - 1) * reach[:, None]
+
+        theta = torch.zeros(n, 2, 3)
+        theta[:, 0, 0] = cos * scale * flip_x
+        theta[:, 0, 1] = -sin * scale * flip_y
+        theta[:, 1, 0] = sin * scale * flip_x
+        theta[:, 1, 1] = cos * scale * flip_y
+        theta[:, :, 2] = shift
+        return theta
+
+    def geometric(self, images, masks):
+        n, _, h, w = images.shape
+        theta = self.affine_matrices(n, square=(h == w))
+        grid = F.affine_grid(theta, (n, 1, h, w), align_corners=False)
+        images = F.grid_sample(images, grid, mode="bilinear", padding_mode="reflection", align_corners=False)
+        masks = F.grid_sample(masks, grid, mode="nearest", padding_mode="reflection", align_corners=False)
+        return images, masks
+
+    def photometric(self, images):
+        n, c = images.shape[:2]
+        g = self.generator
+        apply = (torch.rand(n, 1, 1, 1, generator=g) < self.photometric_p).float()
+        gain = 1 + apply * (torch.rand(n, c, 1, 1, generator=g) * 2 - 1) * self.contrast
+        bias = apply * (torch.rand(n, c, 1, 1, generator=g) * 2 - 1) * self.brightness
+        images = torch.addcmul(bias, images, gain)
+        if self.noise_std > 0:
+            images.add_(torch.randn(images.shape, generator=g).mul_(apply * self.noise_std))
+        return images
+
+    def __call__(self, images, masks):
+        images, masks = self.geometric(images.float(), masks.float())
+        return self.photometric(images), masks
+
+
+class AugmentingCollate:
+    """collate_fn that stacks (image, mask) samples and augments the batch, inside the DataLoader worker."""
+
+    def __init__(self, augmenter):
+        self.augmenter = augmenter
+
+    def __call__(self, samples):
+        images, masks = default_collate(samples)
+        return self.augmenter(images, masks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and time batch augmentation on random patches.")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--channels", type=int, default=2)
+    args = parser.parse_args()
+
+    images = torch.rand(args.batch_size, args.channels, args.size, args.size)
+    # Mask derived from the first channel: geometry must keep it aligned with the (noise-free) image
+    masks = (images[:, :1] > 0.5).float()
+    augmenter = SegmentationAugmenter(photometric_p=0.0, crop_scale=(1.0, 1.0), max_rotation=0.0, max_shift=0.0)
+    aug_images, aug_masks = augmenter(images, masks)
+    print(f"Flips/rot90 keep image and mask aligned: {torch.equal((aug_images[:, :1] > 0.5).float(), aug_masks)}")
+
+    augmenter = SegmentationAugmenter()
+    start = time.perf_counter()
+    for _ in range(5):
+        augmenter(images, masks)
+    per_batch = (time.perf_counter() - start) / 5
+    print(f"Full augmentation: {per_batch * 1000:.1f} ms per batch of {args.batch_size}x{args.channels}x{args.size}^2")
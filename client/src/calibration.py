@@ -0,0 +1,184 @@
+import time
+import argparse
+import numpy as np
+
+# Radiometric calibration: raw detector counts -> physical values (brightness temperature, radiance, reflectance).
+#
+# Calibration runs on every pixel of every channel of every scene, so each band's calibration is reduced
+# once per file to either
+#   - a lookup table indexed by the integer count (INSAT ships count->BT/albedo tables in its L1B files; a
+#     scale/offset over uint8/uint16 counts, optionally followed by the inverse Planck function, is tabulated
+#     the same way), applied as a single np.take gather into a float32 buffer, or
+#   - a float32 fused multiply-add, for float or wide integer inputs.
+# Tables are built in float64 (at most 65536 entries); the per-pixel path never leaves float32.
+# Fill values and counts outside the table map to NaN.
+#
+# Per-band specs live in config.PREPROCESS_STAGES["calibrate"][source][band]:
+#   quantity          - "brightness_temperature", "radiance" or "reflectance" (recorded in the view's meta)
+#   lut_band          - auxiliary table in the file (e.g. "TIR1_TEMP"). When configured it is required: a file
+#                       without it is refused (ValueError) rather than calibrated from its scale/offset, which
+#                       for INSAT products do not encode the same quantity as the table
+#   scale_attr, offset_attr, fill_attr - band attribute names (default scale_factor/add_offset/_FillValue)
+#   offset_first      - MODIS form: (count - offset) * scale
+#   band_index        - element of array-valued scale/offset attributes (MODIS radiance_scales)
+#   wavenumber        - central wavenumber (cm^-1): scaled radiance (mW m-2 sr-1 (cm-1)-1) -> BT by inverse Planck
+#   solar_irradiance  - number or attribute name: radiance -> reflectance factor pi * L / E0
+
+PLANCK_C1 = 1.191042e-5  # mW m-2 sr-1 (cm-1)-4
+PLANCK_C2 = 1.4387752    # K cm
+
+_TABLE_DTYPES = (np.uint8, np.uint16, np.int8, np.int16)
+
+
+def inverse_planck(radiance, wavenumber):
+    """Brightness temperature (K) of `radiance` (mW m-2 sr-1 (cm-1)-1) at `wavenumber` (cm^-1); NaN where L <= 0."""
+    radiance = np.asarray(radiance, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bt = PLANCK_C2 * wavenumber / np.log1p(PLANCK_C1 * wavenumber ** 3 / radiance)
+    return np.where(radiance > 0, bt, np.nan)
+
+
+class Calibration:
+    """
+    Frozen calibration of one band. Call it on a count array to get float32 physical values.
+    Either `lut` (count -> value) or the affine `scale`/`offset` (+ optional inverse Planck at `wavenumber`).
+    """
+
+    def __init__(self, quantity, lut=None, scale=1.0, offset=0.0, wavenumber=None, fill_value=None, valid_range=None):
+        self.quantity = quantity
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.wavenumber = wavenumber
+        self.fill_value = fill_value
+        self.valid_range = valid_range
+        self._tables = {}  # count dtype -> float32 table (with a trailing NaN for out-of-range counts)
+        if lut is not None:
+            self._file_lut = self._finish_table(np.asarray(lut, dtype=np.float64).ravel(), offset=0)
+        else:
+            self._file_lut = None
+
+    def _finish_table(self, values, offset):
+        """float64 values for counts offset..offset+n-1 -> float32 table with fill/invalid entries and a NaN tail."""
+        counts = np.arange(values.size) + offset
+        invalid = ~np.isfinite(values)
+        if self.fill_value is not None:
+            invalid |= counts == self.fill_value
+        if self.valid_range is not None:
+            invalid |= (counts < self.valid_range[0]) | (counts > self.valid_range[1])
+        table = np.empty(values.size + 1, dtype=np.float32)
+        table[:-1] = np.where(invalid, np.nan, values)
+        table[-1] = np.nan
+        return table
+
+    def table(self, dtype):
+        """Lookup table covering every value of integer `dtype` (signed dtypes are indexed from their minimum)."""
+        if self._file_lut is not None:
+            return self._file_lut
+        dtype = np.dtype(dtype)
+        if dtype not in self._tables:
+            info = np.iinfo(dtype)
+            counts = np.arange(info.min, info.max + 1, dtype=np.float64)
+            values = counts * self.scale + self.offset
+            if self.wavenumber:
+                values = inverse_planck(values, self.wavenumber)
+            self._tables[dtype] = self._finish_table(values, offset=info.min)
+        return self._tables[dtype]
+
+    def __call__(self, counts, out=None):
+        counts = np.asarray(counts)
+        if out is None:
+            out = np.empty(counts.shape, dtype=np.float32)
+
+        if counts.dtype.kind in "ui" and (self._file_lut is not None or counts.dtype in _TABLE_DTYPES):
+            table = self.table(counts.dtype)
+            index = counts
+            if counts.dtype.kind == "i":  # Shift signed counts to non-negative table indices
+                low = 0 if self._file_lut is not None else np.iinfo(counts.dtype).min
+                index = counts.astype(np.int32) - low
+                np.putmask(index, index < 0, table.size - 1)
+            # mode="clip" sends counts past the table onto its trailing NaN
+            return np.take(table, index, out=out, mode="clip")
+
+        # Float or wide-integer input: fused multiply-add in float32, in place when `out` is the input
+        np.multiply(counts, np.float32(self.scale), out=out, dtype=np.float32, casting="unsafe")
+        out += np.float32(self.offset)
+        if self.fill_value is not None:
+            out[counts == self.fill_value] = np.nan
+        if self.wavenumber:
+            c1 = np.float32(PLANCK_C1 * self.wavenumber ** 3)
+            c2 = np.float32(PLANCK_C2 * self.wavenumber)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out[out <= 0] = np.nan
+                np.divide(c1, out, out=out)
+                np.log1p(out, out=out)
+                np.divide(c2, out, out=out)
+        return out
+
+    def __repr__(self):
+        source = f"lut[{self._file_lut.size - 1}]" if self._file_lut is not None else f"{self.scale}*count+{self.offset}"
+        planck = f" -> planck@{self.wavenumber}" if self.wavenumber and self._file_lut is None else ""
+        return f"Calibration({self.quantity}: {source}{planck})"
+
+
+def _attr(attrs, name, default, index=0):
+    """Scalar attribute; element `index` of array-valued ones (per-detector-band scales)."""
+    if not name or attrs.get(name) is None:
+        return default
+    value = np.asarray(attrs[name]).ravel()
+    return value[min(index, value.size - 1)].item()
+
+
+def build_calibration(reader, band, spec):
+    """Calibration for `band` of an open reader from its per-band spec (see module comment)."""
+    attrs = reader.band_attrs(band)
+    quantity = spec.get("quantity", "radiance")
+    index = spec.get("band_index", 0)
+    fill_value = _attr(attrs, spec.get("fill_attr", "_FillValue"), None, index)
+    if fill_value is None:
+        fill_value = _attr(attrs, "nodata", None)
+    valid_range = attrs.get("valid_range")
+    valid_range = tuple(np.asarray(valid_range).ravel()[:2]) if valid_range is not None else None
+
+    if spec.get("lut_band"):
+        lut = reader.read_auxiliary(spec["lut_band"])
+        if lut is None:
+            raise ValueError(f"{reader.path}: no {spec['lut_band']} calibration table for band {band}; "
+                             f"refusing to calibrate it from scale/offset")
+        return Calibration(quantity, lut=lut, fill_value=fill_value)
+
+    scale = _attr(attrs, spec.get("scale_attr", "scale_factor"), 1.0, index)
+    offset = _attr(attrs, spec.get("offset_attr", "add_offset"), 0.0, index)
+    if spec.get("offset_first"):
+        offset = -offset * scale
+    irradiance = spec.get("solar_irradiance")
+    if isinstance(irradiance, str):
+        irradiance = _attr(attrs, irradiance, None, index)
+    if irradiance:
+        factor = np.pi / irradiance
+        scale, offset = scale * factor, offset * factor
+    return Calibration(quantity, scale=scale, offset=offset, wavenumber=spec.get("wavenumber"),
+                       fill_value=fill_value, valid_range=valid_range)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark table-based calibration against a naive float64 path.")
+    parser.add_argument("--size", type=int, default=2816, help="Height and width of the synthetic count array")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    counts = np.random.default_rng(0).integers(0, 1024, size=(args.size, args.size), dtype=np.uint16)
+    cal = Calibration("brightness_temperature", scale=0.1, offset=1.0, wavenumber=925.9, fill_value=1023)
+
+    def naive(c):
+        radiance = c.astype(np.float64) * 0.1 + 1.0
+        bt = PLANCK_C2 * 925.9 / np.log1p(PLANCK_C1 * 925.9 ** 3 / radiance)
+        return np.where(c == 1023, np.nan, bt).astype(np.float32)
+
+    out = np.empty(counts.shape, dtype=np.float32)
+    for name, fn in (("float64 per pixel", lambda: naive(counts)), ("table gather", lambda: cal(counts, out=out))):
+        fn()
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            result = fn()
+        print(f"{name:>18}: {(time.perf_counter() - start) / args.repeats * 1000:.1f} ms per {args.size}x{args.size} band")
+    print(f"Max abs difference: {np.nanmax(np.abs(naive(counts) - cal(counts))):.2e} K")
@@ -0,0 +1,176 @@
+import os
+import glob
+import json
+import time
+import random
+import shutil
+import logging
+import numpy as np
+import torch
+
+# Resumable training checkpoints.
+#
+# A checkpoint holds everything needed to continue a run exactly where it stopped: model weights, optimizer,
+# LR scheduler and grad-scaler state, the finished epoch, the best validation metric so far, and the Python,
+# NumPy, torch (and CUDA) RNG states plus the training loader's shuffling generator, per rank under DDP so
+# every rank resumes its own augmentation and dropout streams. Files are written to a
+# temporary name, fsynced and renamed, so a node killed mid-write never leaves a truncated checkpoint.
+# CheckpointManager keeps an index of the run's checkpoints and deletes all but the last `keep_last` and
+# the best `keep_best` (the checkpoint just written is always kept). A new (not resumed) run first moves the previous run's index and checkpoints to
+# <prefix>_runs/<timestamp>/, so "latest"/"best" and retention only ever see the current run. Inference code can load the weights directly (inference.load_unet reads "model").
+
+CHECKPOINT_VERSION = 1
+INDEX_FILENAME = "checkpoints.json"
+
+
+def atomic_torch_save(obj, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def capture_rng_state(loader_generator=None):
+    # Tensors and plain Python values only, so checkpoints stay loadable with torch.load(weights_only=True)
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    state = {"python": random.getstate(), "numpy": (name, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached_gaussian),
+             "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    if loader_generator is not None:
+        state["loader"] = loader_generator.get_state()
+    return state
+
+
+def restore_rng_state(state, loader_generator=None):
+    random.setstate(state["python"])
+    name, keys, pos, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state((name, keys.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+    if loader_generator is not None and "loader" in state:
+        loader_generator.set_state(state["loader"])
+
+
+def _unwrap(model):
+    return model.module if hasattr(model, "module") else model  # DistributedDataParallel
+
+
+def training_state(model, optimizer, scheduler, epoch, best_metric, scaler=None, loader_generator=None, config=None,
+                   rank_rng=None):
+    """rank_rng: every rank's capture_rng_state(), by rank (distributed runs); defaults to this process's alone."""
+    rng = capture_rng_state(loader_generator)
+    return {"version": CHECKPOINT_VERSION, "model": _unwrap(model).state_dict(), "optimizer": optimizer.state_dict(),
+            "scheduler": scheduler.state_dict() if scheduler is not None else None,
+            "scaler": scaler.state_dict() if scaler is not None else None,
+            "epoch": epoch, "best_metric": best_metric, "rng": rng, "rank_rng": rank_rng or [rng], "config": config or {}}
+
+
+def restore_training_state(checkpoint, model, optimizer, scheduler=None, scaler=None, loader_generator=None, map_location="cpu",
+                           rank=0):
+    """
+    Loads a checkpoint (path or dict) into the given objects and `rank`'s RNG streams; returns (next epoch, best
+    metric). A rank the checkpoint has no RNG state for (more ranks than when saved) keeps its current seeding.
+    """
+    if isinstance(checkpoint, str):
+        checkpoint = torch.load(checkpoint, map_location=map_location, weights_only=True)
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {checkpoint.get('version')}, expected {CHECKPOINT_VERSION}")
+    _unwrap(model).load_state_dict(checkpoint["model"])
+    optimizer.load_state_dict(checkpoint["optimizer"])
+    if scheduler is not None and checkpoint.get("scheduler") is not None:
+        scheduler.load_state_dict(checkpoint["scheduler"])
+    if scaler is not None and checkpoint.get("scaler") is not None:
+        scaler.load_state_dict(checkpoint["scaler"])
+    rank_rng = checkpoint.get("rank_rng") or [checkpoint["rng"]]
+    if rank < len(rank_rng):
+        restore_rng_state(rank_rng[rank], loader_generator)
+    else:
+        logging.warning(f"Checkpoint has RNG state for {len(rank_rng)} ranks; rank {rank} keeps its fresh seed")
+    return checkpoint["epoch"] + 1, checkpoint["best_metric"]
+
+
+class CheckpointManager:
+    """Per-epoch checkpoints in `directory` named <prefix>_epochNNNN.ckpt, with retention by recency and metric."""
+
+    def __init__(self, directory, prefix="unet", keep_last=3, keep_best=1, mode="max"):
+        self.directory = directory
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.mode = mode
+        self.index_path = os.path.join(directory, f"{prefix}_{INDEX_FILENAME}")
+        self.entries = []  # [{"file", "epoch", "metric"}] oldest first
+        if os.path.isfile(self.index_path):
+            with open(self.index_path) as f:
+                self.entries = json.load(f)["checkpoints"]
+        # Drop entries whose files were removed by hand
+        self.entries = [e for e in self.entries if os.path.isfile(os.path.join(directory, e["file"]))]
+
+    def start_new_run(self):
+        """
+        Archives the previous run's index and epoch checkpoints under <prefix>_runs/<timestamp>/ and starts an
+        empty index; returns the archive directory (None if there was nothing to move).
+        """
+        stale = glob.glob(os.path.join(self.directory, f"{self.prefix}_epoch*.ckpt"))
+        if os.path.isfile(self.index_path):
+            stale.append(self.index_path)
+        self.entries = []
+        if not stale:
+            return None
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(max(os.path.getmtime(path) for path in stale)))
+        archive = os.path.join(self.directory, f"{self.prefix}_runs", stamp)
+        os.makedirs(archive, exist_ok=True)
+        for path in stale:
+            shutil.move(path, os.path.join(archive, os.path.basename(path)))
+        logging.info(f"Moved {len(stale)} files of the previous run to {archive}")
+        return archive
+
+    def _ranked(self):
+        return sorted(self.entries, key=lambda e: e["metric"], reverse=(self.mode == "max"))
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        best = self.best()
+        with open(tmp_path, "w") as f:
+            json.dump({"checkpoints": self.entries, "best": best and os.path.basename(best),
+                       "latest": self.latest() and os.path.basename(self.latest())}, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def save(self, state, epoch, metric):
+        """Writes `state` for `epoch` atomically, then applies retention; returns the checkpoint path."""
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{self.prefix}_epoch{epoch + 1:04d}.ckpt"
+        atomic_torch_save(state, os.path.join(self.directory, name))
+        self.entries = [e for e in self.entries if e["file"] != name] + [{"file": name, "epoch": epoch, "metric": metric}]
+
+        keep = {e["file"] for e in self.entries[-self.keep_last:]} if self.keep_last else set()
+        keep |= {e["file"] for e in self._ranked()[:self.keep_best]} | {name}
+        for entry in [e for e in self.entries if e["file"] not in keep]:
+            os.remove(os.path.join(self.directory, entry["file"]))
+            logging.info(f"Removed old checkpoint {entry['file']}")
+        self.entries = [e for e in self.entries if e["file"] in keep]
+        self._write_index()
+        return os.path.join(self.directory, name)
+
+    def latest(self):
+        return os.path.join(self.directory, self.entries[-1]["file"]) if self.entries else None
+
+    def best(self):
+        ranked = self._ranked()
+        return os.path.join(self.directory, ranked[0]["file"]) if ranked else None
+
+
+def resolve_checkpoint(checkpoint, model_dir, model_type="unet"):
+    """'latest' (newest of the last epoch checkpoint and the final weights), 'best', or a path as given."""
+    manager = CheckpointManager(model_dir, prefix=model_type)
+    if checkpoint == "best":
+        return manager.best()
+    if checkpoint == "latest":
+        candidates = [manager.latest(), os.path.join(model_dir, f"{model_type}_final_cloud_segmentation.pth")]
+        candidates = [path for path in candidates if path and os.path.isfile(path)]
+        return max(candidates, key=os.path.getmtime) if candidates else None
+    return checkpoint
@@ -18,8 +18,72 @@ DATA_SOURCES = {
 }
 RAW_DATA_DIR = "data/raw"  # Base directory for raw downloaded data
 # Example: data/raw/isro_insat/, data/raw/nasa_goes/, etc.
+# Bulk downloader (see downloader.py): concurrent transfers overall and per host, retries per file (with backoff)
+DOWNLOAD_CONCURRENCY = 16
+DOWNLOAD_PER_HOST = 8
+DOWNLOAD_RETRIES = 6
 PROCESSED_DATA_DIR = "data/processed"
+PATCH_STORE_DIR = "data/processed/patch_store"  # Sharded, memory-mapped patch store (see patch_store.py)
+PATCH_SHARD_SIZE = 4096  # Samples per shard file in the patch store
+REPROJECTION_CACHE_DIR = "data/processed/reprojection_cache"  # Cached source->target lookup tables (see reprojection.py)
+NORMALIZER_PATH = "data/processed/normalizer.json"  # Dataset-wide normalization statistics (see normalization.py)
+PREPROCESS_WORKERS = None  # Preprocessing worker processes; None = all cores
+# Max in-flight preprocessing tasks per source, so heavy granules cannot starve the half-hourly INSAT queue
+PREPROCESS_SOURCE_LIMITS = {"nasa_modis": 2, "esa_sentinel": 2}
+# Parameters of every preprocessing stage. They are hashed into the preprocessing manifest, so changing a value
+# here makes the next incremental run reprocess the affected files. "bands" and "calibrate" are per source.
+PREPROCESS_STAGES = {
+    "bands": {
+        "isro_insat": ["TIR1", "VIS"],
+        "nasa_goes": ["C13"],
+        "nasa_modis": ["EV_1KM_Emissive"],
+        "esa_sentinel": ["S8_BT_in"],
+    },
+    # Per source and band; see calibration.py for the spec keys. INSAT L1B files carry count->TEMP/ALBEDO tables;
+    # a file missing a configured table is refused, not calibrated from scale/offset.
+    "calibrate": {
+        "isro_insat": {
+            "TIR1": {"quantity": "brightness_temperature", "lut_band": "TIR1_TEMP"},
+            "VIS": {"quantity": "reflectance", "lut_band": "VIS_ALBEDO"},
+        },
+        "nasa_goes": {"C13": {"quantity": "brightness_temperature", "wavenumber": 968.0}},
+        "nasa_modis": {"EV_1KM_Emissive": {"quantity": "radiance", "scale_attr": "radiance_scales",
+                                           "offset_attr": "radiance_offsets", "offset_first": True, "band_index": 10}},
+        "esa_sentinel": {"S8_BT_in": {"quantity": "brightness_temperature"}},
+    },
+    # target_bounds = (south, north, west, east); None covers each sensor's footprint. method: "nearest" or "bilinear"
+    "reproject": {"target_crs": "EPSG:4326", "target_resolution": None, "target_bounds": None, "method": "nearest"},
+    # Cold-cloud clusters: calibrated IR band below bt_threshold (K), connected (4/8), at least min_area pixels
+    "labels": {"method": "threshold_based", "band": "TIR1", "bt_threshold": 240.0, "min_area": 25, "connectivity": 8},
+    # method: "min_max", "quantile" (robust, clipped to the quantiles) or "z_score", fitted over the whole archive
+    "normalize": {"method": "min_max", "feature_range": [0, 1], "quantiles": [0.01, 0.99]},
+    "patches": {"patch_size": [256, 256], "overlap": 0.0, "pad_mode": "constant", "min_label_coverage": 0.0},
+}
 MODEL_DIR = "models"
+# Full-scene tiled inference (see inference.py): tile size (multiple of 16), blended overlap, tiles per batch,
+# torch CPU threads (None = torch default)
+INFERENCE_TILE_SIZE = 256
+INFERENCE_OVERLAP = 32
+INFERENCE_BATCH_SIZE = 8
+INFERENCE_THREADS = None
+# Live ingest service (see ingest.py): cluster products directory, seconds a new raw file must stay unchanged before
+# it is picked up, length of the bounded queues between pipeline stages, and source priority (lower runs first)
+INGEST_OUTPUT_DIR = "data/products"
+INGEST_SETTLE_SECONDS = 5.0
+INGEST_QUEUE_SIZE = 4
+INGEST_SOURCE_PRIORITY = {"isro_insat": 0}
+# Real-time multi-model serving (see realtime.py): frames per micro-batch, and the longest a frame may wait
+# for its batch to fill before it is run anyway
+REALTIME_MAX_BATCH = 8
+REALTIME_MAX_LATENCY_MS = 50.0
+# Temporal model input (see temporal.py): frames per ConvLSTM sequence and the nominal time between frames
+# (half-hourly INSAT scans); frames are filed into slots of this width, and empty slots count as gaps
+CONVLSTM_SEQUENCE_LENGTH = 10
+FRAME_INTERVAL_SECONDS = 1800
+# Cluster tracking (see tracking.py): furthest a cluster centroid may be from its track's predicted position
+# (pixels per frame interval) when the clusters do not overlap, and frames a track may go unmatched before it ends
+TRACK_MAX_DISTANCE = 20.0
+TRACK_MAX_MISSED = 2
 # TODO: Add API keys or credentials if required, ideally via environment variables or a secure config
 # Example: NASA_EARTHDATA_LOGIN_USER = "your_username"
 # NASA_EARTHDATA_LOGIN_PASSWORD = "your_password"
@@ -0,0 +1,111 @@
+import os
+import time
+import itertools
+import logging
+import torch
+from torch.utils.data import DataLoader
+
+# DataLoader configuration picked by measurement, and per-step accounting of where training time goes.
+#
+# probe_loader_config() builds a short-lived loader for every candidate (num_workers, prefetch_factor,
+# batch_size), discards the first batches (worker start-up), times the next few and returns the fastest
+# in samples/sec. make_loader() then builds the real loader with persistent workers and prefetching, so
+# workers are started once per run rather than once per epoch. StepTimer splits each step into time spent
+# waiting for the loader and time spent computing on the batch.
+
+
+def worker_candidates(max_workers=None):
+    """0 (load in the training process), then powers of two up to the usable CPU count."""
+    if max_workers is None:
+        max_workers = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    candidates, n = [0], 1
+    while n <= max_workers:
+        candidates.append(n)
+        n *= 2
+    return candidates
+
+
+def make_loader(dataset, batch_size, num_workers=0, prefetch_factor=2, shuffle=False, collate_fn=None,
+                worker_init_fn=None, generator=None, pin_memory=None, persistent_workers=True, drop_last=False, sampler=None):
+    """
+    DataLoader with persistent, prefetching workers when num_workers > 0; pinned memory only with CUDA.
+    A `sampler` (e.g. DistributedSampler) replaces `shuffle`.
+    """
+    kwargs = {}
+    if num_workers > 0:
+        kwargs = {"prefetch_factor": prefetch_factor, "persistent_workers": persistent_workers,
+                  "worker_init_fn": worker_init_fn}
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle and sampler is None, sampler=sampler, num_workers=num_workers, collate_fn=collate_fn,
+                      pin_memory=torch.cuda.is_available() if pin_memory is None else pin_memory,
+                      generator=generator, drop_last=drop_last, **kwargs)
+
+
+def measure_throughput(loader, n_batches=8, warmup_batches=2):
+    """Steady-state samples/sec over n_batches after warmup_batches; also returns the start-up time."""
+    warmup_batches = min(warmup_batches, len(loader) - 1)  # Small datasets: keep at least one timed batch
+    start = time.perf_counter()
+    iterator = iter(loader)
+    for _ in range(warmup_batches):
+        next(iterator, None)
+    startup = time.perf_counter() - start
+
+    timed_start = time.perf_counter()
+    samples = sum(len(batch[0]) for batch in itertools.islice(iterator, n_batches))
+    elapsed = time.perf_counter() - timed_start
+    del iterator  # Shut the probe's workers down
+    return (samples / elapsed if samples else 0.0), startup
+
+
+def probe_loader_config(dataset, batch_sizes, worker_options=None, prefetch_options=(2, 4), n_batches=8,
+                        warmup_batches=2, **loader_kwargs):
+    """
+    Times every (num_workers, prefetch_factor, batch_size) combination on `dataset` and returns the fastest as
+    {"num_workers", "prefetch_factor", "batch_size", "samples_per_sec"}. Batch sizes only change loading cost
+    here; pass a single one unless the caller is free to change the training batch size.
+    """
+    worker_options = worker_options or worker_candidates()
+    best = None
+    for batch_size, num_workers in itertools.product(batch_sizes, worker_options):
+        for prefetch_factor in (prefetch_options if num_workers > 0 else (None,)):
+            loader = make_loader(dataset, batch_size, num_workers, prefetch_factor or 2, shuffle=True,
+                                 persistent_workers=False, **loader_kwargs)
+            rate, startup = measure_throughput(loader, n_batches, warmup_batches)
+            logging.info(f"Loader probe: batch {batch_size}, workers {num_workers}, prefetch {prefetch_factor}: "
+                         f"{rate:.1f} samples/sec (start-up {startup:.2f} s)")
+            if best is None or rate > best["samples_per_sec"]:
+                best = {"num_workers": num_workers, "prefetch_factor": prefetch_factor or 2,
+                        "batch_size": batch_size, "samples_per_sec": rate}
+    logging.info(f"Selected loader config: {best}")
+    return best
+
+
+class StepTimer:
+    """Accumulates time blocked on the loader (data) vs. time between batches (compute) while iterating."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.data_seconds = 0.0
+        self.compute_seconds = 0.0
+        self.steps = 0
+
+    def wrap(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            ready = time.perf_counter()
+            self.data_seconds += ready - start
+            yield batch
+            self.compute_seconds += time.perf_counter() - ready
+            self.steps += 1
+
+    def summary(self):
+        total = self.data_seconds + self.compute_seconds
+        share = 100 * self.data_seconds / total if total else 0.0
+        return (f"Data wait: {self.data_seconds:.2f} s ({share:.0f}%), compute: {self.compute_seconds:.2f} s "
+                f"over {self.steps} steps ({1000 * self.data_seconds / max(self.steps, 1):.0f} ms wait/step)")
@@ -0,0 +1,153 @@
+import os
+import socket
+import logging
+import contextlib
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import Sampler
+
+# Data-parallel training on CPU nodes with torch.distributed (gloo).
+#
+# Every process holds a full model replica (wrapped in DistributedDataParallel, which averages gradients
+# during backward) and trains on its own shard of the dataset (DistributedSampler). Rank and world size come
+# from the usual environment variables, so the same entry point works under torchrun on several nodes:
+#
+#   torchrun --nnodes 4 --nproc_per_node 1 --rdzv_backend c10d --rdzv_endpoint node0:29500 train.py --distributed ...
+#
+# or on one machine with launch_local(), which spawns N processes talking over 127.0.0.1 (train.py --nproc N).
+# Only rank 0 logs at INFO and writes checkpoints; metric sums are all-reduced so every rank sees the global
+# values. Without a process group all helpers fall back to single-process behaviour.
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def configure_rank_logging(rank, world_size):
+    """Prefix log records with the rank; ranks other than 0 only report warnings and errors."""
+    formatter = logging.Formatter(f"%(asctime)s - %(levelname)s - [rank {rank}/{world_size}] %(message)s")
+    root = logging.getLogger()
+    for handler in root.handlers:
+        handler.setFormatter(formatter)
+    if rank != 0:
+        root.setLevel(logging.WARNING)
+
+
+def init_distributed(backend="gloo"):
+    """
+    Joins the process group described by RANK/WORLD_SIZE/MASTER_ADDR/MASTER_PORT (set by torchrun or
+    launch_local) and returns (rank, world_size). Splits the machine's cores between its local processes.
+    """
+    if is_distributed():
+        return get_rank(), get_world_size()
+    if int(os.environ.get("WORLD_SIZE", "1")) <= 1:
+        return 0, 1
+    dist.init_process_group(backend=backend)
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", "1"))
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    torch.set_num_threads(max(1, cpus // local_world_size))  # Avoid oversubscribing shared cores
+    configure_rank_logging(rank, world_size)
+    logging.info(f"Joined process group: {world_size} processes, backend {backend}, {torch.get_num_threads()} threads each")
+    return rank, world_size
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+@contextlib.contextmanager
+def main_process_first():
+    """Run the block on rank 0 before the other ranks (e.g. when it creates files the others read)."""
+    if not is_main_process():
+        barrier()
+    try:
+        yield
+    finally:
+        if is_main_process():
+            barrier()
+
+
+def all_reduce_sum(values):
+    """Sums a list of numbers (or a float64 tensor) over all ranks; returns a float64 tensor."""
+    tensor = torch.as_tensor(values, dtype=torch.float64)
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def broadcast_object(obj, src=0):
+    """`obj` from rank `src` on every rank (e.g. a loader configuration picked by one rank)."""
+    if not is_distributed():
+        return obj
+    holder = [obj]
+    dist.broadcast_object_list(holder, src=src)
+    return holder[0]
+
+
+def gather_object(obj, dst=0):
+    """[obj of rank 0, obj of rank 1, ...] on rank `dst` (None on the others); [obj] without a process group."""
+    if not is_distributed():
+        return [obj]
+    gathered = [None] * get_world_size() if get_rank() == dst else None
+    dist.gather_object(obj, gathered, dst=dst)
+    return gathered
+
+
+class ShardSampler(Sampler):
+    """
+    Deterministic, non-padding evaluation sampler: rank r gets indices r, r + world, ... Unlike
+    DistributedSampler(shuffle=False) no sample is duplicated, so summed metrics count every sample once.
+    """
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        self.num_replicas = get_world_size() if num_replicas is None else num_replicas
+        self.rank = get_rank() if rank is None else rank
+        self.indices = list(range(self.rank, len(dataset), self.num_replicas))
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _local_worker(local_rank, nprocs, port, fn, kwargs):
+    os.environ.update({"MASTER_ADDR": "127.0.0.1", "MASTER_PORT": str(port), "RANK": str(local_rank),
+                       "LOCAL_RANK": str(local_rank), "WORLD_SIZE": str(nprocs), "LOCAL_WORLD_SIZE": str(nprocs)})
+    try:
+        fn(**kwargs)
+    finally:
+        cleanup_distributed()
+
+
+def launch_local(fn, nprocs, **kwargs):
+    """Runs fn(**kwargs) in `nprocs` local processes forming one process group over 127.0.0.1."""
+    if nprocs <= 1:
+        return fn(**kwargs)
+    mp.spawn(_local_worker, args=(nprocs, free_port(), fn, kwargs), nprocs=nprocs, join=True)
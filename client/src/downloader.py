@@ -0,0 +1,565 @@
+import os
+import io
+import json
+import zlib
+import random
+import struct
+import asyncio
+import hashlib
+import zipfile
+import argparse
+import time
+from collections import namedtuple
+
+try:
+    from config import RAW_DATA_DIR, DOWNLOAD_CONCURRENCY, DOWNLOAD_PER_HOST, DOWNLOAD_RETRIES
+except ImportError:
+    print("Warning: config.py not found, using placeholder download settings.")
+    RAW_DATA_DIR = "data/raw_placeholder"
+    DOWNLOAD_CONCURRENCY = 16
+    DOWNLOAD_PER_HOST = 8
+    DOWNLOAD_RETRIES = 6
+
+# Bulk scene downloader (asyncio + aiohttp).
+#
+# All transfers share one aiohttp session, so TCP/TLS connections to the archive are pooled and reused;
+# a semaphore and the connector limits bound how many files are in flight overall and per host. Every
+# file is streamed into <name>.part, hashed as it arrives and, for zip archives, unpacked member by member
+# from the same stream (StreamingZipExtractor) instead of in a second pass. If a transfer breaks, the next
+# attempt asks for the rest with an HTTP Range request and replays the bytes already on disk through the
+# hash and the extractor. Failed attempts back off exponentially with full jitter (honouring Retry-After),
+# so hundreds of clients catching up after an outage don't retry in lockstep. Only a complete, verified
+# file is renamed to its final name; existing files that match their checksum are skipped. An extracted
+# archive also leaves a <name>.complete sidecar (size, sha256, members), so it is still skipped on the next
+# run after the archive itself has been deleted, as long as its members are in place.
+
+DownloadTask = namedtuple("DownloadTask", ["url", "filename", "sha256", "size", "extract_to"],
+                          defaults=(None, None, None, None))
+DownloadResult = namedtuple("DownloadResult", ["url", "path", "ok", "bytes", "attempts", "resumed_from", "skipped",
+                                               "extracted", "error", "elapsed"])
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+_CHUNK = 1024 * 1024
+
+_LOCAL_HEADER = 0x04034b50
+_DATA_DESCRIPTOR = 0x08074b50
+_END_SIGNATURES = {0x02014b50, 0x06054b50, 0x06064b50, 0x07064b50}  # Central directory / end records
+
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class StreamingUnsupported(Exception):
+    """The archive needs random access (stored member of unknown size); extract after the download instead."""
+
+
+class StreamingZipExtractor:
+    """
+    Unpacks a zip archive from a byte stream: feed() it chunks as they arrive, close() at the end. Members are
+    read from their local headers (stored or deflated, with or without data descriptors, zip64 sizes) and
+    CRC-checked; the central directory at the end is not needed.
+    """
+
+    def __init__(self, extract_to):
+        self.extract_to = os.path.abspath(extract_to)
+        self.members = []
+        self.done = False
+        self._buffer = bytearray()
+        self._state = "header"
+        self._member = None
+
+    def _target(self, name):
+        path = os.path.normpath(os.path.join(self.extract_to, name))
+        if not path.startswith(self.extract_to + os.sep):
+            raise zipfile.BadZipFile(f"Refusing to extract {name!r} outside {self.extract_to}")
+        return path
+
+    def feed(self, data):
+        if self.done:
+            return
+        self._buffer += data
+        while self._step():
+            pass
+
+    def close(self):
+        if not self.done and (self._state != "header" or self._buffer):
+            raise zipfile.BadZipFile("Archive stream ended in the middle of a member")
+        return self.members
+
+    def _step(self):
+        buffer = self._buffer
+        if self._state == "header":
+            if len(buffer) < 4:
+                return False
+            signature = struct.unpack_from("<I", buffer)[0]
+            if signature in _END_SIGNATURES:
+                self.done = True
+                buffer.clear()
+                return False
+            if signature != _LOCAL_HEADER:
+                raise zipfile.BadZipFile(f"Unexpected zip record signature {signature:#x}")
+            if len(buffer) < 30:
+                return False
+            _, _, flags, method, _, _, crc, compressed, size, name_len, extra_len = struct.unpack_from("<IHHHHHIIIHH", buffer)
+            if len(buffer) < 30 + name_len + extra_len:
+                return False
+            name = bytes(buffer[30:30 + name_len]).decode("utf-8" if flags & 0x800 else "cp437")
+            extra = bytes(buffer[30 + name_len:30 + name_len + extra_len])
+            del buffer[:30 + name_len + extra_len]
+
+            zip64 = False
+            position = 0
+            while position + 4 <= len(extra):  # zip64 extra field: 8-byte sizes replacing 0xFFFFFFFF
+                field_id, field_len = struct.unpack_from("<HH", extra, position)
+                if field_id == 0x0001:
+                    zip64 = True
+                    values = iter(struct.unpack_from(f"<{field_len // 8}Q", extra, position + 4))
+                    size = next(values) if size == 0xFFFFFFFF else size
+                    compressed = next(values) if compressed == 0xFFFFFFFF else compressed
+                position += 4 + field_len
+
+            if flags & 0x1:
+                raise zipfile.BadZipFile(f"Encrypted member {name!r} is not supported")
+            if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                raise zipfile.BadZipFile(f"Member {name!r} uses unsupported compression method {method}")
+            has_descriptor = bool(flags & 0x8)
+            if has_descriptor and method == zipfile.ZIP_STORED:
+                raise StreamingUnsupported(f"Stored member {name!r} has no size in its local header")
+
+            path = self._target(name)
+            if name.endswith("/"):
+                os.makedirs(path, exist_ok=True)
+                self.members.append(name)
+                return True
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._member = {"name": name, "file": open(path, "wb"), "crc": crc, "size": size, "zip64": zip64,
+                            "remaining": None if has_descriptor else compressed, "has_descriptor": has_descriptor,
+                            "inflate": zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None,
+                            "actual_crc": 0, "actual_size": 0}
+            self._state = "data"
+            return True
+
+        member = self._member
+        if self._state == "data":
+            if member["remaining"] is not None:
+                take = min(len(buffer), member["remaining"])
+                chunk = bytes(buffer[:take])
+                del buffer[:take]
+                member["remaining"] -= take
+                self._write(member["inflate"].decompress(chunk) if member["inflate"] else chunk)
+                if member["remaining"] == 0:
+                    self._state = "descriptor" if member["has_descriptor"] else "finish"
+                    return True
+                return take > 0
+            # Deflated member of unknown length: the deflate stream itself marks the end
+            chunk = bytes(buffer)
+            buffer.clear()
+            self._write(member["inflate"].decompress(chunk))
+            if member["inflate"].eof:
+                buffer[:0] = member["inflate"].unused_data
+                self._state = "descriptor"
+                return True
+            return False
+
+        if self._state == "descriptor":
+            size_format = "<IQQ" if member["zip64"] else "<III"
+            needed = struct.calcsize(size_format)
+            if len(buffer) < 4:
+                return False
+            offset = 4 if struct.unpack_from("<I", buffer)[0] == _DATA_DESCRIPTOR else 0
+            if len(buffer) < offset + needed:
+                return False
+            member["crc"], _, member["size"] = struct.unpack_from(size_format, buffer, offset)
+            del buffer[:offset + needed]
+            self._state = "finish"
+            return True
+
+        # finish
+        if member["inflate"] is not None:
+            self._write(member["inflate"].flush())
+        member["file"].close()
+        if member["actual_crc"] != member["crc"] or member["actual_size"] != member["size"]:
+            raise zipfile.BadZipFile(f"CRC or size mismatch in member {member['name']!r}")
+        self.members.append(member["name"])
+        self._member = None
+        self._state = "header"
+        return True
+
+    def _write(self, data):
+        if data:
+            self._member["file"].write(data)
+            self._member["actual_crc"] = zlib.crc32(data, self._member["actual_crc"])
+            self._member["actual_size"] += len(data)
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """Full jitter: uniform in [0, min(max_delay, base_delay * 2**attempt)]."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4 * _CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _replay_prefix(path, digest, extractor):
+    """Feeds the bytes of a partial download through the hash (and extractor) before resuming it."""
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4 * _CHUNK), b""):
+            digest.update(chunk)
+            if extractor is not None:
+                extractor.feed(chunk)
+
+
+def _parse_retry_after(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:  # HTTP-date form; fall back to our own backoff
+        return None
+
+
+def _read_marker(path):
+    try:
+        with open(path + ".complete") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_marker(task, path, size, sha256, extracted):
+    tmp_path = path + ".complete.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"url": task.url, "size": size, "sha256": sha256, "extracted": extracted}, f)
+    os.replace(tmp_path, path + ".complete")
+
+
+def _is_complete(task, path):
+    if os.path.isfile(path):
+        if task.sha256:
+            return sha256_of(path) == task.sha256.lower()
+        return task.size is None or os.path.getsize(path) == task.size
+    marker = _read_marker(path) if task.extract_to else None  # Archive deleted after a finished extraction
+    if marker is None:
+        return False
+    if task.sha256:  # A checksum identifies the archive wherever it is served from; otherwise the URL must match
+        if marker["sha256"] != task.sha256.lower():
+            return False
+    elif marker["url"] != task.url:
+        return False
+    if task.size is not None and marker["size"] != task.size:
+        return False
+    return all(os.path.exists(os.path.join(task.extract_to, name)) for name in marker["extracted"])
+
+
+async def _attempt(session, task, path, chunk_size):
+    """One transfer attempt; returns (bytes on disk, resumed-from offset, extracted members, sha256)."""
+    part_path = path + ".part"
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    digest = hashlib.sha256()
+    extractor = StreamingZipExtractor(task.extract_to) if task.extract_to else None
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    async with session.get(task.url, headers=headers) as response:
+        if response.status == 416 and offset:  # Partial file no longer matches the remote one
+            os.remove(part_path)
+            raise RetryableError("Range not satisfiable; restarting from scratch")
+        if response.status in RETRYABLE_STATUS:
+            raise RetryableError(f"HTTP {response.status}", _parse_retry_after(response.headers.get("Retry-After")))
+        if response.status not in (200, 206):
+            raise RuntimeError(f"HTTP {response.status} for {task.url}")
+
+        total = response.content_length
+        if response.status == 206:
+            unit_range, _, full_size = response.headers.get("Content-Range", "").partition("/")
+            start = int(unit_range.split()[-1].split("-")[0]) if unit_range else -1
+            if start != offset:
+                os.remove(part_path)
+                raise RetryableError(f"Server resumed at byte {start}, expected {offset}; restarting")
+            total = int(full_size) if full_size.isdigit() else None
+            try:
+                await asyncio.to_thread(_replay_prefix, part_path, digest, extractor)
+            except StreamingUnsupported:
+                extractor = None
+            mode = "ab"
+        else:
+            offset, mode = 0, "wb"  # Server ignored the Range header (or there was nothing to resume)
+
+        with open(part_path, mode) as f:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                f.write(chunk)
+                digest.update(chunk)
+                if extractor is not None:
+                    try:
+                        extractor.feed(chunk)
+                    except StreamingUnsupported:
+                        extractor = None
+
+    size = os.path.getsize(part_path)
+    if total is not None and size < total:
+        raise RetryableError(f"Transfer ended at {size} of {total} bytes")
+    if (task.size is not None and size != task.size) or (task.sha256 and digest.hexdigest() != task.sha256.lower()):
+        os.remove(part_path)
+        raise RetryableError(f"Checksum/size mismatch for {os.path.basename(path)}; downloading again")
+
+    if task.extract_to and extractor is None:  # Archive could not be streamed: extract the finished file
+        with zipfile.ZipFile(part_path) as archive:
+            archive.extractall(task.extract_to)
+            extracted = archive.namelist()
+    else:
+        extracted = extractor.close() if extractor is not None else []
+    os.replace(part_path, path)
+    return size, offset, extracted, digest.hexdigest()
+
+
+async def fetch(session, task, dest_dir, retries=DOWNLOAD_RETRIES, chunk_size=_CHUNK, base_delay=1.0, max_delay=60.0,
+                keep_archive=True):
+    """Downloads one task with retries; never raises, returns a DownloadResult."""
+    import aiohttp
+
+    start = time.perf_counter()
+    filename = task.filename or os.path.basename(task.url.split("?")[0]) or "download"
+    path = os.path.join(dest_dir, filename)
+    if await asyncio.to_thread(_is_complete, task, path):  # Only finished, verified (and extracted) files get this name
+        size = os.path.getsize(path) if os.path.isfile(path) else _read_marker(path)["size"]
+        return DownloadResult(task.url, path, True, size, 0, 0, True, [], None, time.perf_counter() - start)
+
+    error = None
+    for attempt in range(retries + 1):
+        try:
+            size, resumed_from, extracted, sha256 = await _attempt(session, task, path, chunk_size)
+            if task.extract_to:
+                _write_marker(task, path, size, sha256, extracted)
+                if not keep_archive:
+                    os.remove(path)
+            return DownloadResult(task.url, path, True, size, attempt + 1, resumed_from, False, extracted, None,
+                                  time.perf_counter() - start)
+        except (RetryableError, aiohttp.ClientError, asyncio.TimeoutError, zipfile.BadZipFile) as e:
+            error = f"{type(e).__name__}: {e}"
+            if isinstance(e, zipfile.BadZipFile) and os.path.isfile(path + ".part"):
+                os.remove(path + ".part")  # Corrupt bytes on disk: resuming would replay them again
+            if attempt < retries:
+                await asyncio.sleep(max(backoff_delay(attempt, base_delay, max_delay), getattr(e, "retry_after", None) or 0))
+        except Exception as e:  # Not worth retrying (404, permissions, ...)
+            error = f"{type(e).__name__}: {e}"
+            break
+    return DownloadResult(task.url, path, False, 0, attempt + 1, 0, False, [], error, time.perf_counter() - start)
+
+
+def print_progress(done, total, result):
+    if result.skipped:
+        status = "already complete"
+    elif result.ok:
+        status = (f"ok, {result.bytes / 1e6:.1f} MB in {result.elapsed:.1f}s, {result.attempts} attempt(s)"
+                  + (f", resumed at {result.resumed_from}" if result.resumed_from else "")
+                  + (f", {len(result.extracted)} members extracted" if result.extracted else ""))
+    else:
+        status = f"FAILED after {result.attempts} attempt(s): {result.error}"
+    print(f"[{done}/{total}] {os.path.basename(result.path)} - {status}")
+
+
+async def download_many(tasks, dest_dir=RAW_DATA_DIR, concurrency=DOWNLOAD_CONCURRENCY, per_host=DOWNLOAD_PER_HOST,
+                        retries=DOWNLOAD_RETRIES, headers=None, progress=print_progress, **fetch_kwargs):
+    """Downloads every DownloadTask over one pooled session; returns DownloadResults in task order."""
+    import aiohttp
+
+    os.makedirs(dest_dir, exist_ok=True)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+    # Byte ranges must refer to the stored file, not a compressed transfer encoding of it
+    session_headers = {"Accept-Encoding": "identity", **(headers or {})}
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=session_headers,
+                                     auto_decompress=False) as session:
+        async def run(task):
+            nonlocal done
+            async with semaphore:
+                result = await fetch(session, task, dest_dir, retries, **fetch_kwargs)
+            done += 1
+            if progress is not None:
+                progress(done, len(tasks), result)
+            return result
+
+        return await asyncio.gather(*(run(task) for task in tasks))
+
+
+def download_all(tasks, dest_dir=RAW_DATA_DIR, **kwargs):
+    """Blocking wrapper around download_many()."""
+    return asyncio.run(download_many(tasks, dest_dir, **kwargs))
+
+
+def auto_download_ir_images(base_url, dest_folder, max_retries=5):
+    """
+    Downloads a zip of IR images and unpacks it into dest_folder (the archive itself is removed; its .complete
+    sidecar makes later calls skip it while the extracted images are there).
+    """
+    result = download_all([DownloadTask(base_url, extract_to=dest_folder)], dest_folder, retries=max_retries,
+                          keep_archive=False)[0]
+    print("Download and extraction successful." if result.ok else f"All attempts to download the file failed: {result.error}")
+    return result
+
+
+def read_task_list(path, extract_to=None):
+    """One 'url [sha256]' per line ('#' comments allowed); zip archives are extracted to extract_to if given."""
+    tasks = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split("#")[0].split()
+            if fields:
+                is_zip = fields[0].split("?")[0].lower().endswith(".zip")
+                tasks.append(DownloadTask(fields[0], sha256=fields[1] if len(fields) > 1 else None,
+                                          extract_to=extract_to if is_zip else None))
+    return tasks
+
+
+# --- Local stand-in archive server for the self-test ---
+
+async def start_test_server(files, faults):
+    """
+    Serves `files` {name: bytes} on 127.0.0.1 with Range support. `faults` {name: [fault, ...]} are consumed one
+    per request: "503" (with Retry-After: 0), "cut" (connection dropped a third of the way in) or "corrupt".
+    Returns (runner, base_url, request_log).
+    """
+    from aiohttp import web
+
+    request_log = []
+
+    async def handler(request):
+        name = request.match_info["name"]
+        if name not in files:
+            return web.Response(status=404)
+        data = files[name]
+        fault = faults.get(name, []).pop(0) if faults.get(name) else None
+        request_log.append((name, request.headers.get("Range"), fault))
+        if fault == "503":
+            return web.Response(status=503, headers={"Retry-After": "0"})
+
+        start = int(request.headers["Range"][6:].split("-")[0]) if request.headers.get("Range") else 0
+        body = data[start:]
+        if fault == "corrupt":
+            body = body[:len(body) // 2] + bytes([body[len(body) // 2] ^ 0xFF]) + body[len(body) // 2 + 1:]
+        response_headers = {"Content-Length": str(len(body)), "Accept-Ranges": "bytes"}
+        if start:
+            response_headers["Content-Range"] = f"bytes {start}-{len(data) - 1}/{len(data)}"
+        response = web.StreamResponse(status=206 if start else 200, headers=response_headers)
+        await response.prepare(request)
+        if fault == "cut":
+            await response.write(body[:len(body) // 3])
+            request.transport.close()
+            return response
+        for first in range(0, len(body), 256 * 1024):
+            await response.write(body[first:first + 256 * 1024])
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/{name}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", request_log
+
+
+class _NonSeekable(io.RawIOBase):
+    """Write-only stream without seek(), so zipfile emits data descriptors (as streaming archivers do)."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+
+def _test_archive(members, streamed):
+    if streamed:
+        sink = _NonSeekable()
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, data in members.items():
+                archive.writestr(name, data)
+        return bytes(sink.buffer)
+    sink = io.BytesIO()
+    with zipfile.ZipFile(sink, "w") as archive:
+        for i, (name, data) in enumerate(members.items()):
+            archive.writestr(name, data, compress_type=zipfile.ZIP_STORED if i % 2 else zipfile.ZIP_DEFLATED)
+    return sink.getvalue()
+
+
+async def _self_test(dest_dir, n_files, concurrency):
+    rng = random.Random(0)
+    members = {f"IR/scene_{i:02d}.bin": bytes(rng.getrandbits(8) for _ in range(20000)) * 8 for i in range(4)}
+    files = {"scene_resume.h5": os.urandom(3 * _CHUNK),
+             "batch_plain.zip": _test_archive(members, streamed=False),
+             "batch_streamed.zip": _test_archive(members, streamed=True)}
+    files.update({f"granule_{i:03d}.nc": os.urandom(rng.randint(50_000, 400_000)) for i in range(n_files)})
+    faults = {"scene_resume.h5": ["cut", "cut"], "batch_plain.zip": ["503", "cut"], "batch_streamed.zip": ["corrupt"]}
+    for i in range(n_files):  # A flaky archive: some granules fail once or twice
+        faults[f"granule_{i:03d}.nc"] = rng.choice([[], [], ["503"], ["cut"], ["503", "cut"]])
+
+    runner, base_url, request_log = await start_test_server(files, faults)
+    try:
+        tasks = [DownloadTask(f"{base_url}/{name}", sha256=hashlib.sha256(data).hexdigest(),
+                              extract_to=os.path.join(dest_dir, os.path.splitext(name)[0]) if name.endswith(".zip") else None)
+                 for name, data in files.items()]
+        start = time.perf_counter()
+        results = await download_many(tasks, dest_dir, concurrency=concurrency, per_host=concurrency, retries=4,
+                                      base_delay=0.05, max_delay=0.5, progress=None)
+        elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+
+    ok = all(r.ok for r in results)
+    files_ok = all(sha256_of(r.path) == t.sha256 for r, t in zip(results, tasks) if r.ok)
+    extracted_ok = all(open(os.path.join(dest_dir, archive, name), "rb").read() == data
+                       for archive in ("batch_plain", "batch_streamed") for name, data in members.items())
+    resumed = [os.path.basename(r.path) for r in results if r.resumed_from]
+    print(f"{len(results)} files, {sum(r.bytes for r in results) / 1e6:.1f} MB in {elapsed:.2f} s "
+          f"({len(request_log)} requests, concurrency {concurrency})")
+    print(f"All downloads succeeded: {ok}; checksums match: {files_ok}; extracted members match: {extracted_ok}")
+    print(f"Resumed with Range requests: {len(resumed)} files (e.g. {resumed[:3]})")
+    return ok and files_ok and extracted_ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent, resumable downloads of satellite scenes.")
+    parser.add_argument("--urls", type=str, default=None, help="Text file with one 'url [sha256]' per line")
+    parser.add_argument("--url", type=str, action="append", default=[], help="URL to download (repeatable)")
+    parser.add_argument("--dest", type=str, default=RAW_DATA_DIR, help="Destination directory")
+    parser.add_argument("--extract", action="store_true", help="Unpack .zip downloads into --dest while streaming")
+    parser.add_argument("--remove_archives", action="store_true", help="Delete zip files after extracting them")
+    parser.add_argument("--concurrency", type=int, default=DOWNLOAD_CONCURRENCY)
+    parser.add_argument("--per_host", type=int, default=DOWNLOAD_PER_HOST)
+    parser.add_argument("--retries", type=int, default=DOWNLOAD_RETRIES)
+    parser.add_argument("--self_test", action="store_true", help="Download from a local faulty stand-in server")
+    parser.add_argument("--self_test_files", type=int, default=40)
+    args = parser.parse_args()
+
+    if args.self_test:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            passed = asyncio.run(_self_test(tmp, args.self_test_files, args.concurrency))
+        raise SystemExit(0 if passed else 1)
+
+    extract_to = args.dest if args.extract else None
+    tasks = read_task_list(args.urls, extract_to) if args.urls else []
+    tasks += [DownloadTask(url, extract_to=extract_to if url.split("?")[0].lower().endswith(".zip") else None)
+              for url in args.url]
+    if not tasks:
+        parser.error("Nothing to download: pass --urls or --url (or --self_test)")
+    results = download_all(tasks, args.dest, concurrency=args.concurrency, per_host=args.per_host,
+                           retries=args.retries, keep_archive=not args.remove_archives)
+    failed = [r for r in results if not r.ok]
+    print(f"Downloaded {len(results) - len(failed)}/{len(results)} files into {args.dest}")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,212 @@
+import os
+import copy
+import json
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from inference import load_unet, configure_threads
+from checkpoints import resolve_checkpoint
+from manifest import sha256_file
+
+try:
+    from config import MODEL_DIR, INFERENCE_TILE_SIZE, INFERENCE_THREADS
+except ImportError:
+    print("Warning: config.py not found, using placeholder MODEL_DIR and inference settings.")
+    MODEL_DIR = "models_placeholder"
+    INFERENCE_TILE_SIZE = 256
+    INFERENCE_THREADS = None
+
+# Freezing trained UNet checkpoints for CPU inference nodes.
+#
+# export_model() folds every Conv+BatchNorm pair into a single convolution, then writes
+#   <name>.pt    - frozen TorchScript (no Python model code or eager dispatch needed to run it)
+#   <name>.onnx  - ONNX with dynamic batch/height/width, for onnxruntime
+#   <name>.json  - model metadata and the exported files
+#   <name>.parity.npz - a reference input and the eager model's output for it
+# into MODEL_DIR/export. load_runtime() times every backend that is installed and whose output matches the
+# stored eager reference within tolerance, and returns the fastest as a model-like callable that
+# inference.TiledInferenceEngine accepts. onnx/onnxruntime are optional.
+
+EXPORT_SUBDIR = "export"
+BACKENDS = ("onnxruntime", "torchscript", "eager")
+
+
+def fold_conv_bn(model):
+    """Eval-mode copy of `model` with each Conv2d directly followed by BatchNorm2d fused into one Conv2d."""
+    model = copy.deepcopy(model).eval()
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module) - 1):
+            if isinstance(module[i], nn.Conv2d) and isinstance(module[i + 1], nn.BatchNorm2d):
+                module[i] = fuse_conv_bn_eval(module[i], module[i + 1])
+                module[i + 1] = nn.Identity()
+    return model
+
+
+def _to_torchscript(model, example):
+    try:
+        scripted = torch.jit.script(model)
+    except Exception as e:  # Fall back to tracing; the output branch is fixed by n_classes anyway
+        print(f"Scripting failed ({type(e).__name__}), tracing instead.")
+        scripted = torch.jit.trace(model, example)
+    return torch.jit.freeze(scripted.eval())
+
+
+def export_model(checkpoint_path, out_dir=None, tile_size=INFERENCE_TILE_SIZE, formats=("torchscript", "onnx"), opset=17):
+    """Exports a train.py checkpoint; returns the path of the metadata JSON."""
+    out_dir = out_dir or os.path.join(MODEL_DIR, EXPORT_SUBDIR)
+    os.makedirs(out_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(checkpoint_path))[0]
+    base = os.path.join(out_dir, name)
+
+    eager = load_unet(checkpoint_path)
+    folded = fold_conv_bn(eager)
+    example = torch.rand(1, eager.n_channels, tile_size, tile_size, generator=torch.Generator().manual_seed(0))
+    with torch.inference_mode():
+        reference = eager(example)
+        folded_diff = (folded(example) - reference).abs().max().item()
+    print(f"Folded Conv+BN: max abs difference vs eager {folded_diff:.2e}")
+
+    meta = {"source": os.path.abspath(checkpoint_path), "source_sha256": sha256_file(checkpoint_path),
+            "n_channels": eager.n_channels, "n_classes": eager.n_classes, "tile_size": tile_size,
+            "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "files": {}}
+    np.savez(base + ".parity.npz", input=example.numpy(), output=reference.numpy())
+
+    if "torchscript" in formats:
+        path = base + ".pt"
+        _to_torchscript(folded, example).save(path)
+        meta["files"]["torchscript"] = os.path.basename(path)
+        print(f"Saved TorchScript: {path}")
+
+    if "onnx" in formats:
+        path = base + ".onnx"
+        try:
+            torch.onnx.export(folded, (example,), path, input_names=["image"], output_names=["output"],
+                              dynamic_axes={"image": {0: "batch", 2: "height", 3: "width"},
+                                            "output": {0: "batch", 2: "height", 3: "width"}},
+                              opset_version=opset, dynamo=False)
+            meta["files"]["onnx"] = os.path.basename(path)
+            print(f"Saved ONNX: {path}")
+        except ImportError as e:
+            print(f"Skipping ONNX export: {e}")
+
+    with open(base + ".json", "w") as f:
+        json.dump(meta, f, indent=1)
+    return base + ".json"
+
+
+# --- Runtime ---
+
+class CompiledModel:
+    """Model-like wrapper around an exported backend: float32 (N, C, H, W) tensor in, tensor out."""
+
+    def __init__(self, backend, fn, n_channels, n_classes):
+        self.backend = backend
+        self._fn = fn
+        self.n_channels = n_channels
+        self.n_classes = n_classes
+
+    def __call__(self, x):
+        return self._fn(x)
+
+    def to(self, device):
+        if torch.device(device).type != "cpu":
+            raise ValueError(f"Exported {self.backend} runtime only runs on CPU")
+        return self
+
+    def eval(self):
+        return self
+
+    def __repr__(self):
+        return f"CompiledModel({self.backend}, {self.n_channels}->{self.n_classes})"
+
+
+def _build_backend(backend, base, meta, num_threads):
+    files = meta["files"]
+    if backend == "onnxruntime":
+        if "onnx" not in files:
+            return None
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        session = ort.InferenceSession(os.path.join(os.path.dirname(base), files["onnx"]), options,
+                                       providers=["CPUExecutionProvider"])
+        return lambda x: torch.from_numpy(session.run(None, {"image": x.contiguous().numpy()})[0])
+    if backend == "torchscript":
+        if "torchscript" not in files:
+            return None
+        module = torch.jit.load(os.path.join(os.path.dirname(base), files["torchscript"]), map_location="cpu")
+        return module
+    if backend == "eager":
+        if not os.path.isfile(meta["source"]):
+            return None
+        return fold_conv_bn(load_unet(meta["source"]))
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+def load_runtime(export_json, backends=BACKENDS, tolerance=1e-4, repeats=3, num_threads=INFERENCE_THREADS):
+    """
+    Fastest backend among `backends` for an export, after checking each against the stored eager output
+    (max abs difference <= `tolerance`). Backends that are not installed, not exported or fail parity are skipped.
+    """
+    configure_threads(num_threads)
+    with open(export_json) as f:
+        meta = json.load(f)
+    base = os.path.splitext(export_json)[0]
+    parity = np.load(base + ".parity.npz")
+    example, reference = torch.from_numpy(parity["input"]), parity["output"]
+
+    best = None
+    for backend in backends:
+        try:
+            fn = _build_backend(backend, base, meta, num_threads)
+        except ImportError as e:
+            print(f"  {backend}: unavailable ({e})")
+            continue
+        if fn is None:
+            print(f"  {backend}: not exported")
+            continue
+        with torch.inference_mode():
+            diff = float(np.abs(fn(example).numpy() - reference).max())
+            if diff > tolerance:
+                print(f"  {backend}: rejected, max abs difference {diff:.2e} > {tolerance:.0e}")
+                continue
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn(example)
+                timings.append(time.perf_counter() - start)
+        latency = min(timings)
+        print(f"  {backend}: {latency * 1000:.1f} ms per tile, max abs difference {diff:.2e}")
+        if best is None or latency < best[0]:
+            best = (latency, backend, fn)
+
+    if best is None:
+        raise RuntimeError(f"No backend for {export_json} passed the parity check")
+    print(f"Selected {best[1]} runtime")
+    return CompiledModel(best[1], best[2], meta["n_channels"], meta["n_classes"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a trained UNet checkpoint to TorchScript and ONNX.")
+    parser.add_argument("--checkpoint", type=str, default="latest", help="'latest', 'best' or a checkpoint path")
+    parser.add_argument("--out_dir", type=str, default=None, help=f"Default: {os.path.join(MODEL_DIR, EXPORT_SUBDIR)}")
+    parser.add_argument("--tile_size", type=int, default=INFERENCE_TILE_SIZE, help="Reference input size for parity checks")
+    parser.add_argument("--formats", type=str, nargs="+", default=["torchscript", "onnx"], choices=["torchscript", "onnx"])
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Max abs difference accepted by the runtime check")
+    args = parser.parse_args()
+
+    checkpoint_path = resolve_checkpoint(args.checkpoint, MODEL_DIR)
+    if not checkpoint_path or not os.path.isfile(checkpoint_path):
+        raise SystemExit(f"No model to export ({args.checkpoint}) in {MODEL_DIR}. Train a model first.")
+    export_json = export_model(checkpoint_path, args.out_dir, args.tile_size, args.formats, args.opset)
+    print(f"Checking runtimes for {export_json}:")
+    load_runtime(export_json, tolerance=args.tolerance)
@@ -0,0 +1,192 @@
+import os
+import time
+import argparse
+import numpy as np
+import torch
+
+from models.unet import UNet
+
+try:
+    from config import INFERENCE_TILE_SIZE, INFERENCE_OVERLAP, INFERENCE_BATCH_SIZE, INFERENCE_THREADS
+except ImportError:
+    print("Warning: config.py not found, using placeholder inference settings.")
+    INFERENCE_TILE_SIZE = 256
+    INFERENCE_OVERLAP = 32
+    INFERENCE_BATCH_SIZE = 8
+    INFERENCE_THREADS = None
+
+# Full-scene inference for the segmentation UNet.
+#
+# A scene (C, H, W) is covered by overlapping tiles that are copied into one preallocated batch tensor
+# and run through the model batch_size tiles at a time. Each tile's output is weighted by a window that
+# is flat in the middle and falls off with a cosine ramp across the overlap, accumulated into a
+# preallocated (n_classes, H, W) buffer and finally divided by the (cached) sum of window weights, so
+# seams between tiles disappear. Buffers and weight maps are kept per scene shape and reused for every
+# frame of the same sensor grid.
+
+
+def configure_threads(num_threads=None, interop_threads=None):
+    """Intra-op (and optionally inter-op) CPU threads for torch; None leaves torch's default."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:  # Only settable before the first parallel op in the process
+            pass
+
+
+def blend_window(tile_size, overlap, floor=1e-3):
+    """(tile, tile) float32 weights: 1 in the middle, cosine ramp to `floor` over `overlap` pixels at each edge."""
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        x = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+        edge = np.maximum(0.5 - 0.5 * np.cos(np.pi * x), floor)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge[::-1]
+    return np.outer(ramp, ramp)
+
+
+def tile_starts(length, tile_size, stride):
+    """Tile origins covering [0, length); the last tile is flush with the end."""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    return starts + [length - tile_size]
+
+
+def load_unet(checkpoint_path, device="cpu"):
+    """UNet from a train.py state_dict; channel/class counts and upsampling mode are read from the weights."""
+    state = torch.load(checkpoint_path, map_location=device, weights_only=True)
+    state = state.get("model", state)  # Full training checkpoints nest the weights
+    model = UNet(n_channels=state["inc.double_conv.0.weight"].shape[1],
+                 n_classes=state["outc.conv.weight"].shape[0],
+                 bilinear="up1.up.weight" not in state)
+    model.load_state_dict(state)
+    return model.to(device).eval()
+
+
+def load_model(path, device="cpu"):
+    """A train.py checkpoint (.pth/.ckpt), an export.py metadata .json (fastest backend) or a quantize.py .int8.pt."""
+    if path.endswith(".json"):
+        from export import load_runtime
+        return load_runtime(path)
+    if path.endswith(".int8.pt"):
+        from quantize import load_quantized
+        return load_quantized(path)
+    return load_unet(path, device)
+
+
+class TiledInferenceEngine:
+    """
+    Runs `model` over full scenes of any size.
+    tile_size must be a multiple of 16 (four UNet poolings); overlap is the shared border between tiles.
+    """
+
+    def __init__(self, model, tile_size=INFERENCE_TILE_SIZE, overlap=INFERENCE_OVERLAP, batch_size=INFERENCE_BATCH_SIZE,
+                 num_threads=INFERENCE_THREADS, device="cpu"):
+        if tile_size % 16:
+            raise ValueError(f"tile_size must be a multiple of 16, got {tile_size}")
+        if not 0 <= overlap < tile_size // 2:
+            raise ValueError(f"overlap must be in [0, {tile_size // 2}), got {overlap}")
+        configure_threads(num_threads)
+        self.model = model.to(device).eval()
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.n_channels = model.n_channels
+        self.n_classes = model.n_classes
+        self.window = torch.from_numpy(blend_window(tile_size, overlap)).to(self.device)
+        self._batch = torch.empty((batch_size, self.n_channels, tile_size, tile_size), device=self.device)
+        self._buffers = {}  # (H, W) -> (accumulator, inverse weight sum, tile origins)
+        self.stats = {"scenes": 0, "tiles": 0, "seconds": 0.0}
+
+    def _buffers_for(self, shape):
+        if shape not in self._buffers:
+            stride = self.tile_size - self.overlap
+            origins = [(r, c) for r in tile_starts(shape[0], self.tile_size, stride)
+                       for c in tile_starts(shape[1], self.tile_size, stride)]
+            weights = torch.zeros(shape, device=self.device)
+            for r, c in origins:
+                weights[r:r + self.tile_size, c:c + self.tile_size] += self.window
+            accumulator = torch.empty((self.n_classes,) + shape, device=self.device)
+            self._buffers[shape] = (accumulator, weights.reciprocal_(), origins)
+        return self._buffers[shape]
+
+    @torch.inference_mode()
+    def predict(self, scene, out=None):
+        """
+        Model output for a (C, H, W) float32 scene as a (n_classes, H, W) float32 array (the UNet returns
+        probabilities). Scenes smaller than a tile are reflect-padded. Pass `out` to reuse a result array.
+        """
+        start = time.perf_counter()
+        scene = torch.as_tensor(np.ascontiguousarray(scene, dtype=np.float32))
+        if scene.ndim != 3 or scene.shape[0] != self.n_channels:
+            raise ValueError(f"Expected a ({self.n_channels}, H, W) scene, got {tuple(scene.shape)}")
+        height, width = scene.shape[1:]
+        pad_h, pad_w = max(0, self.tile_size - height), max(0, self.tile_size - width)
+        if pad_h or pad_w:
+            mode = "reflect" if pad_h < height and pad_w < width else "replicate"
+            scene = torch.nn.functional.pad(scene[None], (0, pad_w, 0, pad_h), mode=mode)[0]
+        scene = scene.to(self.device)
+
+        accumulator, inverse_weights, origins = self._buffers_for(tuple(scene.shape[1:]))
+        accumulator.zero_()
+        t = self.tile_size
+        for first in range(0, len(origins), self.batch_size):
+            batch_origins = origins[first:first + self.batch_size]
+            for i, (r, c) in enumerate(batch_origins):
+                self._batch[i].copy_(scene[:, r:r + t, c:c + t])
+            pred = self.model(self._batch[:len(batch_origins)])
+            for i, (r, c) in enumerate(batch_origins):
+                accumulator[:, r:r + t, c:c + t].addcmul_(pred[i], self.window)
+        accumulator.mul_(inverse_weights)
+
+        result = accumulator[:, :height, :width].cpu().numpy()
+        if out is not None:
+            out[...] = result
+            result = out
+        else:
+            result = result.copy()  # Don't hand out the reused buffer
+
+        self.stats["scenes"] += 1
+        self.stats["tiles"] += len(origins)
+        self.stats["seconds"] += time.perf_counter() - start
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiled full-scene UNet inference benchmark / runner.")
+    parser.add_argument("--checkpoint", type=str, default=None, help="train.py state_dict (.pth); random weights if omitted")
+    parser.add_argument("--export", type=str, default=None, help="export.py metadata (.json): run the fastest exported backend")
+    parser.add_argument("--input", type=str, default=None, help=".npy scene (C, H, W); synthetic if omitted")
+    parser.add_argument("--output", type=str, default=None, help="Where to save the (n_classes, H, W) .npy result")
+    parser.add_argument("--size", type=int, default=1024, help="Synthetic scene height and width")
+    parser.add_argument("--tile_size", type=int, default=INFERENCE_TILE_SIZE)
+    parser.add_argument("--overlap", type=int, default=INFERENCE_OVERLAP)
+    parser.add_argument("--batch_size", type=int, default=INFERENCE_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=INFERENCE_THREADS, help="torch intra-op threads")
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.export:
+        from export import load_runtime
+        model = load_runtime(args.export, num_threads=args.threads)
+    else:
+        model = load_unet(args.checkpoint) if args.checkpoint else UNet(n_channels=1, n_classes=1)
+    engine = TiledInferenceEngine(model, args.tile_size, args.overlap, args.batch_size, args.threads)
+    scene = np.load(args.input) if args.input else np.random.rand(model.n_channels, args.size, args.size).astype(np.float32)
+    n_tiles = len(engine._buffers_for(scene.shape[1:])[2]) if min(scene.shape[1:]) >= args.tile_size else 1
+    print(f"Scene {scene.shape}, {n_tiles} tiles of {args.tile_size} (overlap {args.overlap}), "
+          f"batch {args.batch_size}, {torch.get_num_threads()} threads")
+
+    out = np.empty((model.n_classes,) + scene.shape[1:], dtype=np.float32)
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        engine.predict(scene, out=out)
+        print(f"  {time.perf_counter() - start:.2f} s per scene")
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        np.save(args.output, out)
+        print(f"Saved {args.output}")
@@ -0,0 +1,448 @@
+import os
+import stat
+import time
+import queue
+import shutil
+import select
+import struct
+import signal
+import ctypes
+import ctypes.util
+import logging
+import argparse
+import itertools
+import threading
+from collections import deque
+import numpy as np
+
+from process import prepare_scene
+from inference import load_model, TiledInferenceEngine
+from labels import label_clusters
+from checkpoints import resolve_checkpoint
+from tracking import scene_time
+
+try:
+    from config import (RAW_DATA_DIR, DATA_SOURCES, MODEL_DIR, PREPROCESS_STAGES, INGEST_OUTPUT_DIR, INGEST_SETTLE_SECONDS,
+                        INGEST_QUEUE_SIZE, INGEST_SOURCE_PRIORITY)
+except ImportError:
+    print("Warning: config.py not found, using placeholder ingest settings.")
+    RAW_DATA_DIR = "data/raw_placeholder"
+    DATA_SOURCES = {"isro_insat": {}, "nasa_goes": {}, "nasa_modis": {}, "esa_sentinel": {}}
+    MODEL_DIR = "models_placeholder"
+    PREPROCESS_STAGES = {"labels": {"min_area": 1, "connectivity": 8}}
+    INGEST_OUTPUT_DIR = "data/products_placeholder"
+    INGEST_SETTLE_SECONDS = 5.0
+    INGEST_QUEUE_SIZE = 4
+    INGEST_SOURCE_PRIORITY = {}
+
+# Long-running ingest service: raw scene in RAW_DATA_DIR/<source>/ -> cloud cluster product in INGEST_OUTPUT_DIR/<source>/.
+#
+#   watcher (main thread) -> [scene queue] -> prepare worker(s) -> [inference queue] -> UNet -> [write queue] -> writer
+#
+# DirectoryWatcher learns about new files from inotify (Linux, through libc; no extra dependency) or, where
+# that is unavailable, by rescanning the directories. A file is handed on only once its size and mtime have
+# stayed the same for `settle_seconds`, so scenes still being copied or downloaded are never read half-written
+# (in-progress names such as *.part are ignored outright). Preparation is process.prepare_scene (band
+# selection, calibration, reprojection, normalization); inference is tiled over the full scene
+# (TiledInferenceEngine); the writer thresholds the output, labels connected clusters and saves the product
+# atomically. Queues are bounded: when the model falls behind, preparation blocks, then the watcher stops
+# handing out files (they wait on disk), so memory stays flat during a backlog. The scene queue is ordered by
+# source priority, so half-hourly INSAT scans are not stuck behind a burst of MODIS granules.
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+class _Inotify:
+    """Minimal inotify binding over ctypes: directory watches and non-blocking event reads."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # wd -> (source, directory)
+
+    def add_watch(self, directory, source):
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.watches[wd] = (source, directory)
+
+    def read(self, timeout):
+        """[(source, path)] of files touched within `timeout` seconds; None if the kernel queue overflowed."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].split(b"\0", 1)[0]
+            offset += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            if wd in self.watches and name:
+                source, directory = self.watches[wd]
+                events.append((source, os.path.join(directory, os.fsdecode(name))))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """
+    Reports files in {source: directory} that are new or changed and have settled (size and mtime unchanged
+    for `settle_seconds`). Files already present at start-up are reported too, so a restart catches up.
+    """
+
+    IGNORED_SUFFIXES = (".part", ".tmp", ".partial", ".crdownload", "~")
+
+    def __init__(self, directories, settle_seconds=INGEST_SETTLE_SECONDS, poll_interval=2.0, use_inotify=None,
+                 rescan_interval=60.0):
+        self.directories = directories
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self._pending = {}  # path -> [source, (size, mtime_ns), last change time, first seen time]
+        self._reported = {}  # path -> (size, mtime_ns) when it was last handed out
+        self._last_scan = None
+        for directory in directories.values():
+            os.makedirs(directory, exist_ok=True)
+
+        self._inotify = None
+        if use_inotify is not False:
+            try:
+                self._inotify = _Inotify()
+                for source, directory in directories.items():
+                    self._inotify.add_watch(directory, source)
+            except (OSError, AttributeError) as e:  # Not Linux, or out of watches
+                if use_inotify:
+                    raise
+                logging.info(f"inotify unavailable ({e}); polling every {poll_interval:.1f}s instead")
+                self._inotify = None
+        self.mode = "inotify" if self._inotify is not None else "polling"
+
+    def _ignored(self, name):
+        return name.startswith(".") or name.endswith(self.IGNORED_SUFFIXES)
+
+    def _touch(self, source, path, now):
+        if self._ignored(os.path.basename(path)):
+            return
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._pending.pop(path, None)
+            return
+        if not stat.S_ISREG(st.st_mode):
+            return
+        signature = (st.st_size, st.st_mtime_ns)
+        if self._reported.get(path) == signature:
+            return
+        entry = self._pending.get(path)
+        if entry is None:
+            # A file last modified long ago (start-up backlog) has already settled
+            self._pending[path] = [source, signature, min(now, st.st_mtime), now]
+        elif entry[1] != signature:
+            entry[1], entry[2] = signature, now
+
+    def _scan(self, now):
+        present = set()
+        for source, directory in self.directories.items():
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    present.add(entry.path)
+                    self._touch(source, entry.path, now)
+        self._reported = {path: sig for path, sig in self._reported.items() if path in present}
+        self._last_scan = now
+
+    def poll(self, timeout=1.0):
+        """Waits up to `timeout` s for changes; returns [(source, path, first seen time)] of newly settled files."""
+        now = time.time()
+        if self._inotify is None:
+            if self._last_scan is not None:
+                time.sleep(min(timeout, self.poll_interval))
+            self._scan(time.time())
+        else:
+            if self._last_scan is None or now - self._last_scan >= self.rescan_interval:
+                self._scan(now)  # Initial backlog, and a safety net for missed events
+            events = self._inotify.read(min(timeout, self.settle_seconds / 2 or timeout))
+            if events is None:
+                logging.warning("inotify queue overflowed; rescanning")
+                self._scan(time.time())
+            else:
+                now = time.time()
+                for source, path in events:
+                    self._touch(source, path, now)
+
+        now = time.time()
+        settled = []
+        for path, (source, signature, last_change, first_seen) in list(self._pending.items()):
+            if now - last_change < self.settle_seconds or signature[0] == 0:
+                continue
+            self._touch(source, path, now)  # Confirm nothing changed since the last event/scan
+            entry = self._pending.get(path)
+            if entry is not None and entry[1] == signature and now - entry[2] >= self.settle_seconds:
+                del self._pending[path]
+                self._reported[path] = signature
+                settled.append((source, path, first_seen))
+        return settled
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+
+
+class IngestService:
+    """Watches the raw directories and turns each settled scene into a cluster product (see module comment)."""
+
+    def __init__(self, model, directories, output_dir=INGEST_OUTPUT_DIR, queue_size=INGEST_QUEUE_SIZE, prepare_workers=1,
+                 threshold=0.5, settle_seconds=INGEST_SETTLE_SECONDS, use_inotify=None, poll_interval=2.0,
+                 priorities=None, reprocess=False):
+        self.engine = TiledInferenceEngine(model)
+        self.watcher = DirectoryWatcher(directories, settle_seconds, poll_interval, use_inotify)
+        self.output_dir = output_dir
+        self.threshold = threshold
+        self.priorities = INGEST_SOURCE_PRIORITY if priorities is None else priorities
+        self.reprocess = reprocess
+        self.label_config = {key: PREPROCESS_STAGES["labels"].get(key, default)
+                             for key, default in (("min_area", 1), ("connectivity", 8))}
+
+        self.scene_queue = queue.PriorityQueue(maxsize=queue_size)  # Settled raw files
+        self.inference_queue = queue.Queue(maxsize=queue_size)  # Prepared scenes
+        self.write_queue = queue.Queue(maxsize=queue_size)  # Model outputs
+        self.stop_event = threading.Event()
+        self.prepare_workers = prepare_workers
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.stats = {"scenes": 0, "failed": 0, "latency_seconds": deque(maxlen=1000)}
+
+    def product_path(self, source, raw_path):
+        return os.path.join(self.output_dir, source, os.path.basename(raw_path) + ".clusters.npz")
+
+    def _is_current(self, source, raw_path):
+        product = self.product_path(source, raw_path)
+        return os.path.isfile(product) and os.path.getmtime(product) >= os.path.getmtime(raw_path)
+
+    def _put(self, target_queue, item):
+        """Blocks while `target_queue` is full (backpressure); gives up only when the service stops."""
+        while not self.stop_event.is_set():
+            try:
+                target_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _items(self, source_queue):
+        while not self.stop_event.is_set():
+            try:
+                yield source_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    def _finish(self, job, error=None):
+        with self._lock:
+            self._in_flight -= 1
+            if error is None:
+                self.stats["scenes"] += 1
+                self.stats["latency_seconds"].append(job["written"] - job["detected"])
+            else:
+                self.stats["failed"] += 1
+        if error is not None:
+            logging.error(f"{job['source']}: {os.path.basename(job['path'])} failed: {error}")
+
+    def _prepare_loop(self):
+        for _, _, _, job in self._items(self.scene_queue):
+            job["dequeued"] = time.time()
+            try:
+                scene = prepare_scene(job["path"], job["source"])
+                if scene is None:
+                    raise ValueError("unsupported file type")
+                _, band_data, normalized, stages = scene
+                if normalized.shape[-1] != self.engine.n_channels:
+                    raise ValueError(f"scene has {normalized.shape[-1]} bands, model expects {self.engine.n_channels}")
+                label_band = stages["labels"].get("band")
+                job["bt"] = band_data[..., stages["bands"].index(label_band)] if label_band in (stages["bands"] or []) else None
+                job["image"] = np.ascontiguousarray(np.moveaxis(normalized, -1, 0), dtype=np.float32)
+            except Exception as e:
+                self._finish(job, e)
+                continue
+            job["prepared"] = time.time()
+            self._put(self.inference_queue, job)
+
+    def _inference_loop(self):
+        for job in self._items(self.inference_queue):
+            job["inference_started"] = time.time()
+            try:
+                job["probability"] = self.engine.predict(job.pop("image"))
+            except Exception as e:
+                self._finish(job, e)
+                continue
+            job["inferred"] = time.time()
+            self._put(self.write_queue, job)
+
+    def _write_loop(self):
+        for job in self._items(self.write_queue):
+            try:
+                probability = job.pop("probability")
+                mask = probability[0] > self.threshold if len(probability) == 1 else probability.argmax(axis=0) > 0
+                bt = job.pop("bt")
+                if bt is not None:
+                    mask &= np.isfinite(bt)  # Off-disk pixels (NaN after reprojection) are never cloud
+                labels, props = label_clusters(mask, bt if bt is not None else probability.max(axis=0), **self.label_config)
+                product = self.product_path(job["source"], job["path"])
+                os.makedirs(os.path.dirname(product), exist_ok=True)
+                tmp_path = product + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    # Acquisition time for tracking; the raw file's mtime only if the name carries none
+                    acquired = scene_time(job["path"])
+                    np.savez_compressed(f, labels=labels, probability=probability.astype(np.float16),
+                                        scene_time=np.float64(os.path.getmtime(job["path"]) if acquired is None else acquired),
+                                        **{f"cluster_{key}": values for key, values in props.items()})
+                os.replace(tmp_path, product)
+            except Exception as e:
+                self._finish(job, e)
+                continue
+            job["written"] = time.time()
+            logging.info(f"{job['source']}: {os.path.basename(job['path'])} -> {len(props['label'])} clusters in "
+                         f"{job['written'] - job['detected']:.1f}s (settle {job['ready'] - job['detected']:.1f}s, "
+                         f"queued {job['dequeued'] - job['ready'] + job['inference_started'] - job['prepared']:.1f}s, "
+                         f"prepare {job['prepared'] - job['dequeued']:.1f}s, inference {job['inferred'] - job['inference_started']:.1f}s, write {job['written'] - job['inferred']:.1f}s)")
+            self._finish(job)
+
+    def submit(self, source, path, detected):
+        """Queues one settled raw file (blocks while the scene queue is full); returns False once stopping."""
+        if not self.reprocess and self._is_current(source, path):
+            return True
+        with self._lock:
+            self._in_flight += 1
+        job = {"source": source, "path": path, "detected": detected, "ready": time.time()}
+        if not self._put(self.scene_queue, (self.priorities.get(source, 1), job["ready"], next(self._sequence), job)):
+            with self._lock:
+                self._in_flight -= 1
+            return False
+        return True
+
+    def idle(self):
+        with self._lock:
+            return self._in_flight == 0
+
+    def run(self, duration=None, drain_timeout=600.0):
+        """
+        Runs until SIGINT/SIGTERM (or for `duration` seconds, then waits up to `drain_timeout` for queued scenes).
+        Scenes interrupted by a stop have no product yet and are picked up again on the next start.
+        """
+        threads = [threading.Thread(target=self._prepare_loop, name=f"prepare-{i}", daemon=True)
+                   for i in range(self.prepare_workers)]
+        threads += [threading.Thread(target=self._inference_loop, name="inference", daemon=True),
+                    threading.Thread(target=self._write_loop, name="write", daemon=True)]
+        for thread in threads:
+            thread.start()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda *_: self.stop_event.set())
+
+        logging.info(f"Watching {', '.join(self.watcher.directories.values())} ({self.watcher.mode}); "
+                     f"products -> {self.output_dir}")
+        deadline = None if duration is None else time.time() + duration
+        try:
+            while not self.stop_event.is_set() and (deadline is None or time.time() < deadline):
+                for source, path, detected in self.watcher.poll(timeout=1.0):
+                    if not self.submit(source, path, detected):
+                        break
+            drain_deadline = time.time() + drain_timeout
+            while not self.stop_event.is_set() and not self.idle() and time.time() < drain_deadline:
+                time.sleep(0.2)
+        finally:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+            self.watcher.close()
+
+        latency = np.array(self.stats["latency_seconds"])
+        summary = (f"; detection-to-product p50 {np.percentile(latency, 50):.1f}s, p95 {np.percentile(latency, 95):.1f}s"
+                   if len(latency) else "")
+        logging.info(f"Ingest stopped: {self.stats['scenes']} scenes, {self.stats['failed']} failed{summary}")
+        return self.stats
+
+
+def _demo_writer(raw_dir, n_scenes, interval, stop_event):
+    """Drops synthetic INSAT scenes into raw_dir, each copied in two halves with a pause (a slow transfer)."""
+    import tempfile
+    from synthetic_data import DEFAULT_BANDS, synthetic_counts, write_netcdf
+
+    with tempfile.TemporaryDirectory() as staging:
+        for i in range(n_scenes):
+            if stop_event.wait(interval):
+                return
+            staged = os.path.join(staging, f"3DIMG_01JUN2025_{i // 2:02d}{30 * (i % 2):02d}_L1B_STD.nc")  # Half-hourly scans
+            write_netcdf(staged, synthetic_counts((512, 512), len(DEFAULT_BANDS), seed=i))
+            with open(staged, "rb") as src, open(os.path.join(raw_dir, os.path.basename(staged)), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                half = os.path.getsize(staged) // 2
+                dst.seek(half)
+                dst.truncate()  # Leave it half-written for a moment
+                dst.flush()
+                time.sleep(1.0)
+                src.seek(half)
+                shutil.copyfileobj(src, dst)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Watch raw data directories and produce cloud cluster masks as scenes arrive.")
+    parser.add_argument("--checkpoint", type=str, default="latest", help="'latest', 'best' or a model path (.pth/.ckpt, export .json, .int8.pt)")
+    parser.add_argument("--sources", type=str, nargs="+", default=list(DATA_SOURCES), help="Sources to watch under RAW_DATA_DIR")
+    parser.add_argument("--raw_dir", type=str, default=RAW_DATA_DIR)
+    parser.add_argument("--output_dir", type=str, default=INGEST_OUTPUT_DIR)
+    parser.add_argument("--settle_seconds", type=float, default=INGEST_SETTLE_SECONDS, help="Quiet time before a file is read")
+    parser.add_argument("--queue_size", type=int, default=INGEST_QUEUE_SIZE)
+    parser.add_argument("--prepare_workers", type=int, default=1)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--poll", action="store_true", help="Poll the directories instead of using inotify")
+    parser.add_argument("--poll_interval", type=float, default=2.0)
+    parser.add_argument("--reprocess", action="store_true", help="Also redo scenes that already have a product")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds (default: run until killed)")
+    parser.add_argument("--demo", type=int, default=0, help="Write this many synthetic INSAT scenes into a temporary raw dir")
+    args = parser.parse_args()
+
+    demo_stop = threading.Event()
+    if args.demo:
+        import tempfile
+        demo_root = tempfile.mkdtemp(prefix="ingest_demo_")
+        args.raw_dir, args.output_dir, args.sources = os.path.join(demo_root, "raw"), os.path.join(demo_root, "products"), ["isro_insat"]
+        args.settle_seconds = min(args.settle_seconds, 2.0)
+        os.makedirs(os.path.join(args.raw_dir, "isro_insat"), exist_ok=True)
+        threading.Thread(target=_demo_writer, args=(os.path.join(args.raw_dir, "isro_insat"), args.demo, 3.0, demo_stop),
+                         daemon=True).start()
+        args.duration = args.duration or 3.0 * args.demo + 2 * args.settle_seconds + 5
+
+    model_path = resolve_checkpoint(args.checkpoint, MODEL_DIR)
+    if model_path and os.path.isfile(model_path):
+        model = load_model(model_path)
+    elif args.demo:
+        from models.unet import UNet
+        logging.info("No trained model found; the demo runs an untrained 2-channel UNet")
+        model = UNet(n_channels=2, n_classes=1)
+    else:
+        raise SystemExit(f"No model to run ({args.checkpoint}) in {MODEL_DIR}. Train a model first.")
+
+    service = IngestService(model, {source: os.path.join(args.raw_dir, source) for source in args.sources},
+                            args.output_dir, args.queue_size, args.prepare_workers, args.threshold, args.settle_seconds,
+                            use_inotify=False if args.poll else None, poll_interval=args.poll_interval, reprocess=args.reprocess)
+    service.run(duration=args.duration)
+    demo_stop.set()
+    if args.demo:
+        print(f"Demo products: {sorted(os.listdir(os.path.join(args.output_dir, 'isro_insat')))}")
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Incremental preprocessing manifest.
+# For every raw file it records what was seen (size, mtime, content hash), the parameters of every
+# pipeline stage it went through, and what it produced (its patch store index fragment).
+# A rerun only reprocesses files that are new, whose content changed, or whose stage config changed.
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+_HASH_CHUNK = 4 * 1024 * 1024
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_hash(params):
+    """Stable hash of a JSON-serializable stage config."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class PreprocessManifest:
+    def __init__(self, path, entries=None):
+        self.path = path
+        self.entries = entries or {}  # raw file path -> entry dict
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.isfile(path):
+            return cls(path)
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            print(f"Manifest {path} has version {data.get('version')}, expected {MANIFEST_VERSION}; starting fresh.")
+            return cls(path)
+        return cls(path, data.get("files", {}))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def plan(self, jobs, stage_hashes, force=False, required_outputs=(), hash_workers=8):
+        """
+        Splits `jobs` [(source, raw_path, ...), ...] into (to_process, skipped).
+        to_process items are (job, reason, fingerprint). Content is only hashed when size/mtime
+        changed, so an untouched archive costs one stat() per file.
+        Entries lacking any of `required_outputs` (e.g. "patch_store") are reprocessed too.
+        """
+        to_process, skipped, to_hash = [], [], []
+        for job in jobs:
+            source, raw_path = job[0], job[1]
+            st = os.stat(raw_path)
+            fingerprint = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            entry = self.entries.get(raw_path)
+            stages = stage_hashes[source]
+
+            if force:
+                to_hash.append((job, "forced", fingerprint))
+            elif entry is None:
+                to_hash.append((job, "new", fingerprint))
+            elif any(key not in (entry.get("outputs") or {}) for key in required_outputs):
+                to_hash.append((job, "missing outputs", fingerprint))
+            elif entry["stages"] != stages:
+                changed = sorted(k for k in set(entry["stages"]) | set(stages) if entry["stages"].get(k) != stages.get(k))
+                to_hash.append((job, f"stage config changed: {', '.join(changed)}", fingerprint))
+            elif entry["size"] == fingerprint["size"] and entry["mtime_ns"] == fingerprint["mtime_ns"]:
+                skipped.append(job)
+            else:
+                to_hash.append((job, "content changed", fingerprint))
+
+        with ThreadPoolExecutor(max_workers=hash_workers) as pool:  # hashlib releases the GIL
+            hashes = list(pool.map(lambda item: sha256_file(item[0][1]), to_hash))
+
+        for (job, reason, fingerprint), digest in zip(to_hash, hashes):
+            fingerprint["sha256"] = digest
+            entry = self.entries.get(job[1])
+            if reason == "content changed" and entry is not None and entry.get("sha256") == digest:
+                # Touched but identical: just refresh the recorded mtime
+                entry.update(fingerprint)
+                skipped.append(job)
+            else:
+                to_process.append((job, reason, fingerprint))
+        return to_process, skipped
+
+    def record(self, raw_path, source, fingerprint, stages, outputs):
+        """Records a successful run; returns the previous entry (its outputs may now be stale)."""
+        previous = self.entries.get(raw_path)
+        self.entries[raw_path] = dict(fingerprint, source=source, stages=stages, outputs=outputs,
+                                      processed_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        return previous
+
+    def outputs(self, key):
+        """Yields (raw_path, outputs[key]) for every entry that produced that output, in stable order."""
+        for raw_path in sorted(self.entries):
+            value = (self.entries[raw_path].get("outputs") or {}).get(key)
+            if value is not None:
+                yield raw_path, value
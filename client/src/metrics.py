@@ -0,0 +1,126 @@
+import time
+import argparse
+import numpy as np
+import torch
+import torch.distributed as dist
+
+from distributed import is_distributed
+
+# Streaming segmentation metrics from one confusion matrix.
+#
+# UNet.forward already returns probabilities (sigmoid for one output channel, softmax for several), so
+# predictions are taken directly from them: `> threshold` for binary models, argmax over classes otherwise.
+# Each batch adds its (truth, prediction) pairs to a K x K confusion matrix with a single bincount, on the
+# batch's device and without reading anything back to the host. Dice, IoU, precision and recall are derived
+# from the summed counts at the end, so they are exact dataset-level values (not a mean of per-batch
+# means, which over-weights small batches), and all_reduce() sums the integer counts over distributed
+# ranks without any loss of precision. A class that is neither present nor predicted scores 1.0; otherwise an
+# empty ratio is 0.0 (precision of a class that is present but never predicted, recall of one that is
+# predicted but absent).
+
+
+def _ratio(numerator, denominator, support):
+    """numerator / denominator; where that is 0/0, 1.0 if the class has no support (tp + fp + fn) else 0.0."""
+    return np.where(denominator > 0, numerator / np.maximum(denominator, 1), np.where(support > 0, 0.0, 1.0))
+
+
+class SegmentationMetrics:
+    """Accumulates a confusion matrix (and the mean loss) over batches of model outputs and masks."""
+
+    def __init__(self, n_classes=1, threshold=0.5, device="cpu", class_names=None):
+        self.n_classes = n_classes
+        self.n_labels = 2 if n_classes == 1 else n_classes  # Binary: background and foreground
+        self.threshold = threshold
+        self.device = torch.device(device)
+        self.class_names = class_names or (["background", "cloud"] if n_classes == 1 else [str(c) for c in range(n_classes)])
+        self.reset()
+
+    def reset(self):
+        self.confusion = torch.zeros(self.n_labels * self.n_labels, dtype=torch.int64, device=self.device)
+        self.loss_totals = torch.zeros(2, dtype=torch.float64, device=self.device)  # [sum of loss * samples, samples]
+
+    def _labels(self, probs, targets):
+        if self.n_classes == 1:
+            return (targets > 0.5).long(), (probs > self.threshold).long()
+        # Multi-class masks are either class indices (B, 1, H, W) or one-hot (B, C, H, W)
+        truth = targets.argmax(dim=1) if targets.shape[1] == self.n_classes else targets[:, 0].long()
+        return truth, probs.argmax(dim=1)
+
+    @torch.no_grad()
+    def update(self, probs, targets, loss=None):
+        """probs: model outputs (B, n_classes, H, W); targets: masks; loss: the batch's mean loss (optional)."""
+        truth, pred = self._labels(probs, targets)
+        pairs = truth.reshape(-1) * self.n_labels + pred.reshape(-1)
+        self.confusion += torch.bincount(pairs, minlength=self.n_labels * self.n_labels)
+        if loss is not None:
+            self.loss_totals[0] += loss.detach().double() * probs.shape[0]
+            self.loss_totals[1] += probs.shape[0]
+
+    def merge(self, other):
+        """Adds another accumulator's counts (e.g. one computed in a worker process)."""
+        self.confusion += other.confusion.to(self.device)
+        self.loss_totals += other.loss_totals.to(self.device)
+        return self
+
+    def all_reduce(self):
+        """Sums counts over all ranks (every rank must call it); no-op without a process group."""
+        if is_distributed():
+            dist.all_reduce(self.confusion, op=dist.ReduceOp.SUM)
+            dist.all_reduce(self.loss_totals, op=dist.ReduceOp.SUM)
+        return self
+
+    def confusion_matrix(self):
+        """(truth, prediction) int64 counts as a NumPy array."""
+        return self.confusion.cpu().numpy().reshape(self.n_labels, self.n_labels)
+
+    def compute(self):
+        """
+        {"loss", "dice", "iou", "precision", "recall", "accuracy", "per_class": {name: {...}}}. Headline scores are
+        the foreground class for binary models and the mean over classes otherwise.
+        """
+        matrix = self.confusion_matrix().astype(np.float64)
+        tp = np.diag(matrix)
+        fp = matrix.sum(axis=0) - tp
+        fn = matrix.sum(axis=1) - tp
+        support = tp + fp + fn
+        per_class = {"dice": _ratio(2 * tp, 2 * tp + fp + fn, support), "iou": _ratio(tp, support, support),
+                     "precision": _ratio(tp, tp + fp, support), "recall": _ratio(tp, tp + fn, support)}
+        loss_sum, samples = self.loss_totals.cpu().tolist()
+
+        result = {name: float(values[1] if self.n_classes == 1 else values.mean()) for name, values in per_class.items()}
+        result["accuracy"] = float(tp.sum() / max(matrix.sum(), 1))
+        result["loss"] = loss_sum / samples if samples else float("nan")
+        result["per_class"] = {class_name: {name: float(values[c]) for name, values in per_class.items()}
+                               for c, class_name in enumerate(self.class_names)}
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and time the streaming segmentation metrics.")
+    parser.add_argument("--n_classes", type=int, default=1)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--batches", type=int, default=20)
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(0)
+    batch_sizes = [1 + i % 5 for i in range(args.batches)]  # Uneven batches, as at the end of an epoch
+    shape = lambda b: (b, args.n_classes, args.size, args.size)
+    if args.n_classes == 1:
+        outputs = [torch.rand(shape(b), generator=generator) for b in batch_sizes]
+        masks = [(torch.rand(shape(b), generator=generator) > 0.6).float() for b in batch_sizes]
+    else:
+        outputs = [torch.rand(shape(b), generator=generator).softmax(dim=1) for b in batch_sizes]
+        masks = [torch.randint(0, args.n_classes, (b, 1, args.size, args.size), generator=generator).float() for b in batch_sizes]
+
+    metrics = SegmentationMetrics(args.n_classes)
+    start = time.perf_counter()
+    for probs, target in zip(outputs, masks):
+        metrics.update(probs, target)
+    elapsed = time.perf_counter() - start
+    streamed = metrics.compute()
+
+    whole = SegmentationMetrics(args.n_classes)
+    whole.update(torch.cat(outputs), torch.cat(masks))
+    print(f"Streamed counts equal whole-dataset counts: {np.array_equal(metrics.confusion_matrix(), whole.confusion_matrix())}")
+    print(f"{sum(batch_sizes)} samples in {len(batch_sizes)} batches: {1000 * elapsed / len(batch_sizes):.2f} ms per batch")
+    print(", ".join(f"{k} {v:.4f}" for k, v in streamed.items() if k not in ("per_class", "loss")))
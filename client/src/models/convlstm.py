@@ -0,0 +1,104 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# PyTorch port of create_convlstm_model (attached_assets/convlstm): two ConvLSTM layers with BatchNorm on
+# their outputs, then a 3x3 ReLU conv and a 1x1 conv to class probabilities at every timestep.
+#
+# The recurrence is exposed one timestep at a time (step), so a caller can keep the hidden state between
+# calls and pay one timestep per new frame instead of re-running the whole sequence; forward() over a
+# sequence is exactly a loop of step() calls. A per-sample `valid` flag marks missing frames: for those the
+# hidden state is carried over unchanged (the output repeats the previous prediction), so gaps in the
+# half-hourly record neither corrupt the state nor need invented frames.
+
+
+class ConvLSTMCell(nn.Module):
+    """One ConvLSTM layer step: input, forget, output and candidate gates from a single convolution."""
+
+    def __init__(self, in_channels, hidden_channels, kernel_size=3):
+        super().__init__()
+        self.hidden_channels = hidden_channels
+        self.gates = nn.Conv2d(in_channels + hidden_channels, 4 * hidden_channels, kernel_size, padding=kernel_size // 2)
+
+    def forward(self, x, state):
+        h, c = state
+        i, f, o, g = self.gates(torch.cat([x, h], dim=1)).chunk(4, dim=1)
+        c = torch.sigmoid(f) * c + torch.sigmoid(i) * torch.tanh(g)
+        h = torch.sigmoid(o) * torch.tanh(c)
+        return h, c
+
+
+class ConvLSTM(nn.Module):
+    def __init__(self, n_channels, n_classes, hidden_channels=(64, 64), kernel_size=3, head_channels=32):
+        super().__init__()
+        self.n_channels = n_channels
+        self.n_classes = n_classes
+        self.hidden_channels = tuple(hidden_channels)
+
+        in_channels = (n_channels,) + self.hidden_channels[:-1]
+        self.cells = nn.ModuleList(ConvLSTMCell(i, h, kernel_size) for i, h in zip(in_channels, self.hidden_channels))
+        self.norms = nn.ModuleList(nn.BatchNorm2d(h) for h in self.hidden_channels)
+        self.head = nn.Sequential(
+            nn.Conv2d(self.hidden_channels[-1], head_channels, kernel_size=3, padding=1),
+            nn.ReLU(inplace=True),
+            nn.BatchNorm2d(head_channels),
+            nn.Conv2d(head_channels, n_classes, kernel_size=1),
+        )
+
+    def init_state(self, x):
+        """Zero (h, c) per layer for a (B, C, H, W) input."""
+        batch, _, height, width = x.shape
+        return tuple((x.new_zeros(batch, h, height, width), x.new_zeros(batch, h, height, width))
+                     for h in self.hidden_channels)
+
+    def step(self, x, state=None, valid=None):
+        """
+        One timestep: x (B, C, H, W), state from init_state or the previous step, valid (B,) bool (None = all).
+        Returns (probabilities (B, n_classes, H, W), new state).
+        """
+        if state is None:
+            state = self.init_state(x)
+        new_state = []
+        out = x
+        for cell, norm, (h_prev, c_prev) in zip(self.cells, self.norms, state):
+            h, c = cell(out, (h_prev, c_prev))
+            if valid is not None:  # Missing frames keep the previous state
+                keep = valid.view(-1, 1, 1, 1)
+                h, c = torch.where(keep, h, h_prev), torch.where(keep, c, c_prev)
+            new_state.append((h, c))
+            out = norm(h)
+        logits = self.head(out)
+
+        if self.n_classes == 1:
+            return torch.sigmoid(logits), tuple(new_state)
+        return F.softmax(logits, dim=1), tuple(new_state)
+
+    def forward(self, x, state=None, valid=None):
+        """x (B, T, C, H, W), valid (B, T) bool; returns (probabilities (B, T, n_classes, H, W), final state)."""
+        outputs = []
+        for t in range(x.shape[1]):
+            out, state = self.step(x[:, t], state, None if valid is None else valid[:, t])
+            outputs.append(out)
+        return torch.stack(outputs, dim=1), state
+
+
+if __name__ == "__main__":
+    torch.manual_seed(0)
+    model = ConvLSTM(n_channels=3, n_classes=2, hidden_channels=(16, 16)).eval()
+    sequence = torch.randn(2, 10, 3, 64, 64)  # CONVLSTM_INPUT_SHAPE (10, 256, 256, 3), channels first and smaller
+    with torch.no_grad():
+        outputs, state = model(sequence)
+        print("ConvLSTM - Input shape:", sequence.shape, "Output shape:", outputs.shape)
+
+        # Stateful use: one step per new frame gives the same outputs as the full sequence
+        stepped, state = None, None
+        for t in range(sequence.shape[1]):
+            stepped, state = model.step(sequence[:, t], state)
+        print("Incremental steps match the full sequence:", torch.allclose(stepped, outputs[:, -1], atol=1e-6))
+
+        # A missing frame leaves the state as it was
+        valid = torch.ones(2, 10, dtype=torch.bool)
+        valid[:, 5] = False
+        gapped, _ = model(sequence, valid=valid)
+        print("Output at a missing frame repeats the previous one:", torch.allclose(gapped[:, 5], gapped[:, 4]))
+    print(f"ConvLSTM - Num params: {sum(p.numel() for p in model.parameters()):,}")
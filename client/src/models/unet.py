@@ -1,6 +1,11 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import time
+import argparse
+import functools
+import contextlib
+from torch.utils.checkpoint import checkpoint
 
 class DoubleConv(nn.Module):
     """(convolution => [BN] => ReLU) * 2"""
@@ -89,8 +94,10 @@ class UNet(nn.Module): # Renamed from UNetCorrected for final use
         self.up3 = Up(256, 128, 128, bilinear)
         self.up4 = Up(128, 64, 64, bilinear)
         self.outc = OutConv(64, n_classes)
+        self.checkpoint_stages = ()
 
-    def forward(self, x):
+    def forward(self, x, return_logits=False):
+        """Class probabilities, or the raw logits with return_logits (for numerically stable losses)."""
         x1 = self.inc(x)        # Skip connection 1 (64 channels)
         x2 = self.down1(x1)     # Skip connection 2 (128 channels)
         x3 = self.down2(x2)     # Skip connection 3 (256 channels)
@@ -102,37 +109,116 @@ class UNet(nn.Module): # Renamed from UNetCorrected for final use
         x = self.up3(x, x2)
         x = self.up4(x, x1)
         logits = self.outc(x)
+        if return_logits:
+            return logits
 
         if self.n_classes == 1: # Binary segmentation (cloud vs no-cloud)
             return torch.sigmoid(logits)
         else: # Multi-class segmentation
             return F.softmax(logits, dim=1) # Apply softmax if multi-class output probabilities are desired
 
-    # Optional: for gradient checkpointing to save memory during training
-    def use_checkpointing(self):
-        self.inc = torch.utils.checkpoint.checkpoint(self.inc)
-        self.down1 = torch.utils.checkpoint.checkpoint(self.down1)
-        self.down2 = torch.utils.checkpoint.checkpoint(self.down2)
-        self.down3 = torch.utils.checkpoint.checkpoint(self.down3)
-        self.down4 = torch.utils.checkpoint.checkpoint(self.down4)
-        # For Up blocks, need to pass function and then inputs.
-        # checkpoint requires static methods or functions, or use_reentrant=True for nn.Module methods
-        # A common way is to wrap the forward of the module.
-        # For simplicity here, if use_reentrant=True is acceptable (default in older PyTorch for modules):
-        if hasattr(torch.utils.checkpoint, 'checkpoint_ Yeşilırmak'): # Check for a non-existent attr to simulate older pytorch
-             self.up1 = torch.utils.checkpoint.checkpoint(self.up1.forward)
-             self.up2 = torch.utils.checkpoint.checkpoint(self.up2.forward)
-             self.up3 = torch.utils.checkpoint.checkpoint(self.up3.forward)
-             self.up4 = torch.utils.checkpoint.checkpoint(self.up4.forward)
-        else: # PyTorch 1.11+ recommends use_reentrant=False for nn.Sequential or custom modules if possible
-             self.up1 = torch.utils.checkpoint.checkpoint(self.up1, use_reentrant=True) # Simpler for now
-             self.up2 = torch.utils.checkpoint.checkpoint(self.up2, use_reentrant=True)
-             self.up3 = torch.utils.checkpoint.checkpoint(self.up3, use_reentrant=True)
-             self.up4 = torch.utils.checkpoint.checkpoint(self.up4, use_reentrant=True)
-        self.outc = torch.utils.checkpoint.checkpoint(self.outc)
+    # --- Gradient checkpointing ---
+    # Checkpointed stages drop their intermediate activations in the forward pass and recompute them during
+    # backward, trading compute for memory. Each stage's `forward` is wrapped on the instance, so module
+    # names and state_dict keys are unchanged. UNet FLOPs are roughly equal per level while activations
+    # shrink 4x per level, so the shallow stages ("shallow") give most of the saving for the least recompute.
+    # The recompute pass restores BatchNorm running statistics afterwards, so they get one update per step
+    # exactly as without checkpointing.
+    CHECKPOINT_STAGES = ("inc", "down1", "down2", "down3", "down4", "up1", "up2", "up3", "up4")
+    CHECKPOINT_POLICIES = {
+        "none": (),
+        "all": CHECKPOINT_STAGES,
+        "encoder": ("inc", "down1", "down2", "down3", "down4"),
+        "decoder": ("up1", "up2", "up3", "up4"),
+        "shallow": ("inc", "down1", "up3", "up4"),
+    }
+
+    def use_checkpointing(self, stages="all"):
+        """
+        Enables activation checkpointing for `stages`: a policy name from CHECKPOINT_POLICIES, or an
+        iterable of stage names from CHECKPOINT_STAGES. "none" disables it. Only active while training
+        with gradients enabled; eval/inference runs the plain forward.
+        """
+        if isinstance(stages, str):
+            if stages not in self.CHECKPOINT_POLICIES:
+                raise ValueError(f"Unknown checkpoint policy '{stages}'. Choose from {list(self.CHECKPOINT_POLICIES)}")
+            stages = self.CHECKPOINT_POLICIES[stages]
+        unknown = set(stages) - set(self.CHECKPOINT_STAGES)
+        if unknown:
+            raise ValueError(f"Unknown UNet stages {sorted(unknown)}. Choose from {list(self.CHECKPOINT_STAGES)}")
+
+        for name in self.CHECKPOINT_STAGES:
+            module = getattr(self, name)
+            module.__dict__.pop("forward", None)  # Restore the class forward
+            if name in stages:
+                module.forward = functools.partial(_checkpointed_call, module, module.forward)
+        self.checkpoint_stages = tuple(name for name in self.CHECKPOINT_STAGES if name in stages)
+        return self
+
+
+@contextlib.contextmanager
+def _frozen_batchnorm_stats(module):
+    """Undo the BatchNorm running-statistics update made by a checkpoint's recomputed forward."""
+    saved = [(buffer, buffer.clone()) for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)
+             for buffer in m.buffers()]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for buffer, value in saved:
+                buffer.copy_(value)
+
+
+def _checkpointed_call(module, forward, *inputs):
+    if module.training and torch.is_grad_enabled():
+        return checkpoint(forward, *inputs, use_reentrant=False,
+                          context_fn=lambda: (contextlib.nullcontext(), _frozen_batchnorm_stats(module)))
+    return forward(*inputs)
+
+
+def saved_activation_bytes(model, inputs):
+    """Bytes of tensors autograd keeps for backward in one training forward pass (the activation memory peak)."""
+    total = [0]
+    seen = set()
+
+    def pack(tensor):
+        key = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape))
+        if key not in seen:  # Count tensors saved by several ops once
+            seen.add(key)
+            total[0] += tensor.numel() * tensor.element_size()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        output = model(inputs)
+    return total[0], output
+
+
+def benchmark_checkpointing(sizes=(512, 1024), policies=("none", "shallow", "all"), n_channels=1, batch_size=1):
+    """Saved-activation memory and forward+backward time of one training step per tile size and policy."""
+    results = []
+    for size in sizes:
+        x = torch.randn(batch_size, n_channels, size, size)
+        for policy in policies:
+            model = UNet(n_channels=n_channels, n_classes=1).train().use_checkpointing(policy)
+            start = time.perf_counter()
+            activation_bytes, output = saved_activation_bytes(model, x)
+            output.mean().backward()
+            elapsed = time.perf_counter() - start
+            results.append({"size": size, "policy": policy, "activation_mb": activation_bytes / 2 ** 20, "seconds": elapsed})
+            print(f"{size}x{size} {policy:>8}: {activation_bytes / 2 ** 20:8.0f} MB saved activations, {elapsed:6.1f} s per step")
+    return results
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="UNet demo, or gradient checkpointing benchmark.")
+    parser.add_argument("--benchmark_checkpointing", action="store_true", help="Measure activation memory/time per checkpoint policy")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024], help="Tile sizes for the benchmark")
+    parser.add_argument("--policies", type=str, nargs="+", default=["none", "shallow", "all"], choices=list(UNet.CHECKPOINT_POLICIES))
+    args = parser.parse_args()
+    if args.benchmark_checkpointing:
+        benchmark_checkpointing(args.sizes, args.policies)
+        raise SystemExit
+
     # Example Usage
     dummy_input_1channel = torch.randn(2, 1, 256, 256) # Batch_size=2, Channels=1, Height=256, Width=256
 
@@ -164,5 +250,18 @@ if __name__ == '__main__':
     print("UNet (1 channel in, 3 classes out, bilinear=F) - Output shape:", output_1c_3class.shape)
     print("Output values (sum should be ~1 for each pixel if softmaxed):", output_1c_3class[0, :, 0, 0].sum().item() if output_1c_3class.shape[1] > 1 else "N/A for binary")
 
+    # Gradient checkpointing: same outputs and gradients, fewer stored activations
+    model_checkpointed = UNet(n_channels=1, n_classes=1, bilinear=False).use_checkpointing("shallow")
+    model_checkpointed.load_state_dict(model_convtranspose.state_dict())
+    model_checkpointed(dummy_input_1channel).mean().backward()
+    model_convtranspose.zero_grad()
+    model_convtranspose(dummy_input_1channel).mean().backward()
+    max_grad_diff = max((a.grad - b.grad).abs().max().item() for a, b in
+                        zip(model_checkpointed.parameters(), model_convtranspose.parameters()))
+    print(f"Checkpointed stages {model_checkpointed.checkpoint_stages}: max gradient difference {max_grad_diff:.2e}")
+    max_stat_diff = max((a - b).abs().max().item() for a, b in
+                        zip(model_checkpointed.buffers(), model_convtranspose.buffers()) if a.is_floating_point())
+    print(f"Checkpointed stages: max BatchNorm running-statistics difference {max_stat_diff:.2e}")
+
     print("\nU-Net model structure is defined and includes options for bilinear upsampling and gradient checkpointing.")
     print("The implementation uses DoubleConv, Down, Up, and OutConv helper modules.")
@@ -0,0 +1,234 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# Dataset-wide normalization.
+#
+# Normalizing each array by its own min/max or mean/std gives every patch a different scale and needs the
+# whole array in memory. Instead, one streaming pass over the training archive accumulates per-(sensor, band)
+# statistics - Welford mean/variance, running min/max and a mergeable histogram for approximate quantiles -
+# from chunked reads, and the result is frozen into a FittedNormalizer saved as JSON. Preprocessing, training,
+# validation and live inference all apply that same artifact.
+
+NORMALIZER_VERSION = 1
+_HIST_BINS = 2048
+
+
+class StreamingHistogram:
+    """Fixed number of bins over a range that doubles whenever data falls outside it (merging bin pairs)."""
+
+    def __init__(self, bins=_HIST_BINS):
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.lo = self.hi = None
+
+    def _grow_to(self, vmin, vmax):
+        if self.lo is None:
+            span = max(vmax - vmin, 1e-6)
+            self.lo, self.hi = vmin, vmin + span * (1 + 1e-6)
+            return
+        while vmin < self.lo or vmax >= self.hi:
+            width = self.hi - self.lo
+            merged = self.counts.reshape(-1, 2).sum(axis=1)
+            pad = np.zeros(self.bins // 2, dtype=np.int64)
+            if vmin < self.lo:
+                self.counts = np.concatenate([pad, merged])
+                self.lo -= width
+            else:
+                self.counts = np.concatenate([merged, pad])
+                self.hi += width
+
+    def update(self, values, weights=None):
+        if values.size == 0:
+            return
+        self._grow_to(float(values.min()), float(values.max()))
+        counts, _ = np.histogram(values, bins=self.bins, range=(self.lo, self.hi), weights=weights)
+        self.counts += counts.astype(np.int64)
+
+    def merge(self, other):
+        if other.lo is None:
+            return
+        width = (other.hi - other.lo) / other.bins
+        centres = other.lo + (np.arange(other.bins) + 0.5) * width
+        nonzero = other.counts > 0
+        self.update(centres[nonzero], weights=other.counts[nonzero])
+
+    def quantile(self, q):
+        total = self.counts.sum()
+        if total == 0:
+            return float("nan")
+        cdf = np.cumsum(self.counts) / total
+        i = int(np.searchsorted(cdf, q))
+        prev = cdf[i - 1] if i > 0 else 0.0
+        frac = (q - prev) / max(cdf[i] - prev, 1e-12)
+        width = (self.hi - self.lo) / self.bins
+        return float(self.lo + (i + frac) * width)
+
+
+class RunningBandStats:
+    """Mergeable running statistics of one band: count, mean, M2 (Welford/Chan), min, max, histogram."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.hist = StreamingHistogram()
+
+    def update(self, values):
+        values = np.asarray(values).ravel()
+        if values.dtype.kind == "f":
+            values = values[np.isfinite(values)]
+        n = values.size
+        if n == 0:
+            return
+        chunk_mean = float(values.mean(dtype=np.float64))
+        chunk_m2 = float(values.var(dtype=np.float64)) * n
+        self._combine(n, chunk_mean, chunk_m2)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.hist.update(values)
+
+    def _combine(self, n, mean, m2):
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        self._combine(other.count, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.hist.merge(other.hist)
+
+    @property
+    def std(self):
+        return (self.m2 / self.count) ** 0.5 if self.count else float("nan")
+
+    def summary(self, quantiles=(0.01, 0.99)):
+        return {"count": self.count, "mean": self.mean, "std": self.std, "min": self.min, "max": self.max,
+                "q_low": self.hist.quantile(quantiles[0]), "q_high": self.hist.quantile(quantiles[1])}
+
+
+class NormalizationStats:
+    """RunningBandStats per (sensor, band); merge() combines passes computed in different workers."""
+
+    def __init__(self):
+        self.bands = {}  # (sensor, band) -> RunningBandStats
+
+    def update(self, sensor, band, values):
+        self.bands.setdefault((sensor, band), RunningBandStats()).update(values)
+
+    def merge(self, other):
+        for key, stats in other.bands.items():
+            self.bands.setdefault(key, RunningBandStats()).merge(stats)
+        return self
+
+    def fit(self, method="min_max", feature_range=(0, 1), quantiles=(0.01, 0.99)):
+        params = {}
+        for (sensor, band), stats in sorted(self.bands.items()):
+            params.setdefault(sensor, {})[band] = stats.summary(quantiles)
+        return FittedNormalizer(method, feature_range, quantiles, params)
+
+
+class FittedNormalizer:
+    """
+    Frozen per-(sensor, band) normalization.
+    method: "min_max" (dataset min/max), "quantile" (robust: q_low/q_high, values outside are clipped)
+            -> both map into feature_range; "z_score" -> (x - mean) / std.
+    """
+
+    def __init__(self, method, feature_range, quantiles, params):
+        if method not in ("min_max", "quantile", "z_score"):
+            raise ValueError(f"Unknown normalization method: {method}")
+        self.method = method
+        self.feature_range = tuple(feature_range)
+        self.quantiles = tuple(quantiles)
+        self.params = params  # sensor -> band -> summary dict
+
+    def _scale_offset(self, sensor, band):
+        try:
+            p = self.params[sensor][band]
+        except KeyError:
+            raise KeyError(f"Normalizer has no statistics for {sensor}/{band}; refit it over the archive") from None
+        if self.method == "z_score":
+            return p["mean"], 1.0 / max(p["std"], 1e-6), 0.0
+        lo, hi = (p["min"], p["max"]) if self.method == "min_max" else (p["q_low"], p["q_high"])
+        a, b = self.feature_range
+        return lo, (b - a) / max(hi - lo, 1e-6), a
+
+    def apply(self, data, sensor, bands, channel_axis=-1, out=None):
+        """
+        Normalizes `data` whose `channel_axis` enumerates `bands` (a 2-D array is a single band).
+        Works in float32, in place when `out` is data itself. NaN (off-disk/fill pixels) becomes the bottom of
+        feature_range (the mean for z_score), so models never see NaN.
+        """
+        if out is None:
+            out = np.array(data, dtype=np.float32, copy=True)
+        elif out is not data:
+            out[...] = data
+        if out.ndim == 2:
+            channels = [out]
+        else:  # Basic indexing, so every channel is a view into `out`
+            channels = [out[(slice(None),) * (channel_axis % out.ndim) + (i,)] for i in range(len(bands))]
+        for channel, band in zip(channels, bands):
+            offset, scale, base = self._scale_offset(sensor, band)
+            channel -= np.float32(offset)
+            channel *= np.float32(scale)
+            if base:
+                channel += np.float32(base)
+            if self.method != "z_score":
+                np.clip(channel, *self.feature_range, out=channel)
+            np.nan_to_num(channel, copy=False, nan=0.0 if self.method == "z_score" else self.feature_range[0])
+        return out
+
+    def to_dict(self):
+        return {"version": NORMALIZER_VERSION, "method": self.method, "feature_range": list(self.feature_range),
+                "quantiles": list(self.quantiles), "params": self.params}
+
+    def fingerprint(self):
+        return hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()[:16]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != NORMALIZER_VERSION:
+            raise ValueError(f"Normalizer {path} has version {data.get('version')}, expected {NORMALIZER_VERSION}")
+        return cls(data["method"], data["feature_range"], data["quantiles"], data["params"])
+
+
+_loaded = {}
+
+
+def load_normalizer(path):
+    """Cached per process (keyed by path and mtime), or None if no normalizer has been fitted yet."""
+    if not path or not os.path.isfile(path):
+        return None
+    key = (path, os.stat(path).st_mtime_ns)
+    if key not in _loaded:
+        _loaded[key] = FittedNormalizer.load(path)
+    return _loaded[key]
+
+
+def frame_normalizer(path, sensor, bands, channel_axis=0):
+    """
+    Callable applying the fitted normalizer at `path` to frames of calibrated `bands` from `sensor`: the hook
+    live inference (realtime.py, temporal.py) uses to scale frames exactly as the training patches were.
+    """
+    normalizer = load_normalizer(path)
+    if normalizer is None:
+        raise FileNotFoundError(f"No fitted normalizer at {path}; fit one with process.py --fit_normalizer")
+    return lambda frame: normalizer.apply(frame, sensor, bands, channel_axis=channel_axis)
@@ -0,0 +1,312 @@
+import os
+import json
+import argparse
+import numpy as np
+
+# Packed patch store: instead of one .npy per patch (thousands of tiny files, slow on NFS),
+# patches are appended to a few large raw binary shards and read back through np.memmap.
+#
+# Layout of a store directory:
+#   index.json            - dtypes, per-sample shapes, shard list and per-sample source/key
+#   images_<prefix>_<n>.bin - contiguous (count, *image_shape) arrays
+#   masks_<prefix>_<n>.bin  - contiguous (count, *mask_shape) arrays
+#
+# Shard i holds samples [offsets[i], offsets[i+1]) of the global sample order.
+
+INDEX_FILENAME = "index.json"
+STORE_VERSION = 1
+
+
+def _normalize_image(image):
+    """(H, W) or (H, W, C) -> (C, H, W), the layout UNet expects."""
+    if image.ndim == 2:
+        return image[np.newaxis]
+    if image.ndim == 3 and image.shape[-1] < image.shape[0] and image.shape[-1] < image.shape[1]:
+        return np.transpose(image, (2, 0, 1))
+    return image
+
+
+def _normalize_mask(mask):
+    """(H, W) or (1, H, W) or anything squeezable to (H, W) -> (1, H, W)."""
+    if mask.ndim == 3 and mask.shape[0] == 1:
+        return mask
+    mask = np.squeeze(mask)
+    if mask.ndim != 2:
+        raise ValueError(f"Mask has unexpected shape {mask.shape} after squeeze")
+    return mask[np.newaxis]
+
+
+def read_store_index(store_dir):
+    with open(os.path.join(store_dir, INDEX_FILENAME)) as f:
+        return json.load(f)
+
+
+def write_store_index(store_dir, index):
+    """Atomically replaces index.json so readers never see a half-written index."""
+    tmp_path = os.path.join(store_dir, INDEX_FILENAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(store_dir, INDEX_FILENAME))
+
+
+def is_patch_store(store_dir):
+    return os.path.isfile(os.path.join(store_dir, INDEX_FILENAME))
+
+
+class PatchShardWriter:
+    """
+    Streams fixed-shape (image, mask) patch pairs into raw binary shards.
+
+    Samples are written straight to the open shard file, so memory use is one patch at a time
+    regardless of shard size. `prefix` keeps shard filenames unique when several writers
+    (e.g. one per preprocessing worker) share a store directory.
+    With append=True, the existing index.json is extended rather than replaced.
+    """
+
+    def __init__(self, store_dir, shard_size=4096, image_dtype=np.float32, mask_dtype=np.uint8,
+                 prefix="part", append=False, write_index=True):
+        self.store_dir = store_dir
+        self.shard_size = shard_size
+        self.image_dtype = np.dtype(image_dtype)
+        self.mask_dtype = np.dtype(mask_dtype)
+        self.prefix = prefix
+        self.write_index = write_index
+        os.makedirs(store_dir, exist_ok=True)
+
+        self.index = None
+        if append and is_patch_store(store_dir):
+            self.index = read_store_index(store_dir)
+            self.image_dtype = np.dtype(self.index["image_dtype"])
+            self.mask_dtype = np.dtype(self.index["mask_dtype"])
+
+        self.image_shape = tuple(self.index["image_shape"]) if self.index else None
+        self.mask_shape = tuple(self.index["mask_shape"]) if self.index else None
+        self.shards = []   # Shards written by this writer
+        self.sources = []
+        self.keys = []
+        self._image_file = None
+        self._mask_file = None
+        self._current_count = 0
+        self._shard_seq = self._first_free_shard_seq()
+
+    def _first_free_shard_seq(self):
+        taken = set(os.listdir(self.store_dir))
+        seq = 0
+        while f"images_{self.prefix}_{seq:05d}.bin" in taken:
+            seq += 1
+        return seq
+
+    def _open_shard(self):
+        name = f"{self.prefix}_{self._shard_seq:05d}"
+        self._shard_seq += 1
+        self.shards.append({"images": f"images_{name}.bin", "masks": f"masks_{name}.bin", "count": 0})
+        self._image_file = open(os.path.join(self.store_dir, self.shards[-1]["images"]), "wb")
+        self._mask_file = open(os.path.join(self.store_dir, self.shards[-1]["masks"]), "wb")
+        self._current_count = 0
+
+    def _close_shard(self):
+        if self._image_file is None:
+            return
+        self._image_file.close()
+        self._mask_file.close()
+        self._image_file = self._mask_file = None
+        self.shards[-1]["count"] = self._current_count
+
+    def append(self, image, mask, source=None, key=None):
+        image = np.ascontiguousarray(_normalize_image(np.asarray(image)), dtype=self.image_dtype)
+        mask = np.ascontiguousarray(_normalize_mask(np.asarray(mask)), dtype=self.mask_dtype)
+
+        if self.image_shape is None:
+            self.image_shape, self.mask_shape = image.shape, mask.shape
+        if image.shape != self.image_shape or mask.shape != self.mask_shape:
+            raise ValueError(f"Patch shapes {image.shape}/{mask.shape} do not match store shapes "
+                             f"{self.image_shape}/{self.mask_shape}")
+
+        if self._image_file is None or self._current_count >= self.shard_size:
+            self._close_shard()
+            self._open_shard()
+        self._image_file.write(image.tobytes())
+        self._mask_file.write(mask.tobytes())
+        self._current_count += 1
+        self.shards[-1]["count"] = self._current_count
+        self.sources.append(source)
+        self.keys.append(key)
+
+    def extend(self, images, masks, source=None, keys=None):
+        """Appends a batch of patches, e.g. the (N, ...) output of create_patches."""
+        for i in range(len(images)):
+            self.append(images[i], masks[i], source=source, key=None if keys is None else keys[i])
+
+    def part_index(self):
+        """Index fragment describing only what this writer produced (used to merge parallel writers)."""
+        return {
+            "image_dtype": self.image_dtype.str,
+            "mask_dtype": self.mask_dtype.str,
+            "image_shape": list(self.image_shape) if self.image_shape else None,
+            "mask_shape": list(self.mask_shape) if self.mask_shape else None,
+            "shards": self.shards,
+            "sources": self.sources,
+            "keys": self.keys,
+        }
+
+    def close(self):
+        self._close_shard()
+        part = self.part_index()
+        if self.write_index and self.image_shape is not None:
+            write_store_index(self.store_dir, merge_index_parts([self.index, part]))
+        return part
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def merge_index_parts(parts):
+    """Concatenates index fragments (full indexes or PatchShardWriter.part_index()) into one index."""
+    parts = [p for p in parts if p and p.get("image_shape") is not None]
+    if not parts:
+        raise ValueError("No patches to index.")
+    first = parts[0]
+    for p in parts[1:]:
+        if (p["image_shape"] != first["image_shape"] or p["mask_shape"] != first["mask_shape"]
+                or p["image_dtype"] != first["image_dtype"] or p["mask_dtype"] != first["mask_dtype"]):
+            raise ValueError("Cannot merge patch store parts with different shapes or dtypes.")
+
+    merged = {
+        "version": STORE_VERSION,
+        "image_dtype": first["image_dtype"],
+        "mask_dtype": first["mask_dtype"],
+        "image_shape": first["image_shape"],
+        "mask_shape": first["mask_shape"],
+        "shards": [],
+        "sources": [],
+        "keys": [],
+    }
+    for p in parts:
+        merged["shards"].extend(s for s in p["shards"] if s["count"] > 0)
+        merged["sources"].extend(p["sources"])
+        merged["keys"].extend(p["keys"])
+    return merged
+
+
+class PatchShardStore:
+    """
+    Read side of the patch store. `get(idx)` returns (image, mask) NumPy views into the memory-mapped
+    shards - no file is opened per sample and nothing is copied until the batch is collated.
+
+    Memmaps are opened lazily on first access, so a store created in the main process can be handed
+    to DataLoader workers and each worker maps the shards itself after fork/spawn.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index = read_store_index(store_dir)
+        self.image_dtype = np.dtype(self.index["image_dtype"])
+        self.mask_dtype = np.dtype(self.index["mask_dtype"])
+        self.image_shape = tuple(self.index["image_shape"])
+        self.mask_shape = tuple(self.index["mask_shape"])
+        self.shards = self.index["shards"]
+        counts = np.array([s["count"] for s in self.shards], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.sources = self.index.get("sources") or [None] * int(self.offsets[-1])
+        self.keys = self.index.get("keys") or [None] * int(self.offsets[-1])
+        self._maps = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_maps"] = None  # Never pickle open mappings into worker processes
+        return state
+
+    def _open(self):
+        maps = []
+        for shard in self.shards:
+            count = shard["count"]
+            # mode="c" (copy-on-write) gives writable views, so torch.from_numpy can wrap them
+            # without a copy; pages are still only read from disk on first touch.
+            images = np.memmap(os.path.join(self.store_dir, shard["images"]), dtype=self.image_dtype,
+                               mode="c", shape=(count,) + self.image_shape)
+            masks = np.memmap(os.path.join(self.store_dir, shard["masks"]), dtype=self.mask_dtype,
+                              mode="c", shape=(count,) + self.mask_shape)
+            maps.append((images, masks))
+        self._maps = maps
+
+    def locate(self, idx):
+        """Global sample index -> (shard number, row within shard)."""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Patch index {idx} out of range for store of size {len(self)}")
+        shard = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        return shard, idx - int(self.offsets[shard])
+
+    def get(self, idx):
+        if self._maps is None:
+            self._open()
+        shard, row = self.locate(idx)
+        images, masks = self._maps[shard]
+        return images[row], masks[row]
+
+    def get_batch(self, indices):
+        """
+        (images, masks) arrays for a sequence of global indices, with one gather per shard touched. A run of
+        consecutive indices inside one shard comes back as views into the mapping, without a copy.
+        """
+        if self._maps is None:
+            self._open()
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) and (indices.min() < 0 or indices.max() >= len(self)):
+            raise IndexError(f"Patch indices out of range for store of size {len(self)}")
+        shards = np.searchsorted(self.offsets, indices, side="right") - 1
+        rows = indices - self.offsets[shards]
+        if len(indices) and shards[0] == shards[-1] and rows[-1] - rows[0] == len(rows) - 1 and np.all(np.diff(rows) == 1):
+            images, masks = self._maps[shards[0]]
+            return images[rows[0]:rows[-1] + 1], masks[rows[0]:rows[-1] + 1]
+
+        images = np.empty((len(indices),) + self.image_shape, dtype=self.image_dtype)
+        masks = np.empty((len(indices),) + self.mask_shape, dtype=self.mask_dtype)
+        for shard in np.unique(shards):
+            selected = np.flatnonzero(shards == shard)
+            shard_images, shard_masks = self._maps[shard]
+            images[selected] = shard_images[rows[selected]]
+            masks[selected] = shard_masks[rows[selected]]
+        return images, masks
+
+
+def convert_directory_to_shards(images_dir, masks_dir, store_dir, shard_size=4096, source=None,
+                                image_dtype=np.float32, mask_dtype=np.uint8):
+    """
+    Packs the legacy all_sources_images/all_sources_masks layout (one .npy per patch) into a
+    patch store. Images and masks are paired by sorted order, as train.py has always done.
+    Returns the number of converted samples.
+    """
+    image_files = sorted(f for f in os.listdir(images_dir) if f.endswith(".npy"))
+    mask_files = sorted(f for f in os.listdir(masks_dir) if f.endswith(".npy"))
+    if len(image_files) != len(mask_files):
+        raise ValueError(f"Found {len(image_files)} images but {len(mask_files)} masks; cannot pair them.")
+
+    with PatchShardWriter(store_dir, shard_size=shard_size, image_dtype=image_dtype,
+                          mask_dtype=mask_dtype) as writer:
+        for img_name, mask_name in zip(image_files, mask_files):
+            writer.append(np.load(os.path.join(images_dir, img_name)),
+                          np.load(os.path.join(masks_dir, mask_name)),
+                          source=source, key=os.path.splitext(img_name)[0])
+    return len(image_files)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert per-patch .npy directories into a sharded patch store.")
+    parser.add_argument("--images_dir", type=str, required=True, help="Directory with one image .npy per patch")
+    parser.add_argument("--masks_dir", type=str, required=True, help="Directory with one mask .npy per patch")
+    parser.add_argument("--store_dir", type=str, required=True, help="Output patch store directory")
+    parser.add_argument("--shard_size", type=int, default=4096, help="Samples per shard file")
+    parser.add_argument("--source", type=str, default=None, help="Data source name recorded for every sample")
+    args = parser.parse_args()
+
+    n = convert_directory_to_shards(args.images_dir, args.masks_dir, args.store_dir,
+                                    shard_size=args.shard_size, source=args.source)
+    print(f"Packed {n} patches into {os.path.abspath(args.store_dir)}")
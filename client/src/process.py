@@ -1,4 +1,6 @@
 import os
+import time
+import argparse
 import numpy as np
 # Common GIS and data handling libraries - install as needed
 # import xarray as xr # For NetCDF, GRIB - good for GOES, some INSAT
@@ -12,15 +14,39 @@ import numpy as np
 # Assuming config.py is in the same directory or accessible via PYTHONPATH
 # For this temp file, we'll simulate access to config variables
 try:
-    from config import RAW_DATA_DIR, PROCESSED_DATA_DIR, DATA_SOURCES
+    from config import (RAW_DATA_DIR, PROCESSED_DATA_DIR, DATA_SOURCES, PATCH_STORE_DIR, PATCH_SHARD_SIZE,
+                        PREPROCESS_WORKERS, PREPROCESS_SOURCE_LIMITS, PREPROCESS_STAGES, REPROJECTION_CACHE_DIR,
+                        NORMALIZER_PATH)
 except ImportError:
     print("Warning: config.py not found, using placeholder values for RAW_DATA_DIR, PROCESSED_DATA_DIR, DATA_SOURCES.")
     RAW_DATA_DIR = "data/raw_placeholder"
     PROCESSED_DATA_DIR = "data/processed_placeholder"
+    PATCH_STORE_DIR = "data/processed_placeholder/patch_store"
+    PATCH_SHARD_SIZE = 4096
+    PREPROCESS_WORKERS = None
+    PREPROCESS_SOURCE_LIMITS = {}
+    REPROJECTION_CACHE_DIR = "data/processed_placeholder/reprojection_cache"
+    NORMALIZER_PATH = "data/processed_placeholder/normalizer.json"
+    PREPROCESS_STAGES = {
+        "bands": {}, "calibrate": {},
+        "reproject": {"target_crs": "EPSG:4326", "target_resolution": None, "target_bounds": None, "method": "nearest"},
+        "labels": {"method": "threshold_based", "band": None, "bt_threshold": 240.0, "min_area": 1, "connectivity": 8},
+        "normalize": {"method": "min_max", "feature_range": [0, 1], "quantiles": [0.01, 0.99]},
+        "patches": {"patch_size": [256, 256], "overlap": 0.0, "pad_mode": "constant", "min_label_coverage": 0.0},
+    }
     DATA_SOURCES = { # Placeholder
         "isro_insat": {}, "nasa_goes": {}, "nasa_modis": {}, "esa_sentinel": {}
     }
 
+from patch_store import PatchShardWriter, merge_index_parts, write_store_index
+from scheduler import run_per_source_pool
+from manifest import PreprocessManifest, MANIFEST_FILENAME, config_hash
+from readers import open_satellite_file, SceneView
+from reprojection import get_engine as get_reprojection_engine
+from normalization import NormalizationStats, load_normalizer
+from calibration import build_calibration
+from labels import label_cold_clusters
+
 
 # Helper function to create directories
 def ensure_dir(directory_path):
@@ -30,60 +56,81 @@ def ensure_dir(directory_path):
 
 def load_satellite_data(filepath):
     """
-    Conceptual: Loads satellite data based on file extension.
-    This would need to be more robust, checking file types more accurately.
-    """
-    print(f"Conceptual: Loading data from {filepath}")
-    if filepath.endswith(('.nc', '.nc4')):
-        # return xr.open_dataset(filepath)
-        print("Conceptual: Would use xarray for NetCDF.")
-        return {"type": "netcdf", "path": filepath, "data": None} # Placeholder
-    elif filepath.endswith(('.hdf', '.h5')):
-        # return h5py.File(filepath, 'r')
-        print("Conceptual: Would use h5py or rasterio for HDF.")
-        return {"type": "hdf", "path": filepath, "data": None} # Placeholder
-    elif filepath.endswith(('.tif', '.tiff')):
-        # return rasterio.open(filepath)
-        print("Conceptual: Would use rasterio for GeoTIFF.")
-        return {"type": "geotiff", "path": filepath, "data": None} # Placeholder
-    else:
+    Opens a lazy, chunk-aware reader for a NetCDF/HDF5/GeoTIFF file (see readers.py), wrapped in a
+    SceneView. No pixel data is read here; later stages narrow the view and read only what they need.
+    Returns None for unsupported file types.
+    """
+    reader = open_satellite_file(filepath)
+    if reader is None:
         print(f"Unsupported file type: {filepath}")
         return None
+    print(f"Opened {reader.kind} reader for {filepath}")
+    return SceneView(reader)
 
 def select_bands(data_object_sim, data_source_name, bands_required):
     """
-    Conceptual: Selects specified bands from the data object.
-    'bands_required' could be a list of band names or indices.
+    Narrows the scene to the given bands (names, or unambiguous fragments such as "TIR1" for "IMG_TIR1").
+    Only these bands are ever read from disk.
     """
-    print(f"Conceptual: Selecting bands {bands_required} for {data_source_name} from {data_object_sim['type']}.")
-    # Example for xarray: selected_data = data_object[bands_required]
-    # Example for rasterio: data_array = data_object.read(band_indices)
-    return data_object_sim # Placeholder, actual data would be modified
+    if not bands_required:
+        return data_object_sim
+    print(f"Selecting bands {bands_required} for {data_source_name} from {data_object_sim.kind}.")
+    return data_object_sim.select(bands_required)
 
 def calibrate_to_physical_values(data_object_sim, data_source_name, metadata=None):
     """
-    Conceptual: Converts raw digital numbers to radiance, brightness temp, or reflectance.
-    Requires scale factors, offsets, etc., often found in metadata.
+    Converts raw digital numbers to brightness temperature, radiance or reflectance (see calibration.py).
+    'metadata' is the per-band calibration spec, by default PREPROCESS_STAGES["calibrate"][data_source_name].
+    Each selected band gets a table/multiply-add transform built once from the file's attributes and LUTs;
+    it runs as the band is read, so counts are never widened beyond float32.
     """
-    print(f"Conceptual: Calibrating {data_source_name} data from {data_object_sim['type']}.")
-    # This is highly sensor-specific.
-    # E.g., brightness_temp = (DN * scale_factor) + offset
-    return data_object_sim # Placeholder
-
-def reproject_to_common_grid(data_object_sim, data_source_name, target_crs="EPSG:4326", target_resolution=None):
+    specs = metadata if metadata is not None else PREPROCESS_STAGES.get("calibrate", {}).get(data_source_name, {})
+    reader = data_object_sim.reader
+    resolved = {}
+    for name, spec in specs.items():
+        try:
+            resolved[reader.resolve_band(name)] = spec
+        except KeyError:
+            pass  # Band not in this file
+    specs = resolved
+    for band in data_object_sim.bands:
+        if band not in specs:
+            print(f"Warning: no calibration spec for {data_source_name} band {band}; keeping raw counts.")
+            continue
+        calibration = build_calibration(reader, band, specs[band])
+        data_object_sim = data_object_sim.add_transform(band, calibration)
+        data_object_sim.meta["quantities"] = dict(data_object_sim.meta.get("quantities", {}), **{band: calibration.quantity})
+    print(f"Calibrating {data_source_name} data from {data_object_sim.kind}: "
+          f"{', '.join(f'{b}: {c}' for b, fns in data_object_sim.transforms.items() for c in fns)}")
+    return data_object_sim
+
+def reproject_to_common_grid(data_object_sim, data_source_name, target_crs="EPSG:4326", target_resolution=None,
+                             target_bounds=None, method="nearest"):
     """
-    Conceptual: Reprojects data to a common Coordinate Reference System (CRS) and resolution.
+    Reprojects the scene onto a regular grid in `target_crs` (see reprojection.py).
+    The source->target lookup table is built once per sensor geometry and cached in memory and under
+    REPROJECTION_CACHE_DIR; each scene then costs one gather per band, done lazily when bands are read.
+    target_resolution=None keeps the source pixel spacing; target_bounds=None covers the source footprint.
     """
-    print(f"Conceptual: Reprojecting {data_source_name} data from {data_object_sim['type']} to CRS {target_crs}.")
-    # Using rasterio.warp.reproject or rioxarray.reproject
-    return data_object_sim # Placeholder
+    print(f"Reprojecting {data_source_name} data from {data_object_sim.kind} to CRS {target_crs}.")
+    engine = get_reprojection_engine(REPROJECTION_CACHE_DIR)
+    table = engine.get_table(data_object_sim.reader, data_object_sim.bands[0], data_source_name, target_crs,
+                             target_resolution, target_bounds, method)
+    return data_object_sim.with_regrid(table)
 
-def normalize_data(data_array_sim, method="min_max", feature_range=(0, 1)):
+def normalize_data(data_array_sim, method="min_max", feature_range=(0, 1), normalizer=None, sensor=None, bands=None):
     """
-    Conceptual: Normalizes pixel values (e.g., to 0-1 range or z-score).
-    'data_array_sim' is expected to be a NumPy array here.
+    Normalizes pixel values (e.g., to 0-1 range or z-score).
+    'data_array_sim' is expected to be a NumPy array here, (H, W) or (H, W, C) with channels = `bands`.
+
+    With a fitted `normalizer` (normalization.FittedNormalizer, see fit_normalizer) the dataset-wide
+    per-(sensor, band) statistics are applied, so every scene, patch and live frame shares one scale.
+    Without one, falls back to statistics of this array alone.
     """
-    print(f"Conceptual: Normalizing data using {method} method.")
+    if normalizer is not None:
+        return normalizer.apply(data_array_sim, sensor, bands)
+
+    print(f"Warning: no fitted normalizer; normalizing with per-array {method} statistics.")
     if not isinstance(data_array_sim, np.ndarray): # Simulate if not actual array
         data_array_sim = np.random.rand(10,10)
 
@@ -92,46 +139,134 @@ def normalize_data(data_array_sim, method="min_max", feature_range=(0, 1)):
         # reshaped_data = data_array_sim.reshape(-1, 1)
         # normalized = scaler.fit_transform(reshaped_data).reshape(data_array_sim.shape)
         # return normalized
-        return (data_array_sim - np.min(data_array_sim)) / (np.max(data_array_sim) - np.min(data_array_sim) + 1e-6) # Simple min-max
+        # NaN-aware statistics: off-disk pixels from reprojection are NaN, and end up at the bottom of the range
+        lo, hi = np.nanmin(data_array_sim), np.nanmax(data_array_sim)
+        normalized = (data_array_sim - lo) / (hi - lo + 1e-6) # Simple min-max
+        return np.nan_to_num(normalized, copy=False, nan=0.0)
     elif method == "z_score":
         # scaler = StandardScaler()
         # reshaped_data = data_array_sim.reshape(-1, 1)
         # normalized = scaler.fit_transform(reshaped_data).reshape(data_array_sim.shape)
         # return normalized
-        mean = np.mean(data_array_sim)
-        std = np.std(data_array_sim)
-        return (data_array_sim - mean) / (std + 1e-6)
+        mean = np.nanmean(data_array_sim)
+        std = np.nanstd(data_array_sim)
+        return np.nan_to_num((data_array_sim - mean) / (std + 1e-6), copy=False, nan=0.0)
     return data_array_sim # Placeholder
 
-def create_patches(image_array_sim, label_array_sim=None, patch_size=(256, 256), stride=None):
+class PatchGrid:
+    """
+    Sequence of patches taken from a strided sliding-window view of a scene.
+    Indexing returns a view into the (padded) scene, never a copy; use to_array() to materialize.
+    `origins` holds the (row, col) of each patch's top-left corner in the padded scene.
+    """
+
+    def __init__(self, windows, origins, stride):
+        self.windows = windows  # (n_rows, n_cols, ph, pw[, C]) view
+        self.origins = origins  # (N, 2) int array, row-major order
+        self.stride = stride
+        self._grid_idx = origins // np.asarray(stride)
+
+    def __len__(self):
+        return len(self.origins)
+
+    def __getitem__(self, i):
+        r, c = self._grid_idx[i]
+        return self.windows[r, c]
+
+    def __iter__(self):
+        for r, c in self._grid_idx:
+            yield self.windows[r, c]
+
+    def to_array(self):
+        return self.windows[self._grid_idx[:, 0], self._grid_idx[:, 1]]
+
+
+def _resolve_stride(patch_size, stride, overlap):
+    if stride is not None:
+        return (stride, stride) if np.isscalar(stride) else tuple(stride)
+    if overlap:
+        if not 0 <= overlap < 1:
+            raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+        return tuple(max(1, int(round(p * (1 - overlap)))) for p in patch_size)
+    return tuple(patch_size)  # Non-overlapping by default
+
+
+def _window_sums(mask, patch_size, origins):
+    """Per-window sum of `mask` at every origin via a summed-area table - no window is materialized."""
+    ph, pw = patch_size
+    sat = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(mask, axis=0, dtype=np.int64), axis=1, out=sat[1:, 1:])
+    r, c = origins[:, 0], origins[:, 1]
+    return sat[r + ph, c + pw] - sat[r, c + pw] - sat[r + ph, c] + sat[r, c]
+
+
+def create_patches(image_array_sim, label_array_sim=None, patch_size=(256, 256), stride=None, overlap=None,
+                   pad_mode="constant", min_label_coverage=0.0):
     """
-    Conceptual: Creates smaller patches from a larger image and corresponding label mask.
+    Tiles a scene (H, W) or (H, W, C) and its optional (H, W) label mask into patches.
+
+    Patches come from numpy's sliding_window_view, so image and label patches are strided views of
+    the scene rather than per-patch copies. `stride` (int or (sy, sx)) wins over `overlap`
+    (fraction of the patch shared with its neighbour, e.g. 0.5). With `pad_mode` ("constant",
+    "reflect", "edge", ...) the bottom/right edges are padded so the whole scene is covered;
+    pad_mode=None drops the remainder instead. Labels are always padded with 0 (no cloud).
+    Patches whose label coverage (fraction of non-zero label pixels) is below `min_label_coverage`
+    are dropped. Returns (PatchGrid, PatchGrid or None).
     """
     print(f"Conceptual: Creating patches of size {patch_size}.")
     if not isinstance(image_array_sim, np.ndarray): # Simulate
         image_array_sim = np.random.rand(patch_size[0]*2, patch_size[1]*2)
     if label_array_sim is not None and not isinstance(label_array_sim, np.ndarray):
         label_array_sim = np.random.randint(0, 2, size=(patch_size[0]*2, patch_size[1]*2))
-
-    if stride is None:
-        stride = patch_size[0] # Non-overlapping by default
-
-    patches = []
-    label_patches = []
-    # Simulate creating one patch
-    patches.append(image_array_sim[:patch_size[0], :patch_size[1]])
+    if label_array_sim is not None and label_array_sim.shape[:2] != image_array_sim.shape[:2]:
+        raise ValueError(f"Label shape {label_array_sim.shape} does not match image shape {image_array_sim.shape}")
+
+    ph, pw = patch_size
+    sy, sx = _resolve_stride(patch_size, stride, overlap)
+    height, width = image_array_sim.shape[:2]
+
+    if pad_mode is not None:
+        # Smallest padding so that the last window ends exactly at the (padded) edge
+        pad_h = max(ph - height, 0) + (-(max(height, ph) - ph)) % sy
+        pad_w = max(pw - width, 0) + (-(max(width, pw) - pw)) % sx
+        if pad_h or pad_w:
+            spatial_pad = ((0, pad_h), (0, pad_w))
+            image_array_sim = np.pad(image_array_sim, spatial_pad + ((0, 0),) * (image_array_sim.ndim - 2), mode=pad_mode)
+            if label_array_sim is not None:
+                label_array_sim = np.pad(label_array_sim, spatial_pad, mode="constant")
+    elif height < ph or width < pw:
+        raise ValueError(f"Scene {height}x{width} is smaller than patch size {patch_size} and pad_mode is None")
+
+    # (n_rows, n_cols, [C,] ph, pw) -> keep channels last so each patch has the input's layout
+    windows = np.lib.stride_tricks.sliding_window_view(image_array_sim, (ph, pw), axis=(0, 1))[::sy, ::sx]
+    if image_array_sim.ndim == 3:
+        windows = np.moveaxis(windows, 2, -1)
+
+    rows = np.arange(windows.shape[0]) * sy
+    cols = np.arange(windows.shape[1]) * sx
+    origins = np.stack(np.meshgrid(rows, cols, indexing="ij"), axis=-1).reshape(-1, 2)
+
+    label_windows = None
     if label_array_sim is not None:
-        label_patches.append(label_array_sim[:patch_size[0], :patch_size[1]])
-        return patches, label_patches
+        label_windows = np.lib.stride_tricks.sliding_window_view(label_array_sim, (ph, pw))[::sy, ::sx]
+        if min_label_coverage > 0:
+            coverage = _window_sums(label_array_sim != 0, patch_size, origins) / float(ph * pw)
+            origins = origins[coverage >= min_label_coverage]
+
+    patches = PatchGrid(windows, origins, (sy, sx))
+    if label_windows is not None:
+        return patches, PatchGrid(label_windows, origins, (sy, sx))
     return patches, None
 
 
-def generate_or_load_labels(data_object_sim, data_source_name, raw_filepath, method="threshold_based"):
+def generate_or_load_labels(data_object_sim, data_source_name, raw_filepath, method="threshold_based", band=None,
+                            bt_threshold=240.0, min_area=1, connectivity=8, bt=None):
     """
-    Conceptual: Generates or loads labels/masks for cloud clusters.
-    This is a CRITICAL and COMPLEX step.
+    Generates or loads labels/masks for cloud clusters, on the scene's (reprojected) grid.
+    "threshold_based": pixels of the calibrated IR `band` colder than `bt_threshold` K, grouped into
+    connected clusters of at least `min_area` pixels (see labels.py). Pass `bt` if the band is already read.
     """
-    print(f"Conceptual: Generating/loading labels for {data_source_name} from {data_object_sim['path']} using {method} method.")
+    print(f"Generating labels for {data_source_name} from {data_object_sim.path} using {method} method.")
     # Option 1: Load existing labels if they exist (e.g., from a parallel directory)
     # label_path = raw_filepath.replace("raw", "labels").replace(".nc", "_mask.png") # Example
     # if os.path.exists(label_path): return load_mask(label_path) # load_mask would be another helper
@@ -141,37 +276,87 @@ def generate_or_load_labels(data_object_sim, data_source_name, raw_filepath, met
     #    cloud_mask_product_path = find_corresponding_cloud_mask(raw_filepath) # Helper needed
     #    if cloud_mask_product_path: return load_modis_cloud_mask(cloud_mask_product_path) # Helper needed
 
-    # Option 3: Rule-based (e.g., IR temperature threshold for high clouds)
-    # if method == "threshold_based" and data_object_sim.get("data_calibrated") is not None: # Assuming calibration happened
-    #    bt_band_sim = data_object_sim["data_calibrated"]["brightness_temp_band_example"] # Simulated
-    #    mask = bt_band_sim < 240 # Example threshold in Kelvin for cold (high) clouds
-    #    return mask
+    # Option 3: Rule-based (IR temperature threshold for cold, high cloud tops)
+    if method == "threshold_based":
+        if bt is None:
+            bt = data_object_sim.read_band(band or data_object_sim.bands[0])
+        labels, props = label_cold_clusters(bt, threshold=bt_threshold, min_area=min_area, connectivity=connectivity)
+        print(f"Found {len(props['label'])} clusters below {bt_threshold} K covering {int(props['area'].sum())} pixels.")
+        return labels > 0
 
-    # Placeholder: return a dummy mask
-    return np.zeros((256,256), dtype=bool)
+    print(f"Warning: unknown label method '{method}', returning an empty mask.")
+    return np.zeros(data_object_sim.shape, dtype=bool)
 
 
 # --- Sensor-Specific Preprocessing Stubs ---
 
-def preprocess_insat_data(raw_file_path, processed_file_dir):
-    """Conceptual preprocessing for a single ISRO INSAT file."""
-    print(f"\nPreprocessing ISRO INSAT file: {raw_file_path}")
-    ensure_dir(processed_file_dir)
+def stage_config(source_name):
+    """Effective parameters of every pipeline stage for one source (per-source entries resolved)."""
+    stages = {}
+    for stage, params in PREPROCESS_STAGES.items():
+        if stage in ("bands", "calibrate"):
+            params = params.get(source_name)
+        stages[stage] = params
+    # Refitting the normalizer changes every output, so its identity is part of the normalize stage
+    normalizer = load_normalizer(NORMALIZER_PATH)
+    stages["normalize"] = dict(stages["normalize"], normalizer=normalizer.fingerprint() if normalizer else None)
+    # So is the preprocessor's own code: bumping its version reprocesses the files it has already seen
+    stages["preprocessor"] = PREPROCESSOR_VERSIONS.get(source_name)
+    return stages
+
+
+def stage_hashes(source_name):
+    return {stage: config_hash(params) for stage, params in stage_config(source_name).items()}
+
 
+def prepare_scene(raw_file_path, source_name):
+    """
+    Band selection, calibration, reprojection and normalization of one raw file: the part of preprocessing
+    shared by training-patch generation and live ingest (ingest.py).
+    Returns (scene view, physical band data (H, W, C), normalized data (H, W, C), stage config), or None.
+    """
     data_sim = load_satellite_data(raw_file_path)
-    if data_sim is None: return
+    if data_sim is None:
+        return None
 
-    data_sim = select_bands(data_sim, "isro_insat", ["TIR1_sim", "VIS_sim"])
-    data_sim = calibrate_to_physical_values(data_sim, "isro_insat")
-    data_sim = reproject_to_common_grid(data_sim, "isro_insat")
+    stages = stage_config(source_name)
+    data_sim = select_bands(data_sim, source_name, stages["bands"])
+    data_sim = calibrate_to_physical_values(data_sim, source_name, stages["calibrate"])
+    data_sim = reproject_to_common_grid(data_sim, source_name, **stages["reproject"])
 
-    labels_sim = generate_or_load_labels(data_sim, "isro_insat", raw_file_path)
+    # Only the selected bands (and window) are read from disk here, as (H, W, C)
+    band_data = np.moveaxis(data_sim.read(), 0, -1)
+    normalized = normalize_data(band_data, method=stages["normalize"]["method"],
+                                feature_range=tuple(stages["normalize"]["feature_range"]),
+                                normalizer=load_normalizer(NORMALIZER_PATH), sensor=source_name, bands=stages["bands"])
+    return data_sim, band_data, normalized, stages
 
-    # Simulate having a calibrated numpy array for normalization and patching
-    simulated_calibrated_band_data = np.random.rand(512, 512)
-    normalized_data_sim = normalize_data(simulated_calibrated_band_data)
 
-    image_patches_sim, label_patches_sim = create_patches(normalized_data_sim, labels_sim)
+def preprocess_insat_data(raw_file_path, processed_file_dir, patch_writer=None):
+    """
+    Conceptual preprocessing for a single ISRO INSAT file.
+    If `patch_writer` (a patch_store.PatchShardWriter) is given, patches are appended to the packed store.
+    """
+    print(f"\nPreprocessing ISRO INSAT file: {raw_file_path}")
+    ensure_dir(processed_file_dir)
+
+    scene = prepare_scene(raw_file_path, "isro_insat")
+    if scene is None: return
+    data_sim, band_data, normalized_data_sim, stages = scene
+
+    label_band = stages["labels"].get("band")
+    bt = band_data[..., stages["bands"].index(label_band)] if label_band in stages["bands"] else None
+    labels_sim = generate_or_load_labels(data_sim, "isro_insat", raw_file_path, bt=bt, **stages["labels"])
+
+    patch_cfg = dict(stages["patches"], patch_size=tuple(stages["patches"]["patch_size"]))
+    image_patches_sim, label_patches_sim = create_patches(normalized_data_sim, labels_sim, **patch_cfg)
+
+    if patch_writer is not None:
+        key = os.path.basename(raw_file_path)
+        patch_writer.extend(image_patches_sim, label_patches_sim, source="isro_insat",
+                            keys=[f"{key}_patch_{i}" for i in range(len(image_patches_sim))])
+        print(f"Appended {len(image_patches_sim)} INSAT patches to patch store {patch_writer.store_dir}")
+        return
 
     for i, (patch, label) in enumerate(zip(image_patches_sim, label_patches_sim)):
         out_patch_path = os.path.join(processed_file_dir, f"{os.path.basename(raw_file_path)}_patch_{i}.npy")
@@ -182,21 +367,21 @@ def preprocess_insat_data(raw_file_path, processed_file_dir):
     print(f"Conceptual: Finished processing for INSAT file {raw_file_path}")
 
 
-def preprocess_goes_data(raw_file_path, processed_file_dir):
+def preprocess_goes_data(raw_file_path, processed_file_dir, patch_writer=None):
     print(f"\nPreprocessing NASA GOES file: {raw_file_path}")
     ensure_dir(processed_file_dir)
     # Similar conceptual flow as preprocess_insat_data
     print(f"Conceptual: Finished processing for GOES file {raw_file_path}")
 
 
-def preprocess_modis_data(raw_file_path, processed_file_dir):
+def preprocess_modis_data(raw_file_path, processed_file_dir, patch_writer=None):
     print(f"\nPreprocessing NASA MODIS file: {raw_file_path}")
     ensure_dir(processed_file_dir)
     # Similar conceptual flow, noting MODIS cloud mask product for labels.
     print(f"Conceptual: Finished processing for MODIS file {raw_file_path}")
 
 
-def preprocess_sentinel_data(raw_file_path, processed_file_dir):
+def preprocess_sentinel_data(raw_file_path, processed_file_dir, patch_writer=None):
     print(f"\nPreprocessing ESA SENTINEL file: {raw_file_path}")
     ensure_dir(processed_file_dir)
     # Similar conceptual flow.
@@ -205,10 +390,26 @@ def preprocess_sentinel_data(raw_file_path, processed_file_dir):
 
 # --- Main Preprocessing Dispatcher ---
 
-def preprocess_all_datasources():
-    ensure_dir(PROCESSED_DATA_DIR)
-    print(f"Ensured processed data directory exists: {os.path.abspath(PROCESSED_DATA_DIR)}")
-
+PREPROCESSORS = {
+    "isro_insat": preprocess_insat_data,
+    "nasa_goes": preprocess_goes_data,
+    "nasa_modis": preprocess_modis_data,
+    "esa_sentinel": preprocess_sentinel_data,
+}
+
+# Bump a source's version whenever its preprocessor changes what it writes. None marks a placeholder that
+# produces no outputs yet: its files are never recorded in the manifest, so they are picked up once it exists.
+PREPROCESSOR_VERSIONS = {
+    "isro_insat": 1,
+    "nasa_goes": None,
+    "nasa_modis": None,
+    "esa_sentinel": None,
+}
+
+
+def _collect_raw_files():
+    """Lists (source_name, raw_filepath, processed_source_dir) for every raw file of every configured source."""
+    jobs = []
     for source_name in DATA_SOURCES.keys():
         raw_source_dir = os.path.join(RAW_DATA_DIR, source_name)
         processed_source_dir = os.path.join(PROCESSED_DATA_DIR, source_name)
@@ -218,37 +419,173 @@ def preprocess_all_datasources():
             print(f"Raw data directory not found for {source_name}: {os.path.abspath(raw_source_dir)}. Skipping.")
             continue
 
-        print(f"\n--- Conceptual processing for {source_name.upper()} ---")
         # List actual files if they exist, otherwise use a dummy
         files_to_process = []
         if os.path.exists(raw_source_dir) and len(os.listdir(raw_source_dir)) > 0 :
-             files_to_process = [os.path.join(raw_source_dir, f) for f in os.listdir(raw_source_dir) if os.path.isfile(os.path.join(raw_source_dir, f))]
+             files_to_process = [os.path.join(raw_source_dir, f) for f in sorted(os.listdir(raw_source_dir)) if os.path.isfile(os.path.join(raw_source_dir, f))]
         else:
             files_to_process = [os.path.join(raw_source_dir, f"dummy_{source_name}_file.ext")] # Add dummy if dir is empty for demo
             ensure_dir(os.path.dirname(files_to_process[0])) # Ensure dummy file's dir exists
             if not os.path.exists(files_to_process[0]): # Create dummy file
                  with open(files_to_process[0], 'w') as df: df.write("dummy")
 
+        print(f"Found {len(files_to_process)} raw files for {source_name.upper()}")
+        jobs.extend((source_name, raw_filepath, processed_source_dir) for raw_filepath in files_to_process)
+    return jobs
 
-        for raw_filepath in files_to_process:
-            if source_name == "isro_insat":
-                preprocess_insat_data(raw_filepath, processed_source_dir)
-            elif source_name == "nasa_goes":
-                preprocess_goes_data(raw_filepath, processed_source_dir)
-            elif source_name == "nasa_modis":
-                preprocess_modis_data(raw_filepath, processed_source_dir)
-            elif source_name == "esa_sentinel":
-                preprocess_sentinel_data(raw_filepath, processed_source_dir)
+
+def preprocess_file(raw_filepath, source_name, processed_source_dir, patch_store_dir=None, shard_size=PATCH_SHARD_SIZE):
+    """
+    Preprocesses one raw file; this is the unit of work handed to the process pool.
+    With a patch store, the file gets its own shard(s) and the index fragment is returned for the
+    parent to merge, so workers never contend on a shared index.
+    """
+    patch_writer = None
+    if patch_store_dir:
+        prefix = f"{source_name}_{os.path.basename(raw_filepath)}".replace(os.sep, "_")
+        patch_writer = PatchShardWriter(patch_store_dir, shard_size=shard_size, prefix=prefix, write_index=False)
+    try:
+        PREPROCESSORS[source_name](raw_filepath, processed_source_dir, patch_writer)
+    finally:
+        part = patch_writer.close() if patch_writer is not None else None
+    return part
+
+
+def collect_normalization_stats(raw_filepath, source_name):
+    """
+    Streaming statistics of one raw file's calibrated bands (before reprojection), read block by block along
+    the file's storage chunks so the full scene is never in memory. Runs in pool workers.
+    """
+    stats = NormalizationStats()
+    data = load_satellite_data(raw_filepath)
+    if data is None:
+        return stats
+    stages = stage_config(source_name)
+    data = select_bands(data, source_name, stages["bands"])
+    data = calibrate_to_physical_values(data, source_name, stages["calibrate"])
+    for band_name, band in zip(stages["bands"] or data.bands, data.bands):
+        for window in data.reader.iter_windows(band):
+            stats.update(source_name, band_name, data.read_band(band, window))
+    return stats
+
+
+def fit_normalizer(max_workers=None, source_limits=None, normalizer_path=NORMALIZER_PATH):
+    """
+    One streaming pass over every raw file -> per-(sensor, band) statistics -> FittedNormalizer saved to
+    `normalizer_path`. Preprocessing, training, validation and live inference all apply this one artifact.
+    """
+    jobs = _collect_raw_files()
+    tasks = [(source_name, (raw_filepath, source_name)) for source_name, raw_filepath, _ in jobs]
+    results = run_per_source_pool(tasks, collect_normalization_stats,
+                                  max_workers=max_workers or PREPROCESS_WORKERS,
+                                  source_limits=PREPROCESS_SOURCE_LIMITS if source_limits is None else source_limits)
+    stats = NormalizationStats()
+    for r in results:
+        if r.ok:
+            stats.merge(r.value)
+        else:
+            print(f"FAILED {r.source}: {r.args[0]}\n{r.error}")
+
+    cfg = PREPROCESS_STAGES["normalize"]
+    normalizer = stats.fit(cfg["method"], cfg["feature_range"], cfg.get("quantiles", (0.01, 0.99)))
+    normalizer.save(normalizer_path)
+    print(f"Fitted {cfg['method']} normalizer over {sum(r.ok for r in results)} files -> {normalizer_path}")
+    return normalizer
+
+
+def preprocess_all_datasources(patch_store_dir=None, shard_size=PATCH_SHARD_SIZE, max_workers=None, source_limits=None,
+                               force=False):
+    """
+    Runs the per-source preprocessing over every raw file on a process pool (see scheduler.py).
+    With `patch_store_dir`, all patches are packed into one sharded store (see patch_store.py)
+    instead of being written as individual .npy files.
+
+    Runs are incremental: the manifest in PROCESSED_DATA_DIR (see manifest.py) records each raw file's
+    size/mtime/hash, stage parameters and outputs, and only new/changed files or files whose stage
+    config changed are reprocessed. `force` reprocesses everything.
+    Failed files are reported and skipped (and retried next run); returns the list of scheduler.TaskResult.
+    """
+    ensure_dir(PROCESSED_DATA_DIR)
+    print(f"Ensured processed data directory exists: {os.path.abspath(PROCESSED_DATA_DIR)}")
+    if source_limits is None:
+        source_limits = PREPROCESS_SOURCE_LIMITS
+    if max_workers is None:
+        max_workers = PREPROCESS_WORKERS
+
+    manifest = PreprocessManifest.load(os.path.join(PROCESSED_DATA_DIR, MANIFEST_FILENAME))
+    hashes = {source_name: stage_hashes(source_name) for source_name in DATA_SOURCES.keys()}
+    required_outputs = ["patch_store"] if patch_store_dir else []
+
+    jobs = _collect_raw_files()
+    pending = sorted(source for source in DATA_SOURCES if PREPROCESSOR_VERSIONS.get(source) is None)
+    if pending:
+        print(f"No preprocessor implemented yet for {', '.join(pending)}: their files are not recorded as processed")
+    to_process, skipped = manifest.plan(jobs, hashes, force=force, required_outputs=required_outputs)
+    print(f"{len(to_process)} files to process, {len(skipped)} unchanged and skipped")
+    for (source_name, raw_filepath, _), reason, _ in to_process:
+        print(f"  {source_name}: {raw_filepath} ({reason})")
+
+    tasks = [(source_name, (raw_filepath, source_name, processed_source_dir, patch_store_dir, shard_size))
+             for (source_name, raw_filepath, processed_source_dir), _, _ in to_process]
+
+    start = time.perf_counter()
+    results = run_per_source_pool(tasks, preprocess_file, max_workers=max_workers, source_limits=source_limits)
+    elapsed = time.perf_counter() - start
+
+    for (_, _, fingerprint), result in zip(to_process, results):
+        if not result.ok or PREPROCESSOR_VERSIONS.get(result.source) is None:
+            continue
+        raw_filepath = result.args[0]
+        outputs = {"patch_store": result.value} if result.value is not None else {}
+        previous = manifest.record(raw_filepath, result.source, fingerprint, hashes[result.source], outputs)
+        if patch_store_dir and previous:
+            _remove_stale_shards(patch_store_dir, (previous.get("outputs") or {}).get("patch_store"), result.value)
+
+    if patch_store_dir:
+        parts = [part for _, part in manifest.outputs("patch_store") if part["image_shape"] is not None]
+        if parts:
+            write_store_index(patch_store_dir, merge_index_parts(parts))
+    manifest.save()
+
+    failures = [r for r in results if not r.ok]
+    print(f"\nPreprocessed {len(results) - len(failures)}/{len(results)} files in {elapsed:.1f}s")
+    for r in failures:
+        print(f"FAILED {r.source}: {r.args[0]}\n{r.error}")
+    return results
+
+
+def _remove_stale_shards(patch_store_dir, old_part, new_part):
+    """Deletes shard files of a previous run of a file once its reprocessed shards are in place."""
+    if not old_part:
+        return
+    keep = {name for shard in (new_part or {}).get("shards", []) for name in (shard["images"], shard["masks"])}
+    for shard in old_part["shards"]:
+        for name in (shard["images"], shard["masks"]):
+            path = os.path.join(patch_store_dir, name)
+            if name not in keep and os.path.exists(path):
+                os.remove(path)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess raw satellite data into training patches.")
+    parser.add_argument("--patch_store", action="store_true", help=f"Pack patches into the sharded store at {PATCH_STORE_DIR}")
+    parser.add_argument("--shard_size", type=int, default=PATCH_SHARD_SIZE, help="Samples per shard file")
+    parser.add_argument("--workers", type=int, default=PREPROCESS_WORKERS, help="Worker processes (default: all cores, 1 = serial)")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and reprocess every raw file")
+    parser.add_argument("--fit_normalizer", action="store_true", help=f"Refit dataset-wide normalization statistics into {NORMALIZER_PATH} first")
+    args = parser.parse_args()
+
     print("Starting conceptual data preprocessing (temp_process.py)...")
 
     # Ensure base RAW_DATA_DIR exists for the dummy file creation part of preprocess_all_datasources
     ensure_dir(RAW_DATA_DIR)
     print(f"Ensured raw data directory exists: {os.path.abspath(RAW_DATA_DIR)}")
 
-    preprocess_all_datasources()
+    if args.fit_normalizer:
+        fit_normalizer(max_workers=args.workers)
+
+    preprocess_all_datasources(patch_store_dir=PATCH_STORE_DIR if args.patch_store else None, shard_size=args.shard_size,
+                               max_workers=args.workers, force=args.force)
 
     print("\nConceptual data preprocessing finished.")
     print(f"Processed data would be in subdirectories under: {os.path.abspath(PROCESSED_DATA_DIR)}")
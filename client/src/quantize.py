@@ -0,0 +1,221 @@
+import os
+import io
+import sys
+import copy
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import torch
+
+from inference import load_unet, configure_threads
+from checkpoints import resolve_checkpoint
+from export import CompiledModel, EXPORT_SUBDIR
+from patch_store import PatchShardStore
+
+try:
+    from config import MODEL_DIR, PATCH_STORE_DIR, INFERENCE_TILE_SIZE, INFERENCE_THREADS
+except ImportError:
+    print("Warning: config.py not found, using placeholder paths and inference settings.")
+    MODEL_DIR = "models_placeholder"
+    PATCH_STORE_DIR = "data/processed_placeholder/patch_store"
+    INFERENCE_TILE_SIZE = 256
+    INFERENCE_THREADS = None
+
+# Static post-training int8 quantization of the UNet for CPU inference.
+#
+# The model is prepared with FX graph-mode quantization (Conv+BN+ReLU in every DoubleConv/Down/Up block
+# are fused and quantized; the final 1x1 OutConv and the sigmoid stay float), observers are calibrated on
+# a random sample of the processed patch store, and the converted model is frozen to TorchScript under
+# MODEL_DIR/export/<name>.int8.pt. A report next to it compares Dice/IoU of int8 and fp32 against the
+# store's labels on a disjoint sample, their agreement with each other, latency, model size and the peak
+# resident memory of inference. Peak RSS only ever grows within a process, so each precision is loaded and
+# run in a fresh spawned process and reported as the growth over that process's baseline.
+
+
+def split_samples(store, n_calibration, n_eval, seed=0):
+    """Disjoint random index samples of the store for calibration and evaluation."""
+    order = np.random.default_rng(seed).permutation(len(store))
+    return order[:n_calibration], order[n_calibration:n_calibration + n_eval]
+
+
+def iter_batches(store, indices, batch_size):
+    """(images, masks) float32 tensors from a patch store, batch_size samples at a time."""
+    for first in range(0, len(indices), batch_size):
+        items = [store.get(int(i)) for i in indices[first:first + batch_size]]
+        yield (torch.from_numpy(np.stack([image for image, _ in items]).astype(np.float32, copy=False)),
+               torch.from_numpy(np.stack([mask for _, mask in items]).astype(np.float32)))
+
+
+def quantize_unet(model, calibration_batches, backend="x86"):
+    """int8 static-quantized copy of an eval-mode UNet, observers calibrated on `calibration_batches` of images."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = backend
+    qconfig_mapping = get_default_qconfig_mapping(backend).set_module_name("outc", None)
+    batches = iter(calibration_batches)
+    first = next(batches)
+    prepared = prepare_fx(copy.deepcopy(model).eval(), qconfig_mapping, (first,))
+    with torch.inference_mode():
+        prepared(first)
+        for images in batches:
+            prepared(images)
+    return convert_fx(prepared)
+
+
+def segmentation_scores(model, store, indices, batch_size, threshold=0.5, reference=None):
+    """
+    Dataset-level Dice/IoU of thresholded outputs against the store's masks (summed confusion counts).
+    With a `reference` model, also the Dice agreement between both models' binarized outputs.
+    """
+    tp = fp = fn = agree_tp = agree_total = 0
+    with torch.inference_mode():
+        for images, masks in iter_batches(store, indices, batch_size):
+            pred = model(images) > threshold
+            truth = masks > 0.5
+            tp += (pred & truth).sum().item()
+            fp += (pred & ~truth).sum().item()
+            fn += (~pred & truth).sum().item()
+            if reference is not None:
+                ref = reference(images) > threshold
+                agree_tp += (pred & ref).sum().item()
+                agree_total += pred.sum().item() + ref.sum().item()
+    scores = {"dice": 2 * tp / max(2 * tp + fp + fn, 1), "iou": tp / max(tp + fp + fn, 1)}
+    if reference is not None:
+        scores["dice_vs_reference"] = 2 * agree_tp / agree_total if agree_total else 1.0
+    return scores
+
+
+def latency_ms(model, example, repeats=5):
+    with torch.inference_mode():
+        model(example)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(example)
+            timings.append(time.perf_counter() - start)
+    return 1000 * float(np.median(timings))
+
+
+def serialized_bytes(obj):
+    buffer = io.BytesIO()
+    torch.jit.save(obj, buffer) if isinstance(obj, torch.jit.ScriptModule) else torch.save(obj, buffer)
+    return buffer.tell()
+
+
+def _max_rss_bytes():
+    """Peak resident set size of this process (VmHWM on Linux, which unlike ru_maxrss starts afresh at exec)."""
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:"))
+    except (OSError, StopIteration):
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def _inference_peak_rss(precision, path, shape, backend, num_threads):
+    """Runs in a fresh process: peak RSS growth (bytes) from loading `path` and from one inference on `shape`."""
+    configure_threads(num_threads)
+    example = torch.rand(shape)
+    baseline = _max_rss_bytes()
+    if precision == "int8":
+        torch.backends.quantized.engine = backend
+        model = torch.jit.load(path, map_location="cpu")
+    else:
+        model = load_unet(path)
+    loaded = _max_rss_bytes()
+    with torch.inference_mode():
+        model(example)
+    peak = _max_rss_bytes()
+    return {"model": loaded - baseline, "inference": peak - loaded, "total": peak - baseline}
+
+
+def peak_memory(paths, shape, backend="x86", num_threads=INFERENCE_THREADS):
+    """{precision: peak RSS growth} for {precision: model path}, each measured in its own spawned process."""
+    context = multiprocessing.get_context("spawn")
+    report = {}
+    for precision, path in paths.items():
+        with context.Pool(1) as pool:
+            report[precision] = pool.apply(_inference_peak_rss, (precision, path, shape, backend, num_threads))
+    return report
+
+
+def load_quantized(path):
+    """int8 TorchScript written by quantize_checkpoint, as a model-like callable for TiledInferenceEngine."""
+    with open(os.path.splitext(path)[0] + ".json") as f:
+        report = json.load(f)
+    torch.backends.quantized.engine = report["backend"]
+    module = torch.jit.load(path, map_location="cpu")
+    return CompiledModel("int8", module, report["n_channels"], report["n_classes"])
+
+
+def quantize_checkpoint(checkpoint_path, store_dir=PATCH_STORE_DIR, out_dir=None, n_calibration=64, n_eval=64,
+                        batch_size=8, backend="x86", seed=0, num_threads=INFERENCE_THREADS):
+    """Calibrates, converts and saves the int8 model; returns the report dict (also written as JSON)."""
+    configure_threads(num_threads)
+    out_dir = out_dir or os.path.join(MODEL_DIR, EXPORT_SUBDIR)
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, os.path.splitext(os.path.basename(checkpoint_path))[0] + ".int8")
+
+    fp32 = load_unet(checkpoint_path)
+    store = PatchShardStore(store_dir)
+    calibration_idx, eval_idx = split_samples(store, n_calibration, n_eval, seed)
+    print(f"Calibrating on {len(calibration_idx)} patches, evaluating on {len(eval_idx)} of {len(store)}")
+
+    int8 = quantize_unet(fp32, (images for images, _ in iter_batches(store, calibration_idx, batch_size)), backend)
+    example = iter_batches(store, calibration_idx[:batch_size], batch_size).__next__()[0]
+    with torch.inference_mode():
+        frozen = torch.jit.freeze(torch.jit.trace(int8, example))
+    frozen.save(base + ".pt")
+
+    report = {"source": os.path.abspath(checkpoint_path), "backend": backend,
+              "n_channels": fp32.n_channels, "n_classes": fp32.n_classes,
+              "calibration_samples": int(len(calibration_idx)), "eval_samples": int(len(eval_idx))}
+    if len(eval_idx):
+        report["fp32"] = segmentation_scores(fp32, store, eval_idx, batch_size)
+        report["int8"] = segmentation_scores(frozen, store, eval_idx, batch_size, reference=fp32)
+    tile = torch.rand(batch_size, fp32.n_channels, INFERENCE_TILE_SIZE, INFERENCE_TILE_SIZE)
+    report["latency_ms_per_batch"] = {"batch_size": batch_size, "tile_size": INFERENCE_TILE_SIZE,
+                                      "fp32": latency_ms(fp32, tile), "int8": latency_ms(frozen, tile)}
+    report["model_bytes"] = {"fp32": serialized_bytes(fp32.state_dict()), "int8": os.path.getsize(base + ".pt")}
+    report["peak_rss_bytes"] = dict(peak_memory({"fp32": checkpoint_path, "int8": base + ".pt"}, tuple(tile.shape),
+                                                backend, num_threads), batch_size=batch_size, tile_size=INFERENCE_TILE_SIZE)
+
+    with open(base + ".json", "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Saved int8 model: {base}.pt")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Static int8 post-training quantization of a trained UNet.")
+    parser.add_argument("--checkpoint", type=str, default="latest", help="'latest', 'best' or a checkpoint path")
+    parser.add_argument("--patch_store", type=str, default=PATCH_STORE_DIR, help="Processed patch store to sample from")
+    parser.add_argument("--out_dir", type=str, default=None, help=f"Default: {os.path.join(MODEL_DIR, EXPORT_SUBDIR)}")
+    parser.add_argument("--calibration_samples", type=int, default=64)
+    parser.add_argument("--eval_samples", type=int, default=64)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--backend", type=str, default="x86", choices=["x86", "fbgemm", "qnnpack", "onednn"],
+                        help="Quantized kernel backend (qnnpack for ARM edge devices)")
+    parser.add_argument("--threads", type=int, default=INFERENCE_THREADS)
+    args = parser.parse_args()
+
+    checkpoint_path = resolve_checkpoint(args.checkpoint, MODEL_DIR)
+    if not checkpoint_path or not os.path.isfile(checkpoint_path):
+        raise SystemExit(f"No model to quantize ({args.checkpoint}) in {MODEL_DIR}. Train a model first.")
+    report = quantize_checkpoint(checkpoint_path, args.patch_store, args.out_dir, args.calibration_samples,
+                                 args.eval_samples, args.batch_size, args.backend, num_threads=args.threads)
+    for precision in ("fp32", "int8"):
+        if precision in report:
+            print(f"{precision}: " + ", ".join(f"{k} {v:.4f}" for k, v in report[precision].items()))
+    latency, size = report["latency_ms_per_batch"], report["model_bytes"]
+    print(f"Latency per batch of {latency['batch_size']}x{latency['tile_size']}: fp32 {latency['fp32']:.0f} ms, "
+          f"int8 {latency['int8']:.0f} ms ({latency['fp32'] / latency['int8']:.2f}x)")
+    print(f"Model size: fp32 {size['fp32'] / 1e6:.1f} MB, int8 {size['int8'] / 1e6:.1f} MB")
+    memory = report["peak_rss_bytes"]
+    for precision in ("fp32", "int8"):
+        print(f"Peak RSS {precision}: weights {memory[precision]['model'] / 1e6:.1f} MB + inference "
+              f"{memory[precision]['inference'] / 1e6:.1f} MB = {memory[precision]['total'] / 1e6:.1f} MB")
@@ -0,0 +1,358 @@
+import os
+import numpy as np
+
+# Lazy, chunk-aware readers for the satellite formats we ingest (NetCDF, HDF5, GeoTIFF).
+#
+# Opening a reader does no I/O. Data is only read through read(band, window), which pulls just that
+# band and spatial window from disk, so a full-disk multi-channel INSAT-3DR file never has to be
+# materialized in a worker. Readers hold only a path when pickled, so they can be handed to
+# process-pool workers. Format libraries are imported on first use; only the one a file needs must
+# be installed.
+#
+# A window is a (row_slice, col_slice) tuple in pixel coordinates of the band.
+#
+# GeoTIFF has no 1-D variables, so auxiliary tables (INSAT count->TEMP/ALBEDO) travel as dataset metadata
+# in the GEOTIFF_TABLE_NAMESPACE domain, one whitespace-separated list per table name.
+
+NETCDF_EXTENSIONS = ('.nc', '.nc4')
+HDF_EXTENSIONS = ('.hdf', '.h5', '.hdf5')
+GEOTIFF_EXTENSIONS = ('.tif', '.tiff')
+GEOTIFF_TABLE_NAMESPACE = "CALIBRATION_TABLES"
+
+_LAT_NAMES = ("lat", "latitude", "Latitude")
+_LON_NAMES = ("lon", "longitude", "Longitude")
+
+
+def _full_window(shape):
+    return (slice(0, shape[0]), slice(0, shape[1]))
+
+
+def compose_windows(outer, inner):
+    """Window `inner` (relative to `outer`) expressed in the coordinates `outer` is relative to."""
+    if outer is None:
+        return inner
+    if inner is None:
+        return outer
+    return tuple(slice(o.start + (i.start or 0), o.start + (i.stop if i.stop is not None else o.stop - o.start))
+                 for o, i in zip(outer, inner))
+
+
+class SatelliteReader:
+    """Common interface; subclasses implement _open, _list_bands, _band_shape, _read, band_attrs."""
+
+    kind = None
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+        self._bands = None
+
+    # --- lifecycle ---
+    @property
+    def handle(self):
+        if self._handle is None:
+            self._handle = self._open()
+        return self._handle
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_handle"] = None  # File handles don't survive pickling; reopen lazily in the worker
+        return state
+
+    # --- metadata ---
+    @property
+    def bands(self):
+        if self._bands is None:
+            self._bands = self._list_bands()
+        return self._bands
+
+    def resolve_band(self, name):
+        """Exact band name, else the single band whose name ends with/contains `name` (case-insensitive)."""
+        if name in self.bands:
+            return name
+        lowered = name.lower()
+        for match in (lambda b: b.lower().endswith(lowered), lambda b: lowered in b.lower()):
+            candidates = [b for b in self.bands if match(b)]
+            if len(candidates) == 1:
+                return candidates[0]
+            if len(candidates) > 1:
+                raise KeyError(f"Band '{name}' is ambiguous in {self.path}: {candidates}")
+        raise KeyError(f"Band '{name}' not found in {self.path}. Available: {self.bands}")
+
+    def band_shape(self, band):
+        return self._band_shape(self.resolve_band(band))
+
+    def band_attrs(self, band):
+        return {}
+
+    def chunk_shape(self, band):
+        """Native storage chunk (rows, cols) of a band, or None if stored contiguously."""
+        return None
+
+    def _list_variables(self):
+        """Every variable/dataset name in the file, including 1-D auxiliary ones (calibration tables)."""
+        return list(self.bands)
+
+    def read_auxiliary(self, name):
+        """
+        Whole auxiliary variable `name` (matched exactly, else by case-insensitive suffix), e.g. INSAT's
+        1-D count->temperature table IMG_TIR1_TEMP, or None if the file has no such variable.
+        """
+        names = self._list_variables()
+        if name not in names:
+            candidates = [n for n in names if n.lower().endswith(name.lower())]
+            if len(candidates) != 1:
+                return None
+            name = candidates[0]
+        return self._read_variable(name)
+
+    def geolocation(self):
+        """Names of latitude/longitude bands if the file carries them, for reprojection."""
+        lat = next((b for b in self.bands if b.split("/")[-1] in _LAT_NAMES), None)
+        lon = next((b for b in self.bands if b.split("/")[-1] in _LON_NAMES), None)
+        return {"lat": lat, "lon": lon} if lat and lon else {}
+
+    # --- data ---
+    def read(self, band, window=None, out=None):
+        band = self.resolve_band(band)
+        window = window or _full_window(self._band_shape(band))
+        data = self._read(band, window)
+        if out is not None:
+            out[...] = data
+            return out
+        return data
+
+    def iter_windows(self, band, min_rows=256):
+        """Row-block windows covering a band, aligned to its storage chunks, for streaming passes."""
+        height, width = self.band_shape(band)
+        chunk = self.chunk_shape(band)
+        step = chunk[0] if chunk else min_rows
+        if step < min_rows:  # Whole number of chunks per block
+            step *= -(-min_rows // step)
+        for r in range(0, height, step):
+            yield (slice(r, min(r + step, height)), slice(0, width))
+
+
+def _squeeze_leading(shape):
+    """(1, ..., H, W) -> number of leading singleton dims to index away (time/band axes of size 1)."""
+    lead = len(shape) - 2
+    if any(d != 1 for d in shape[:lead]):
+        raise ValueError(f"Cannot read band with non-singleton leading dimensions {shape}")
+    return lead
+
+
+class NetCDFReader(SatelliteReader):
+    kind = "netcdf"
+
+    def _open(self):
+        import netCDF4
+        ds = netCDF4.Dataset(self.path, "r")
+        ds.set_auto_maskandscale(False)  # Keep raw counts; calibration applies scale/offset itself
+        return ds
+
+    def _list_bands(self):
+        return [name for name, var in self.handle.variables.items() if var.ndim >= 2]
+
+    def _list_variables(self):
+        return list(self.handle.variables)
+
+    def _read_variable(self, name):
+        return np.asarray(self.handle.variables[name][...])
+
+    def _band_shape(self, band):
+        return tuple(self.handle.variables[band].shape[-2:])
+
+    def band_attrs(self, band):
+        var = self.handle.variables[self.resolve_band(band)]
+        return {k: var.getncattr(k) for k in var.ncattrs()}
+
+    def chunk_shape(self, band):
+        chunking = self.handle.variables[self.resolve_band(band)].chunking()
+        return None if chunking == "contiguous" else tuple(chunking[-2:])
+
+    def _read(self, band, window):
+        var = self.handle.variables[band]
+        return np.asarray(var[(0,) * _squeeze_leading(var.shape) + tuple(window)])
+
+
+class HDF5Reader(SatelliteReader):
+    kind = "hdf"
+
+    def _open(self):
+        import h5py
+        return h5py.File(self.path, "r")
+
+    def _list_bands(self):
+        import h5py
+        names = []
+        self.handle.visititems(lambda name, obj: names.append(name)
+                               if isinstance(obj, h5py.Dataset) and obj.ndim >= 2 else None)
+        return names
+
+    def _list_variables(self):
+        import h5py
+        names = []
+        self.handle.visititems(lambda name, obj: names.append(name) if isinstance(obj, h5py.Dataset) else None)
+        return names
+
+    def _read_variable(self, name):
+        return self.handle[name][()]
+
+    def _band_shape(self, band):
+        return tuple(self.handle[band].shape[-2:])
+
+    def band_attrs(self, band):
+        return {k: (v.item() if isinstance(v, np.ndarray) and v.size == 1 else v)
+                for k, v in self.handle[self.resolve_band(band)].attrs.items()}
+
+    def chunk_shape(self, band):
+        chunks = self.handle[self.resolve_band(band)].chunks
+        return tuple(chunks[-2:]) if chunks else None
+
+    def _read(self, band, window):
+        ds = self.handle[band]
+        return ds[(0,) * _squeeze_leading(ds.shape) + tuple(window)]
+
+
+class GeoTIFFReader(SatelliteReader):
+    kind = "geotiff"
+
+    def _open(self):
+        import rasterio
+        return rasterio.open(self.path)
+
+    def _list_bands(self):
+        return [desc or f"band_{i + 1}" for i, desc in enumerate(self.handle.descriptions)]
+
+    def _band_index(self, band):
+        return self.bands.index(band) + 1
+
+    def _band_shape(self, band):
+        return (self.handle.height, self.handle.width)
+
+    def _list_variables(self):
+        return list(self.bands) + list(self.handle.tags(ns=GEOTIFF_TABLE_NAMESPACE))
+
+    def _read_variable(self, name):
+        tables = self.handle.tags(ns=GEOTIFF_TABLE_NAMESPACE)
+        if name in tables:  # 1-D tables (e.g. count->TEMP) are stored as whitespace-separated metadata
+            return np.array(tables[name].split(), dtype=np.float64)
+        return self.read(name)
+
+    def band_attrs(self, band):
+        i = self._band_index(self.resolve_band(band)) - 1
+        return {"scale_factor": self.handle.scales[i], "add_offset": self.handle.offsets[i],
+                "nodata": self.handle.nodata, "crs": str(self.handle.crs), "transform": tuple(self.handle.transform)}
+
+    def chunk_shape(self, band):
+        return tuple(self.handle.block_shapes[self._band_index(self.resolve_band(band)) - 1])
+
+    def geolocation(self):
+        return {"crs": str(self.handle.crs), "transform": tuple(self.handle.transform)}
+
+    def _read(self, band, window):
+        from rasterio.windows import Window
+        return self.handle.read(self._band_index(band), window=Window.from_slices(*window))
+
+
+class SceneView:
+    """
+    Lazy selection over a reader: a subset of bands, an optional spatial window, and per-band
+    transforms (e.g. calibration) applied as each band is read. select_bands/calibrate/reproject
+    in process.py build these up; nothing is read until read()/read_band() is called.
+    With a `regrid` (reprojection.ReprojectionTable), bands are read over the table's source window,
+    transformed, then gathered onto the target grid; shape and windows are then in target pixels.
+    """
+
+    def __init__(self, reader, bands=None, window=None):
+        self.reader = reader
+        self.bands = [reader.resolve_band(b) for b in bands] if bands else list(reader.bands)
+        self.window = window
+        self.transforms = {}  # band -> [callable(array) -> array]
+        self.meta = {}
+        self.regrid = None
+
+    @property
+    def kind(self):
+        return self.reader.kind
+
+    @property
+    def path(self):
+        return self.reader.path
+
+    @property
+    def shape(self):
+        if self.window is not None:
+            return tuple(s.stop - s.start for s in self.window)
+        if self.regrid is not None:
+            return self.regrid.target_shape
+        return self.reader.band_shape(self.bands[0])
+
+    def _copy(self, **changes):
+        view = SceneView.__new__(SceneView)
+        view.__dict__.update(self.__dict__)
+        view.transforms = {b: list(fns) for b, fns in self.transforms.items()}
+        view.meta = dict(self.meta)
+        view.__dict__.update(changes)
+        return view
+
+    def select(self, bands):
+        return self._copy(bands=[self.reader.resolve_band(b) for b in bands])
+
+    def crop(self, window):
+        """Sub-window relative to the current view."""
+        return self._copy(window=compose_windows(self.window, window))
+
+    def with_regrid(self, table):
+        if self.window is not None:
+            raise ValueError("Reprojection tables map whole bands; regrid before cropping")
+        return self._copy(regrid=table)
+
+    def add_transform(self, band, fn):
+        view = self._copy()
+        view.transforms.setdefault(self.reader.resolve_band(band), []).append(fn)
+        return view
+
+    def read_band(self, band, window=None):
+        band = self.reader.resolve_band(band)
+        if self.regrid is not None:
+            data = self.reader.read(band, self.regrid.source_window)
+        else:
+            data = self.reader.read(band, compose_windows(self.window, window))
+        for fn in self.transforms.get(band, ()):
+            data = fn(data)
+        if self.regrid is not None:
+            data = self.regrid.apply(data)
+            target_window = compose_windows(self.window, window)
+            if target_window is not None:
+                data = data[target_window]
+        return data
+
+    def read(self, window=None, dtype=np.float32):
+        """(C, H, W) stack of the selected bands, reading only the view's window from disk."""
+        shape = tuple(s.stop - s.start for s in window) if window is not None else self.shape
+        out = np.empty((len(self.bands),) + shape, dtype=dtype)
+        for i, band in enumerate(self.bands):
+            out[i] = self.read_band(band, window)
+        return out
+
+
+READERS = {ext: cls for exts, cls in ((NETCDF_EXTENSIONS, NetCDFReader), (HDF_EXTENSIONS, HDF5Reader),
+                                      (GEOTIFF_EXTENSIONS, GeoTIFFReader)) for ext in exts}
+
+
+def open_satellite_file(filepath):
+    """Lazy reader for `filepath` chosen by extension, or None if the format is unsupported."""
+    cls = READERS.get(os.path.splitext(filepath)[1].lower())
+    return cls(filepath) if cls else None
@@ -0,0 +1,295 @@
+import time
+import queue
+import argparse
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import torch
+
+from inference import configure_threads
+from normalization import frame_normalizer
+from validate import latency_summary
+
+try:
+    from config import REALTIME_MAX_BATCH, REALTIME_MAX_LATENCY_MS, INFERENCE_THREADS, NORMALIZER_PATH, PREPROCESS_STAGES
+except ImportError:
+    print("Warning: config.py not found, using placeholder real-time settings.")
+    REALTIME_MAX_BATCH = 8
+    REALTIME_MAX_LATENCY_MS = 50.0
+    INFERENCE_THREADS = None
+    NORMALIZER_PATH = "data/processed/normalizer.json"
+    PREPROCESS_STAGES = {"bands": {}}
+
+# Micro-batching scheduler for serving several models on a stream of frames.
+#
+# The original RealTimeInference (attached_assets/realtime) calls every model one after another with a batch
+# of one for each frame. Here frames from any number of streams are submitted to one queue and a batching
+# thread collects them into micro-batches: a batch is run as soon as it holds max_batch frames, or when its
+# oldest frame has waited max_latency_ms, whichever comes first. Frames are copied once into a preallocated
+# (max_batch, C, H, W) tensor and every head reads the same view of it, so the preprocessed input is shared
+# without copies. Heads that only need the frames (segmentation, classifiers, regressors) run concurrently on
+# a thread pool (torch releases the GIL inside its kernels); a head declared with `inputs="<other head>"`
+# starts as soon as that head's output is ready. Each frame's result is delivered through a Future. Latency
+# is recorded per head (per batch and per frame), for time spent waiting in the queue and end to end.
+#
+# With `sensor` set, submitted frames are calibrated band values and are scaled by the fitted dataset
+# normalizer (normalization.py) on submit, the same artifact preprocessing applied to the training patches;
+# without it, frames must already be normalized (e.g. from process.prepare_scene).
+#
+# Heads running side by side share the cores: pass num_threads (torch intra-op threads) of about
+# cores / concurrent heads to avoid oversubscription.
+
+Head = namedtuple("Head", ["name", "model", "inputs"])  # model: callable on a batch tensor; inputs: None = frames
+_Request = namedtuple("_Request", ["frame", "stream", "future", "submitted"])
+
+
+class RealTimeInference:
+    """
+    heads: {name: model} or [Head, ...]; frame_shape: (C, H, W) of every submitted frame.
+    sensor/bands: frames are calibrated values of these bands (default: the sensor's configured bands) and are
+    normalized with the fitted normalizer at normalizer_path; sensor=None takes already-normalized frames.
+    submit() queues one frame and returns a Future of {head name: output for that frame (NumPy)}.
+    """
+
+    def __init__(self, heads, frame_shape, max_batch=REALTIME_MAX_BATCH, max_latency_ms=REALTIME_MAX_LATENCY_MS,
+                 head_threads=None, num_threads=INFERENCE_THREADS, device="cpu", history=10000, sensor=None, bands=None,
+                 normalizer_path=NORMALIZER_PATH):
+        if isinstance(heads, dict):
+            heads = [Head(name, model, None) for name, model in heads.items()]
+        self.heads = {head.name: head for head in heads}
+        self._check_dependencies()
+        configure_threads(num_threads)
+        for head in self.heads.values():
+            if isinstance(head.model, torch.nn.Module):
+                head.model.to(device).eval()
+
+        self.frame_shape = tuple(frame_shape)
+        self._normalize = None
+        if sensor is not None:
+            bands = bands or PREPROCESS_STAGES["bands"][sensor]
+            if len(bands) != self.frame_shape[0]:
+                raise ValueError(f"{len(bands)} bands {bands} for {self.frame_shape[0]}-channel frames")
+            self._normalize = frame_normalizer(normalizer_path, sensor, bands)
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000
+        self.device = torch.device(device)
+        self._input = torch.empty((max_batch,) + self.frame_shape, device=self.device)
+        self._requests = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=head_threads or len(self.heads), thread_name_prefix="head") \
+            if len(self.heads) > 1 else None
+
+        self._lock = threading.Lock()
+        self._head_ms = {name: deque(maxlen=history) for name in self.heads}
+        self._batch_sizes = deque(maxlen=history)
+        self._queue_ms = deque(maxlen=history)
+        self._total_ms = deque(maxlen=history)
+        self.frames = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._batch_loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def _check_dependencies(self):
+        resolved = set()
+        while len(resolved) < len(self.heads):
+            ready = [name for name, head in self.heads.items()
+                     if name not in resolved and (head.inputs is None or head.inputs in resolved)]
+            if not ready:
+                unresolved = sorted(set(self.heads) - resolved)
+                raise ValueError(f"Heads {unresolved} depend on missing heads or on each other")
+            resolved.update(ready)
+
+    def submit(self, frame, stream=None):
+        """Queues a (C, H, W) frame (normalized here if a sensor was given); returns a Future of {head name: output}."""
+        if tuple(np.shape(frame)) != self.frame_shape:
+            raise ValueError(f"Expected a {self.frame_shape} frame, got {tuple(np.shape(frame))}")
+        if self._normalize is not None:
+            frame = self._normalize(frame)
+        frame = torch.as_tensor(np.ascontiguousarray(frame, dtype=np.float32))
+        future = Future()
+        self._requests.put(_Request(frame, stream, future, time.perf_counter()))
+        return future
+
+    def run_inference(self, frame):
+        """Blocking single-frame call (the original interface); batches with whatever else is in flight."""
+        return self.submit(frame).result()
+
+    def _batch_loop(self):
+        closing = False
+        while not closing:
+            first = self._requests.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = first.submitted + self.max_latency
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    request = self._requests.get(timeout=remaining) if remaining > 0 else self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                batch.append(request)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        n = len(batch)
+        try:
+            for i, request in enumerate(batch):
+                self._input[i].copy_(request.frame)
+            outputs = self._run_heads(self._input[:n])
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        with self._lock:
+            self.frames += n
+            self.batches += 1
+            self._batch_sizes.append(n)
+            for request in batch:
+                self._queue_ms.append(1000 * (started - request.submitted))
+                self._total_ms.append(1000 * (finished - request.submitted))
+        for i, request in enumerate(batch):
+            request.future.set_result({name: output[i] for name, output in outputs.items()})
+
+    def _call_head(self, head, inputs):
+        start = time.perf_counter()
+        with torch.inference_mode():
+            output = head.model(inputs)
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+        with self._lock:
+            self._head_ms[head.name].append((elapsed_ms, len(inputs)))
+        return output
+
+    def _run_heads(self, frames):
+        """{head name: (n, ...) NumPy output} for one batch; independent heads run concurrently."""
+        outputs = {}
+        waiting = dict(self.heads)
+        pending = {}
+
+        def launch_ready():
+            for name, head in list(waiting.items()):
+                inputs = frames if head.inputs is None else outputs.get(head.inputs)
+                if inputs is None:
+                    continue
+                del waiting[name]
+                if self._pool is None:
+                    outputs[name] = self._call_head(head, inputs)
+                else:
+                    pending[self._pool.submit(self._call_head, head, inputs)] = name
+
+        launch_ready()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                outputs[pending.pop(future)] = future.result()
+            launch_ready()
+        # A head may return a view of its input (e.g. a channel slice); copy those out of the reused batch buffer
+        input_storage = self._input.untyped_storage().data_ptr()
+        return {name: (output.clone() if output.untyped_storage().data_ptr() == input_storage else output).cpu().numpy()
+                if torch.is_tensor(output) else np.array(output) for name, output in outputs.items()}
+
+    def metrics(self):
+        """Frames/batches served, batch fill, queue wait, end-to-end latency and per-head latency summaries."""
+        with self._lock:
+            head_ms = {name: list(values) for name, values in self._head_ms.items()}
+            batch_sizes = list(self._batch_sizes)
+            percentiles = lambda values: {f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)} if values else {}
+            report = {"frames": self.frames, "batches": self.batches,
+                      "mean_batch_size": float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+                      "queue_wait_ms": percentiles(list(self._queue_ms)),
+                      "end_to_end_ms": percentiles(list(self._total_ms))}
+        report["heads"] = {name: latency_summary([ms for ms, _ in values], [size for _, size in values])
+                           for name, values in head_ms.items()}
+        return report
+
+    def close(self):
+        """Finishes every frame already submitted, then stops the batching thread and the head pool."""
+        if self._thread.is_alive():
+            self._requests.put(None)
+            self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import os
+    from models.unet import UNet
+    from models.vit import VisionTransformer
+    from inference import load_model
+    from checkpoints import resolve_checkpoint
+    from config import MODEL_DIR
+
+    parser = argparse.ArgumentParser(description="Compare per-frame batch-1 calls with the micro-batching multi-model scheduler.")
+    parser.add_argument("--checkpoint", type=str, default="latest", help="Segmentation model ('latest', 'best' or a path)")
+    parser.add_argument("--streams", type=int, default=4, help="Concurrent frame streams")
+    parser.add_argument("--frames", type=int, default=16, help="Frames per stream")
+    parser.add_argument("--interval_ms", type=float, default=5.0, help="Time between frames of one stream")
+    parser.add_argument("--max_batch", type=int, default=REALTIME_MAX_BATCH)
+    parser.add_argument("--max_latency_ms", type=float, default=REALTIME_MAX_LATENCY_MS)
+    parser.add_argument("--num_threads", type=int, default=INFERENCE_THREADS)
+    args = parser.parse_args()
+
+    model_path = resolve_checkpoint(args.checkpoint, MODEL_DIR)
+    segmentation = load_model(model_path) if model_path and os.path.isfile(model_path) else UNet(n_channels=2, n_classes=1).eval()
+    n_channels = segmentation.n_channels
+    frame_shape = (n_channels, 64, 64)  # The stub VisionTransformer expects 64x64 frames
+    heads = [Head("segmentation", segmentation, None),
+             Head("scene_class", VisionTransformer(in_channels=n_channels).eval(), None),
+             Head("first_band", lambda x: x[:, :1], None),  # Returns a view of the shared input
+             Head("cloud_fraction", lambda probs: (probs > 0.5).float().mean(dim=(1, 2, 3)), "segmentation")]
+    generator = torch.Generator().manual_seed(0)
+    frames = [[torch.rand(frame_shape, generator=generator).numpy() for _ in range(args.frames)] for _ in range(args.streams)]
+
+    # Baseline: every model called on each frame with a batch of one
+    configure_threads(args.num_threads)
+    start = time.perf_counter()
+    expected = []
+    with torch.inference_mode():
+        for stream in frames:
+            for frame in stream:
+                x = torch.from_numpy(frame)[None]
+                probs = segmentation(x)
+                expected.append({"segmentation": probs[0].numpy(), "scene_class": heads[1].model(x)[0].numpy(),
+                                 "first_band": frame[:1], "cloud_fraction": heads[3].model(probs)[0].numpy()})
+    sequential = time.perf_counter() - start
+
+    with RealTimeInference(heads, frame_shape, args.max_batch, args.max_latency_ms, num_threads=args.num_threads) as server:
+        futures = [[] for _ in frames]
+
+        def feed(s):
+            for frame in frames[s]:
+                futures[s].append(server.submit(frame, stream=s))
+                time.sleep(args.interval_ms / 1000)
+
+        start = time.perf_counter()
+        feeders = [threading.Thread(target=feed, args=(s,)) for s in range(args.streams)]
+        for feeder in feeders:
+            feeder.start()
+        for feeder in feeders:
+            feeder.join()
+        results = [future.result() for stream in futures for future in stream]
+        batched = time.perf_counter() - start
+        report = server.metrics()
+
+    matches = all(np.allclose(r[name], e[name], atol=1e-4) for r, e in zip(results, expected) for name in e)
+    total = args.streams * args.frames
+    print(f"Outputs match batch-1 calls: {matches}")
+    print(f"Sequential batch-1: {total / sequential:.1f} frames/sec; micro-batched: {total / batched:.1f} frames/sec "
+          f"({report['batches']} batches, mean size {report['mean_batch_size']:.1f})")
+    print(f"Queue wait p95 {report['queue_wait_ms']['p95']:.1f} ms, end to end p50 {report['end_to_end_ms']['p50']:.1f} ms, "
+          f"p95 {report['end_to_end_ms']['p95']:.1f} ms")
+    for name, latency in report["heads"].items():
+        print(f"  {name:<15} per batch p50 {latency['per_batch_ms']['p50']:.2f} ms, "
+              f"per frame p50 {latency['per_sample_ms']['p50']:.2f} ms")
@@ -0,0 +1,299 @@
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+# Cached reprojection onto a common lat/lon grid.
+#
+# Building the source->target pixel mapping (KD-tree search or affine inversion over millions of pixels)
+# is the expensive part of reprojection, but a geostationary sensor's fixed grid never changes between
+# scenes. So the mapping is computed once per (sensor, source geometry, target CRS, resolution, bounds,
+# method), saved as an index/weight lookup table, and every scene is then reprojected with one
+# vectorized gather. Tables live in an in-memory LRU (the few grids in active use) backed by .npz files.
+#
+# Target grids are regular in the target CRS. EPSG:4326 needs nothing extra; other CRSs need pyproj.
+# Curvilinear sources (lat/lon bands) need scipy for the KD-tree.
+
+_GEOMETRY_SAMPLES = 33  # Points per axis sampled from lat/lon to fingerprint a source grid
+
+
+class ReprojectionTable:
+    """
+    Lookup table for one source grid -> target grid.
+    index:   (N, k) flat indices into the source window (k=1 nearest, k=4 interpolating)
+    weights: (N, k) float32 or None for nearest
+    valid:   (N,) bool, False where no source pixel is close enough (filled with `fill`)
+    source_window: (row_slice, col_slice) of the source band actually referenced - only this is read
+    target_shape: (rows, cols); target_origin/target_resolution describe the regular target grid
+    """
+
+    def __init__(self, index, weights, valid, source_window, target_shape, target_origin, target_resolution, target_crs):
+        self.index = index
+        self.weights = weights
+        self.valid = valid
+        self.source_window = source_window
+        self.target_shape = tuple(int(n) for n in target_shape)
+        self.target_origin = tuple(float(v) for v in target_origin)  # (y of top row centre, x of left column centre)
+        self.target_resolution = float(target_resolution)
+        self.target_crs = target_crs
+        self._invalid = np.flatnonzero(~valid) if not valid.all() else None
+
+    def apply(self, source, fill=np.nan, out=None):
+        """Reprojects a source-window array (rows, cols) in a single gather; returns float32 (target_shape)."""
+        flat = np.ascontiguousarray(source).reshape(-1)
+        if out is None:
+            out = np.empty(self.target_shape, dtype=np.float32)
+        out_flat = out.reshape(-1)
+        if self.weights is None:
+            if flat.dtype == out.dtype:
+                np.take(flat, self.index[:, 0], out=out_flat)
+            else:
+                out_flat[...] = np.take(flat, self.index[:, 0])
+        else:
+            np.einsum("nk,nk->n", np.take(flat, self.index).astype(np.float32, copy=False), self.weights, out=out_flat)
+        if self._invalid is not None:
+            out_flat[self._invalid] = fill
+        return out
+
+    def target_axes(self):
+        """1-D (y, x) coordinates of target pixel centres, e.g. (lat, lon) for EPSG:4326."""
+        y0, x0 = self.target_origin
+        rows, cols = self.target_shape
+        return (y0 - np.arange(rows) * self.target_resolution, x0 + np.arange(cols) * self.target_resolution)
+
+    def save(self, path):
+        # Unique temporary name: several preprocessing workers may cache the same grid at once
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp.npz", prefix=os.path.basename(path) + ".", dir=os.path.dirname(path) or ".")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, index=self.index, weights=self.weights if self.weights is not None else np.empty(0),
+                     valid=self.valid, source_window=np.array([[s.start, s.stop] for s in self.source_window]),
+                     target_shape=np.array(self.target_shape), target_origin=np.array(self.target_origin),
+                     target_resolution=self.target_resolution, target_crs=self.target_crs)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            weights = f["weights"] if f["weights"].size else None
+            window = tuple(slice(int(a), int(b)) for a, b in f["source_window"])
+            return cls(f["index"], weights, f["valid"], window, f["target_shape"], f["target_origin"],
+                       float(f["target_resolution"]), str(f["target_crs"]))
+
+
+def _to_unit_xyz(lat, lon):
+    lat, lon = np.radians(lat, dtype=np.float64), np.radians(lon, dtype=np.float64)
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def _valid_latlon(lat, lon):
+    return np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 360)
+
+
+def _target_lonlat(target_crs, origin, resolution, shape):
+    """lon/lat of every target pixel centre (flattened), going through pyproj for non-geographic CRSs."""
+    y0, x0 = origin
+    ys = y0 - np.arange(shape[0]) * resolution
+    xs = x0 + np.arange(shape[1]) * resolution
+    xx, yy = np.meshgrid(xs, ys)
+    if target_crs.upper() in ("EPSG:4326", "WGS84"):
+        return xx.ravel(), yy.ravel()
+    from pyproj import Transformer
+    lon, lat = Transformer.from_crs(target_crs, "EPSG:4326", always_xy=True).transform(xx.ravel(), yy.ravel())
+    return np.asarray(lon), np.asarray(lat)
+
+
+def _target_grid_from_bounds(bounds, resolution):
+    """bounds = (south, north, west, east) in target CRS units -> (origin, shape)."""
+    south, north, west, east = bounds
+    shape = (max(1, int(round((north - south) / resolution))), max(1, int(round((east - west) / resolution))))
+    origin = (north - resolution / 2, west + resolution / 2)
+    return origin, shape
+
+
+def _source_window(flat_indices, source_shape, valid):
+    """
+    Smallest (row_slice, col_slice) holding every source pixel referenced by a valid target pixel, plus the
+    (N, k) indices re-based onto that window. Indices of invalid targets are clamped; they get filled anyway.
+    """
+    rows, cols = np.divmod(flat_indices, source_shape[1])
+    valid = np.broadcast_to(valid, rows.shape)
+    if valid.any():
+        r0, r1 = rows[valid].min(), rows[valid].max() + 1
+        c0, c1 = cols[valid].min(), cols[valid].max() + 1
+    else:
+        r0, r1, c0, c1 = 0, 1, 0, 1
+    rows, cols = np.clip(rows, r0, r1 - 1), np.clip(cols, c0, c1 - 1)
+    rebased = (rows - r0) * (c1 - c0) + (cols - c0)
+    return (slice(int(r0), int(r1)), slice(int(c0), int(c1))), rebased
+
+
+def build_table_from_latlon(lat, lon, target_crs="EPSG:4326", target_resolution=None, target_bounds=None,
+                            method="nearest", max_distance_pixels=1.5):
+    """
+    Lookup table for a curvilinear source grid given per-pixel lat/lon (off-disk pixels may be NaN/fill).
+    method="bilinear" uses inverse-distance weights over the 4 nearest source pixels, the usual stand-in for
+    bilinear interpolation on a non-rectilinear grid.
+    """
+    from scipy.spatial import cKDTree
+
+    source_shape = lat.shape
+    valid = _valid_latlon(lat, lon)
+    src_flat = np.flatnonzero(valid)
+    xyz = _to_unit_xyz(lat.ravel()[src_flat], lon.ravel()[src_flat])
+
+    # Source pixel spacing (degrees) from neighbouring rows/cols, used for the default resolution and search radius
+    dlat = np.nanmedian(np.abs(np.diff(np.where(valid, lat, np.nan), axis=0)))
+    dlon = np.nanmedian(np.abs(np.diff(np.where(valid, lon, np.nan), axis=1)))
+    source_res = float(np.nanmax([dlat, dlon]))
+    if target_resolution is None:
+        target_resolution = source_res
+    if target_bounds is None:
+        # lat/lon are pixel centres; the footprint extends half a target pixel beyond them
+        lat_v, lon_v, half = lat[valid], lon[valid], target_resolution / 2
+        target_bounds = (float(lat_v.min()) - half, float(lat_v.max()) + half,
+                         float(lon_v.min()) - half, float(lon_v.max()) + half)
+    origin, shape = _target_grid_from_bounds(target_bounds, target_resolution)
+
+    t_lon, t_lat = _target_lonlat(target_crs, origin, target_resolution, shape)
+    k = 1 if method == "nearest" else 4
+    max_chord = np.radians(source_res * max_distance_pixels)  # Beyond this there is no source pixel (off-disk/outside)
+    dist, nn = cKDTree(xyz).query(_to_unit_xyz(t_lat, t_lon), k=k, distance_upper_bound=max_chord, workers=-1)
+    dist, nn = dist.reshape(-1, k), nn.reshape(-1, k)
+
+    found = nn < len(src_flat)
+    valid_t = found[:, 0]
+    nn = np.where(found, nn, 0)
+    flat = src_flat[nn] if len(src_flat) else np.zeros_like(nn)
+    window, index = _source_window(flat, source_shape, valid_t[:, None])
+
+    weights = None
+    if k > 1:
+        w = np.where(found, 1.0 / np.maximum(dist, 1e-12), 0.0)
+        weights = (w / np.maximum(w.sum(axis=1, keepdims=True), 1e-12)).astype(np.float32)
+    return ReprojectionTable(index, weights, valid_t, window, shape, origin, target_resolution, target_crs)
+
+
+def build_table_from_affine(transform, source_shape, target_resolution=None, target_bounds=None, method="nearest"):
+    """
+    Lookup table for a source already on a regular EPSG:4326 grid (e.g. a GeoTIFF), by inverting its
+    affine transform (a, b, c, d, e, f) analytically - no KD-tree needed.
+    """
+    a, b, c, d, e, f = transform[:6]
+    if b or d:
+        raise ValueError("Rotated source grids are not supported")
+    if target_resolution is None:
+        target_resolution = max(abs(a), abs(e))
+    if target_bounds is None:
+        lons = (c, c + a * source_shape[1])
+        lats = (f, f + e * source_shape[0])
+        target_bounds = (min(lats), max(lats), min(lons), max(lons))
+    origin, shape = _target_grid_from_bounds(target_bounds, target_resolution)
+    t_lon, t_lat = _target_lonlat("EPSG:4326", origin, target_resolution, shape)
+
+    # Fractional source pixel coordinates of each target centre (pixel centres at +0.5)
+    col = (t_lon - c) / a - 0.5
+    row = (t_lat - f) / e - 0.5
+    if method == "nearest":
+        r, cc = np.rint(row).astype(np.int64), np.rint(col).astype(np.int64)
+        valid = (r >= 0) & (r < source_shape[0]) & (cc >= 0) & (cc < source_shape[1])
+        flat = (np.clip(r, 0, source_shape[0] - 1) * source_shape[1] + np.clip(cc, 0, source_shape[1] - 1))[:, None]
+        weights = None
+    else:
+        # Valid anywhere inside the span of source pixel centres; the last row/col interpolates with weight 1
+        eps = 1e-6  # Target centres that coincide with the outermost source centres, up to float error
+        valid = (row >= -eps) & (row <= source_shape[0] - 1 + eps) & (col >= -eps) & (col <= source_shape[1] - 1 + eps)
+        r0 = np.clip(np.floor(row).astype(np.int64), 0, source_shape[0] - 2)
+        c0 = np.clip(np.floor(col).astype(np.int64), 0, source_shape[1] - 2)
+        fr = np.clip(row - r0, 0, 1).astype(np.float32)
+        fc = np.clip(col - c0, 0, 1).astype(np.float32)
+        base = r0 * source_shape[1] + c0
+        flat = np.stack([base, base + 1, base + source_shape[1], base + source_shape[1] + 1], axis=1)
+        weights = np.stack([(1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc], axis=1)
+    window, index = _source_window(flat, source_shape, valid[:, None])
+    return ReprojectionTable(index, weights, valid, window, shape, origin, target_resolution, "EPSG:4326")
+
+
+def source_geometry_key(reader, band):
+    """
+    Fingerprint of a file's source grid: the affine transform + CRS for GeoTIFFs, otherwise the band shape and
+    a sparse sample of the lat/lon bands (a strided read, not the whole arrays).
+    """
+    geo = reader.geolocation()
+    shape = reader.band_shape(band)
+    digest = hashlib.sha1(repr(shape).encode())
+    if "transform" in geo:
+        digest.update(repr((geo["crs"], geo["transform"])).encode())
+    elif geo:
+        step = tuple(max(1, n // (_GEOMETRY_SAMPLES - 1)) for n in shape)
+        sample_window = (slice(0, shape[0], step[0]), slice(0, shape[1], step[1]))
+        for name in (geo["lat"], geo["lon"]):
+            digest.update(np.ascontiguousarray(reader.read(name, sample_window), dtype=np.float32).tobytes())
+    else:
+        raise ValueError(f"{reader.path} has no geolocation (lat/lon bands or affine transform) to reproject from")
+    return digest.hexdigest()[:16]
+
+
+class ReprojectionEngine:
+    """
+    Hands out ReprojectionTables, building each at most once: in-memory LRU first, then `cache_dir`,
+    then a fresh build (which is saved to `cache_dir`).
+    """
+
+    def __init__(self, cache_dir=None, max_cached=4):
+        self.cache_dir = cache_dir
+        self.max_cached = max_cached
+        self._lru = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "builds": 0}
+
+    def table_key(self, sensor, geometry_key, target_crs, target_resolution, target_bounds, method):
+        params = repr((sensor, geometry_key, target_crs, target_resolution, target_bounds, method))
+        return f"{sensor}_{hashlib.sha1(params.encode()).hexdigest()[:16]}"
+
+    def _remember(self, key, table):
+        self._lru[key] = table
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_cached:
+            self._lru.popitem(last=False)
+        return table
+
+    def get_table(self, reader, band, sensor, target_crs="EPSG:4326", target_resolution=None, target_bounds=None,
+                  method="nearest"):
+        target_bounds = tuple(target_bounds) if target_bounds is not None else None
+        key = self.table_key(sensor, source_geometry_key(reader, band), target_crs, target_resolution,
+                             target_bounds, method)
+        if key in self._lru:
+            self.stats["memory_hits"] += 1
+            self._lru.move_to_end(key)
+            return self._lru[key]
+
+        path = os.path.join(self.cache_dir, key + ".npz") if self.cache_dir else None
+        if path and os.path.exists(path):
+            self.stats["disk_hits"] += 1
+            return self._remember(key, ReprojectionTable.load(path))
+
+        self.stats["builds"] += 1
+        geo = reader.geolocation()
+        if "transform" in geo:
+            if geo["crs"].upper() != target_crs.upper():
+                raise ValueError(f"GeoTIFF in {geo['crs']} -> {target_crs} is not supported; warp it to {target_crs} first")
+            table = build_table_from_affine(geo["transform"], reader.band_shape(band), target_resolution,
+                                            target_bounds, method)
+        else:
+            table = build_table_from_latlon(reader.read(geo["lat"]), reader.read(geo["lon"]), target_crs,
+                                            target_resolution, target_bounds, method)
+        if path:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            table.save(path)
+        return self._remember(key, table)
+
+
+_engines = {}
+
+
+def get_engine(cache_dir=None, max_cached=4):
+    """Per-process engine for a cache directory, so pool workers reuse tables across the scenes they handle."""
+    if cache_dir not in _engines:
+        _engines[cache_dir] = ReprojectionEngine(cache_dir, max_cached)
+    return _engines[cache_dir]
@@ -0,0 +1,93 @@
+import os
+import time
+import traceback
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Process-pool scheduler for per-source work (preprocessing raw files, ingest, evaluation shards).
+# Tasks are fanned out across cores, but each source can be capped to a number of in-flight tasks,
+# so a few heavy MODIS/Sentinel granules cannot occupy every worker while half-hourly INSAT scenes queue up.
+# Sources are served round-robin whenever a worker frees up.
+
+TaskResult = namedtuple("TaskResult", ["source", "args", "ok", "value", "error", "elapsed"])
+
+
+def _run_task(worker_fn, args):
+    """Runs in the worker process. Exceptions are returned, not raised, so one bad file never kills the batch."""
+    start = time.perf_counter()
+    try:
+        value = worker_fn(*args)
+        return True, value, None, time.perf_counter() - start
+    except Exception:
+        return False, None, traceback.format_exc(), time.perf_counter() - start
+
+
+def print_progress(done, total, result):
+    status = "ok" if result.ok else "FAILED"
+    print(f"[{done}/{total}] {result.source}: {result.args[0] if result.args else ''} - {status} ({result.elapsed:.1f}s)")
+
+
+def run_per_source_pool(tasks, worker_fn, max_workers=None, source_limits=None, progress=print_progress):
+    """
+    Runs worker_fn(*args) for every (source, args) in `tasks` and returns TaskResults in task order.
+
+    max_workers: pool size (defaults to os.cpu_count()); 1 runs everything in-process, which is
+                 handy for debugging.
+    source_limits: {source: max in-flight tasks}; sources not listed are only bounded by max_workers.
+    progress: called as progress(done, total, result) after each task, or None for silence.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    source_limits = source_limits or {}
+    results = [None] * len(tasks)
+    total = len(tasks)
+
+    def record(i, ok, value, error, elapsed):
+        source, args = tasks[i]
+        results[i] = TaskResult(source, args, ok, value, error, elapsed)
+        if progress is not None:
+            progress(sum(r is not None for r in results), total, results[i])
+
+    if max_workers == 1:
+        for i, (_, args) in enumerate(tasks):
+            record(i, *_run_task(worker_fn, args))
+        return results
+
+    pending = {}  # source -> deque of task indices, in submission order
+    for i, (source, _) in enumerate(tasks):
+        pending.setdefault(source, deque()).append(i)
+    rotation = deque(pending)
+    in_flight = {source: 0 for source in pending}
+    futures = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        def fill():
+            # Hand free workers to sources round-robin, skipping sources at their limit
+            skipped = 0
+            while len(futures) < max_workers and rotation and skipped < len(rotation):
+                source = rotation[0]
+                rotation.rotate(-1)
+                limit = source_limits.get(source)
+                if not pending[source] or (limit is not None and in_flight[source] >= limit):
+                    skipped += 1
+                    continue
+                skipped = 0
+                i = pending[source].popleft()
+                try:
+                    futures[pool.submit(_run_task, worker_fn, tasks[i][1])] = i
+                    in_flight[source] += 1
+                except Exception:  # Pool already broken; fail the task rather than the batch
+                    record(i, False, None, traceback.format_exc(), 0.0)
+
+        fill()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures.pop(future)
+                in_flight[tasks[i][0]] -= 1
+                try:
+                    record(i, *future.result())
+                except Exception:  # Worker died (e.g. BrokenProcessPool); record and keep going
+                    record(i, False, None, traceback.format_exc(), 0.0)
+            fill()
+
+    return results
@@ -0,0 +1,119 @@
+import os
+import argparse
+import numpy as np
+
+# Small synthetic satellite files for exercising readers.py and the preprocessing pipeline locally.
+# Each file carries uint16 count bands (INSAT-like TIR1/VIS names), scale/offset attributes, lat/lon
+# grids and INSAT-style count->TEMP/ALBEDO tables (GeoTIFF: as metadata, see readers.py), stored chunked so
+# windowed reads can be checked. Formats whose library is not installed are skipped with a note.
+
+DEFAULT_BANDS = ("IMG_TIR1", "IMG_VIS")
+
+
+def synthetic_counts(shape, n_bands, seed=0):
+    """Smooth blobs over noise, as uint16 10-bit counts - enough structure for thresholds and patches."""
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:shape[0], 0:shape[1]]
+    bands = []
+    for b in range(n_bands):
+        field = rng.normal(0, 20, size=shape)
+        for _ in range(4):
+            cy, cx = rng.uniform(0, shape[0]), rng.uniform(0, shape[1])
+            radius = rng.uniform(0.05, 0.2) * min(shape)
+            field += 400 * np.exp(-((rows - cy) ** 2 + (cols - cx) ** 2) / (2 * radius ** 2))
+        bands.append(np.clip(field + 300, 0, 1023).astype(np.uint16))
+    return np.stack(bands)
+
+
+def _lat_lon(shape, bounds=(-10.0, 30.0, 60.0, 100.0)):
+    lat0, lat1, lon0, lon1 = bounds
+    lat = np.linspace(lat1, lat0, shape[0], dtype=np.float32)
+    lon = np.linspace(lon0, lon1, shape[1], dtype=np.float32)
+    return np.meshgrid(lat, lon, indexing="ij")
+
+
+def calibration_tables(n_counts=1024):
+    """INSAT L1B-style count->value tables: TEMP (K, decreasing with count) for thermal, ALBEDO (%) for visible."""
+    counts = np.arange(n_counts, dtype=np.float32)
+    return {"IMG_TIR1_TEMP": 320.0 - 130.0 * counts / (n_counts - 1), "IMG_VIS_ALBEDO": 100.0 * counts / (n_counts - 1)}
+
+
+def write_netcdf(path, counts, bands=DEFAULT_BANDS, chunks=(64, 64)):
+    import netCDF4
+    lat, lon = _lat_lon(counts.shape[1:])
+    with netCDF4.Dataset(path, "w") as ds:
+        ds.createDimension("time", 1)
+        ds.createDimension("y", counts.shape[1])
+        ds.createDimension("x", counts.shape[2])
+        for name, data in zip(bands, counts):
+            var = ds.createVariable(name, "u2", ("time", "y", "x"), chunksizes=(1,) + chunks)
+            var.set_auto_maskandscale(False)  # Store the counts as given, not packed through scale/offset
+            var.scale_factor, var.add_offset = 0.1, 150.0
+            var[0] = data
+        ds.createVariable("Latitude", "f4", ("y", "x"))[:] = lat
+        ds.createDimension("GreyCount", 1024)
+        for name, table in calibration_tables().items():
+            ds.createVariable(name, "f4", ("GreyCount",))[:] = table
+        ds.createVariable("Longitude", "f4", ("y", "x"))[:] = lon
+
+
+def write_hdf5(path, counts, bands=DEFAULT_BANDS, chunks=(64, 64)):
+    import h5py
+    lat, lon = _lat_lon(counts.shape[1:])
+    with h5py.File(path, "w") as f:
+        for name, data in zip(bands, counts):
+            ds = f.create_dataset(name, data=data[np.newaxis], chunks=(1,) + chunks)
+            ds.attrs["scale_factor"], ds.attrs["add_offset"] = 0.1, 150.0
+        f.create_dataset("Latitude", data=lat)
+        f.create_dataset("Longitude", data=lon)
+        for name, table in calibration_tables().items():
+            f.create_dataset(name, data=table)
+
+
+def write_geotiff(path, counts, bands=DEFAULT_BANDS, block=64, bounds=(-10.0, 30.0, 60.0, 100.0)):
+    import rasterio
+    from rasterio.transform import from_bounds
+    from readers import GEOTIFF_TABLE_NAMESPACE
+    lat0, lat1, lon0, lon1 = bounds
+    transform = from_bounds(lon0, lat0, lon1, lat1, counts.shape[2], counts.shape[1])
+    with rasterio.open(path, "w", driver="GTiff", height=counts.shape[1], width=counts.shape[2],
+                       count=len(counts), dtype="uint16", crs="EPSG:4326", transform=transform,
+                       tiled=True, blockxsize=block, blockysize=block) as dst:
+        dst.write(counts)
+        for i, name in enumerate(bands, start=1):
+            dst.set_band_description(i, name)
+        dst.scales = (0.1,) * len(counts)
+        dst.offsets = (150.0,) * len(counts)
+        dst.update_tags(ns=GEOTIFF_TABLE_NAMESPACE,
+                        **{name: " ".join(map(str, table.tolist())) for name, table in calibration_tables().items()})
+
+
+WRITERS = {".nc": write_netcdf, ".h5": write_hdf5, ".tif": write_geotiff}
+
+
+def make_synthetic_fixtures(out_dir, shape=(256, 256), bands=DEFAULT_BANDS, n_files=1, prefix="synthetic", seed=0):
+    """Writes n_files of each available format into out_dir; returns the written paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for i in range(n_files):
+        counts = synthetic_counts(shape, len(bands), seed=seed + i)
+        for ext, writer in WRITERS.items():
+            path = os.path.join(out_dir, f"{prefix}_{i:03d}{ext}")
+            try:
+                writer(path, counts, bands)
+            except ImportError as e:
+                print(f"Skipping {ext} fixtures: {e}")
+                continue
+            written.append(path)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate small synthetic .nc/.h5/.tif satellite files.")
+    parser.add_argument("--out_dir", type=str, required=True, help="Directory to write fixtures into")
+    parser.add_argument("--size", type=int, default=256, help="Height and width in pixels")
+    parser.add_argument("--n_files", type=int, default=1, help="Files per format")
+    args = parser.parse_args()
+
+    for path in make_synthetic_fixtures(args.out_dir, shape=(args.size, args.size), n_files=args.n_files):
+        print(f"Wrote {path}")
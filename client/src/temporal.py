@@ -0,0 +1,205 @@
+import time
+import argparse
+from datetime import datetime
+import numpy as np
+import torch
+
+from normalization import frame_normalizer
+
+try:
+    from config import CONVLSTM_SEQUENCE_LENGTH, FRAME_INTERVAL_SECONDS, NORMALIZER_PATH, PREPROCESS_STAGES
+except ImportError:
+    print("Warning: config.py not found, using placeholder temporal settings.")
+    CONVLSTM_SEQUENCE_LENGTH = 10
+    FRAME_INTERVAL_SECONDS = 1800
+    NORMALIZER_PATH = "data/processed/normalizer.json"
+    PREPROCESS_STAGES = {"bands": {}}
+
+# Frame history for the temporal (ConvLSTM) model.
+#
+# Each region keeps the last N frames in a FrameRingBuffer: one preallocated array, written in place, with
+# frames filed into fixed time slots (timestamp // interval). Every slot is stored twice, at i and i + N, so
+# the N most recent slots are always one contiguous slice of the array and sequence() returns them oldest
+# first as a view, never a copy; torch.from_numpy on that view feeds the model directly. Slots with no frame
+# (a missed scan) read as zeros and are flagged invalid, and the ConvLSTM carries its state across them.
+# Frames that arrive late still land in their own slot, as long as it is inside the window.
+#
+# TemporalInference runs the model per region in one of two modes. "window" recomputes the whole N-frame
+# sequence for every new frame. "incremental" keeps each region's hidden state and runs a single timestep
+# per new frame (missed slots cost nothing); its state therefore summarizes the whole stream rather than just
+# the last N frames. A late frame, or a gap longer than the window, rebuilds the state from the buffer.
+# Given a sensor, frames are calibrated band values and are scaled by the fitted dataset normalizer before
+# they enter the buffer, as in realtime.py.
+
+
+def _seconds(timestamp):
+    return timestamp.timestamp() if isinstance(timestamp, datetime) else float(timestamp)
+
+
+class FrameRingBuffer:
+    """The last `length` time slots of (C, H, W) frames for one region."""
+
+    def __init__(self, length, frame_shape, interval=FRAME_INTERVAL_SECONDS, dtype=np.float32):
+        self.length = length
+        self.interval = interval
+        self._frames = np.zeros((2 * length,) + tuple(frame_shape), dtype=dtype)
+        self._valid = np.zeros(2 * length, dtype=bool)
+        self._times = np.full(2 * length, np.nan)
+        self.latest = None  # Slot number of the newest slot
+
+    def slot_of(self, timestamp):
+        return int(round(_seconds(timestamp) / self.interval))
+
+    def _clear(self, first, last):
+        positions = np.arange(first, last + 1) % self.length
+        positions = np.concatenate([positions, positions + self.length])
+        self._frames[positions] = 0
+        self._valid[positions] = False
+        self._times[positions] = np.nan
+
+    def push(self, frame, timestamp):
+        """Stores `frame` in its time slot; returns False (and drops it) if the slot is older than the window."""
+        slot = self.slot_of(timestamp)
+        if self.latest is None or slot > self.latest:
+            first = slot - self.length + 1 if self.latest is None else max(self.latest + 1, slot - self.length + 1)
+            self._clear(first, slot)
+            self.latest = slot
+        elif slot <= self.latest - self.length:
+            return False
+        position = slot % self.length
+        for i in (position, position + self.length):
+            self._frames[i] = frame
+            self._valid[i] = True
+            self._times[i] = _seconds(timestamp)
+        return True
+
+    def frame(self, slot):
+        """View of the frame stored for `slot` (zeros if missing)."""
+        return self._frames[slot % self.length]
+
+    def sequence(self):
+        """(frames (N, C, H, W), valid (N,), timestamps (N,)): views of the last N slots, oldest first."""
+        start = 0 if self.latest is None else (self.latest + 1) % self.length
+        window = slice(start, start + self.length)
+        return self._frames[window], self._valid[window], self._times[window]
+
+
+class TemporalInference:
+    """Per-region frame buffers (and, in "incremental" mode, hidden states) for a ConvLSTM-style model."""
+
+    MODES = ("incremental", "window")
+
+    def __init__(self, model, length=CONVLSTM_SEQUENCE_LENGTH, interval=FRAME_INTERVAL_SECONDS, mode="incremental",
+                 device="cpu", sensor=None, bands=None, normalizer_path=NORMALIZER_PATH):
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}, got {mode!r}")
+        self._normalize = None
+        if sensor is not None:  # Frames are calibrated values; None = already normalized
+            self._normalize = frame_normalizer(normalizer_path, sensor, bands or PREPROCESS_STAGES["bands"][sensor])
+        self.model = model.to(device).eval()
+        self.length = length
+        self.interval = interval
+        self.mode = mode
+        self.device = torch.device(device)
+        self.buffers = {}  # region -> FrameRingBuffer
+        self.states = {}  # region -> (hidden state, last slot included in it)
+        self.stats = {"frames": 0, "dropped": 0, "timesteps": 0, "seconds": 0.0}
+
+    def _replay(self, buffer):
+        frames, valid, _ = buffer.sequence()
+        inputs = torch.from_numpy(frames).to(self.device)[None]
+        outputs, state = self.model(inputs, valid=torch.from_numpy(valid).to(self.device)[None])
+        self.stats["timesteps"] += self.length
+        return outputs[0], state
+
+    @torch.inference_mode()
+    def update(self, region, frame, timestamp):
+        """
+        Adds a (C, H, W) frame for `region` and returns the model output for its time slot as a
+        (n_classes, H, W) array, or None if the frame is older than the buffered window.
+        """
+        start = time.perf_counter()
+        if self._normalize is not None:
+            frame = self._normalize(frame)
+        buffer = self.buffers.get(region)
+        if buffer is None:
+            buffer = self.buffers[region] = FrameRingBuffer(self.length, frame.shape, self.interval)
+        slot = buffer.slot_of(timestamp)
+        if not buffer.push(frame, timestamp):
+            self.stats["dropped"] += 1
+            return None
+
+        state, included = self.states.get(region, (None, None))
+        if self.mode == "window" or (included is not None and slot <= included):
+            outputs, state = self._replay(buffer)  # Late frame: rebuild from the window
+            output = outputs[slot - (buffer.latest - self.length + 1)]
+            if self.mode == "incremental":
+                self.states[region] = (state, buffer.latest)
+        else:
+            if included is not None and slot - included > self.length:
+                state = None  # Gap longer than the window: start afresh
+            inputs = torch.from_numpy(buffer.frame(slot)).to(self.device)[None]
+            output, state = self.model.step(inputs, state)
+            output = output[0]
+            self.states[region] = (state, slot)
+            self.stats["timesteps"] += 1
+
+        self.stats["frames"] += 1
+        self.stats["seconds"] += time.perf_counter() - start
+        return output.cpu().numpy()
+
+    def reset(self, region=None):
+        """Forgets the frames and state of one region (or of all)."""
+        for store in (self.buffers, self.states):
+            if region is None:
+                store.clear()
+            else:
+                store.pop(region, None)
+
+
+if __name__ == "__main__":
+    from models.convlstm import ConvLSTM
+
+    parser = argparse.ArgumentParser(description="Check the frame ring buffer and time incremental vs windowed ConvLSTM updates.")
+    parser.add_argument("--regions", type=int, default=2)
+    parser.add_argument("--frames", type=int, default=24, help="Half-hourly frames per region")
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--hidden", type=int, default=16)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = ConvLSTM(args.channels, 1, hidden_channels=(args.hidden, args.hidden)).eval()
+    rng = np.random.default_rng(0)
+    t0 = datetime(2025, 6, 1).timestamp()
+    missing = {5, 6, args.frames - 4}  # Missed scans
+    stream = [(f"region{r}", rng.random((args.channels, args.size, args.size), dtype=np.float32), t0 + i * FRAME_INTERVAL_SECONDS)
+              for i in range(args.frames) if i not in missing for r in range(args.regions)]
+
+    buffer = FrameRingBuffer(CONVLSTM_SEQUENCE_LENGTH, (args.channels, args.size, args.size))
+    for region, frame, timestamp in stream:
+        if region == "region0":
+            buffer.push(frame, timestamp)
+    frames, valid, _ = buffer.sequence()
+    print(f"Sequence is a view of the buffer: {np.shares_memory(frames, buffer._frames)}, contiguous: "
+          f"{frames.flags['C_CONTIGUOUS']}, valid slots: {valid.astype(int).tolist()}")
+
+    results = {}
+    for mode in TemporalInference.MODES:
+        engine = TemporalInference(model, mode=mode)
+        results[mode] = [engine.update(*item) for item in stream]
+        print(f"{mode:<12} {1000 * engine.stats['seconds'] / engine.stats['frames']:.1f} ms per frame, "
+              f"{engine.stats['timesteps'] / engine.stats['frames']:.1f} timesteps per frame")
+
+    # Until the stream outgrows the window, both modes have seen the same frames
+    first_window = [i for i, (_, _, timestamp) in enumerate(stream)
+                    if timestamp < t0 + CONVLSTM_SEQUENCE_LENGTH * FRAME_INTERVAL_SECONDS]
+    print("Incremental matches windowed over the first window:",
+          all(np.allclose(results["incremental"][i], results["window"][i], atol=1e-5) for i in first_window))
+
+    engine = TemporalInference(model)
+    for item in stream:
+        engine.update(*item)
+    late = engine.update("region0", stream[0][1], t0 + (args.frames - 3) * FRAME_INTERVAL_SECONDS)
+    print(f"Late frame inside the window accepted: {late is not None}; frame older than the window dropped: "
+          f"{engine.update('region0', stream[0][1], t0) is None}")
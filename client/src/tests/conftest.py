@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline modules are flat scripts in client/src, imported by plain name as the CLIs do.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
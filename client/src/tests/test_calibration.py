@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from calibration import build_calibration
+import synthetic_data
+from readers import open_satellite_file
+from synthetic_data import WRITERS, synthetic_counts, write_geotiff
+from config import PREPROCESS_STAGES
+
+SPECS = PREPROCESS_STAGES["calibrate"]["isro_insat"]
+
+
+def _calibrated(path):
+    reader = open_satellite_file(path)
+    return {band: build_calibration(reader, reader.resolve_band(band), spec)(reader.read(reader.resolve_band(band)))
+            for band, spec in SPECS.items()}
+
+
+def _write_all(tmp_path, counts):
+    paths = []
+    for ext, writer in WRITERS.items():
+        path = str(tmp_path / f"scene{ext}")
+        try:
+            writer(path, counts)
+        except ImportError:
+            continue
+        paths.append(path)
+    return paths
+
+
+def test_scene_calibrates_identically_in_every_container(tmp_path):
+    paths = _write_all(tmp_path, synthetic_counts((64, 64), 2, seed=1))
+    if len(paths) < 2:
+        pytest.skip("needs at least two of netCDF4, h5py, rasterio")
+    reference = _calibrated(paths[0])
+    assert 150 < np.nanmin(reference["TIR1"]) and np.nanmax(reference["TIR1"]) < 330
+    assert 0 <= np.nanmin(reference["VIS"]) and np.nanmax(reference["VIS"]) <= 100
+    for path in paths[1:]:
+        for band, values in _calibrated(path).items():
+            np.testing.assert_array_equal(values, reference[band], err_msg=f"{band} differs in {path}")
+
+
+def test_missing_table_is_refused(tmp_path, monkeypatch):
+    pytest.importorskip("rasterio")
+    monkeypatch.setattr(synthetic_data, "calibration_tables", lambda: {})  # Scale/offset only
+    path = str(tmp_path / "no_tables.tif")
+    write_geotiff(path, synthetic_counts((64, 64), 2))
+    reader = open_satellite_file(path)
+    with pytest.raises(ValueError, match="TIR1_TEMP"):
+        build_calibration(reader, reader.resolve_band("TIR1"), SPECS["TIR1"])
@@ -0,0 +1,130 @@
+import os
+import asyncio
+import hashlib
+import zipfile
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import downloader
+from downloader import (DownloadTask, StreamingZipExtractor, backoff_delay, download_many, start_test_server,
+                        _test_archive)
+
+MEMBERS = {f"IR/scene_{i}.bin": bytes(range(256)) * (200 + 50 * i) for i in range(3)}
+
+
+def _serve_and_download(files, faults, tasks_for, dest, **kwargs):
+    """Runs download_many against the local stand-in server; returns (results, request log)."""
+    async def run():
+        runner, base_url, request_log = await start_test_server(files, faults)
+        try:
+            results = await download_many(tasks_for(base_url), str(dest), progress=None, base_delay=0.01,
+                                          max_delay=0.05, **kwargs)
+        finally:
+            await runner.cleanup()
+        return results, request_log
+    return asyncio.run(run())
+
+
+def _task(base_url, name, data, extract_to=None, sha256=None):
+    return DownloadTask(f"{base_url}/{name}", sha256=sha256 or hashlib.sha256(data).hexdigest(), extract_to=extract_to)
+
+
+def test_resumes_broken_transfer_with_range(tmp_path):
+    data = os.urandom(3 * 1024 * 1024)
+    files = {"scene.h5": data}
+    results, log = _serve_and_download(files, {"scene.h5": ["cut"]}, lambda url: [_task(url, "scene.h5", data)], tmp_path)
+
+    result = results[0]
+    assert result.ok and result.attempts == 2 and result.resumed_from > 0
+    assert log[1][1] == f"bytes={result.resumed_from}-"
+    assert (tmp_path / "scene.h5").read_bytes() == data
+    assert not (tmp_path / "scene.h5.part").exists()
+
+
+def test_checksum_mismatch_downloads_again(tmp_path):
+    data = os.urandom(500_000)
+    files = {"granule.nc": data}
+    results, log = _serve_and_download(files, {"granule.nc": ["corrupt"]}, lambda url: [_task(url, "granule.nc", data)],
+                                       tmp_path)
+    assert results[0].ok and results[0].attempts == 2
+    assert [range_header for _, range_header, _ in log] == [None, None]  # The corrupt bytes are not resumed
+    assert (tmp_path / "granule.nc").read_bytes() == data
+
+
+def test_wrong_checksum_fails_without_final_file(tmp_path):
+    data = os.urandom(100_000)
+    results, _ = _serve_and_download({"granule.nc": data}, {},
+                                     lambda url: [_task(url, "granule.nc", data, sha256="0" * 64)], tmp_path, retries=1)
+    assert not results[0].ok and "mismatch" in results[0].error
+    assert not (tmp_path / "granule.nc").exists()
+
+
+def test_retries_back_off_with_jitter(tmp_path, monkeypatch):
+    delays = []
+
+    def recording_backoff(attempt, base_delay, max_delay):
+        delays.append((attempt, base_delay, max_delay))
+        return 0.0
+
+    monkeypatch.setattr(downloader, "backoff_delay", recording_backoff)
+    data = os.urandom(50_000)
+    results, log = _serve_and_download({"granule.nc": data}, {"granule.nc": ["503", "503", "cut"]},
+                                       lambda url: [_task(url, "granule.nc", data)], tmp_path, retries=3)
+    assert results[0].ok and results[0].attempts == 4 and len(log) == 4
+    assert [attempt for attempt, _, _ in delays] == [0, 1, 2]
+
+    monkeypatch.undo()
+    for attempt in range(8):
+        cap = min(0.5, 0.01 * 2 ** attempt)
+        samples = [backoff_delay(attempt, 0.01, 0.5) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in samples)
+        assert len(set(samples)) > 1  # Jittered, not a fixed schedule
+
+
+def test_retries_exhausted_reports_failure(tmp_path):
+    data = os.urandom(10_000)
+    results, log = _serve_and_download({"granule.nc": data}, {"granule.nc": ["503"] * 3},
+                                       lambda url: [_task(url, "granule.nc", data)], tmp_path, retries=2)
+    assert not results[0].ok and results[0].attempts == 3 and "503" in results[0].error
+    assert len(log) == 3
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_archive_is_extracted_while_streaming(tmp_path, streamed):
+    archive = _test_archive(MEMBERS, streamed)
+    extract_to = tmp_path / "batch"
+    results, _ = _serve_and_download({"batch.zip": archive}, {"batch.zip": ["cut"]},
+                                     lambda url: [_task(url, "batch.zip", archive, extract_to=str(extract_to))], tmp_path)
+    assert results[0].ok and results[0].resumed_from > 0
+    assert sorted(results[0].extracted) == sorted(MEMBERS)
+    for name, data in MEMBERS.items():
+        assert (extract_to / name).read_bytes() == data
+
+
+def test_extractor_handles_tiny_chunks_and_refuses_escaping_paths(tmp_path):
+    archive = _test_archive(MEMBERS, streamed=True)
+    extractor = StreamingZipExtractor(str(tmp_path))
+    for first in range(0, len(archive), 7):
+        extractor.feed(archive[first:first + 7])
+    assert sorted(extractor.close()) == sorted(MEMBERS)
+
+    escaping = _test_archive({"../outside.bin": b"x"}, streamed=False)
+    with pytest.raises(zipfile.BadZipFile):
+        StreamingZipExtractor(str(tmp_path / "inner")).feed(escaping)
+
+
+def test_completed_extraction_is_skipped_after_archive_removal(tmp_path):
+    archive = _test_archive(MEMBERS, streamed=False)
+    extract_to = str(tmp_path / "batch")
+    tasks_for = lambda url: [_task(url, "batch.zip", archive, extract_to=extract_to)]
+
+    first, log = _serve_and_download({"batch.zip": archive}, {}, tasks_for, tmp_path, keep_archive=False)
+    assert first[0].ok and not first[0].skipped and not (tmp_path / "batch.zip").exists()
+    again, log = _serve_and_download({"batch.zip": archive}, {}, tasks_for, tmp_path, keep_archive=False)
+    assert again[0].ok and again[0].skipped and log == []
+
+    os.remove(os.path.join(extract_to, next(iter(MEMBERS))))  # A missing member means it must be fetched again
+    third, log = _serve_and_download({"batch.zip": archive}, {}, tasks_for, tmp_path, keep_archive=False)
+    assert third[0].ok and not third[0].skipped and len(log) == 1
@@ -0,0 +1,401 @@
+import os
+import re
+import glob
+import time
+import calendar
+import argparse
+import numpy as np
+
+from labels import CLUSTER_FIELDS, label_clusters
+
+try:
+    from config import FRAME_INTERVAL_SECONDS, TRACK_MAX_DISTANCE, TRACK_MAX_MISSED
+except ImportError:
+    print("Warning: config.py not found, using placeholder tracking settings.")
+    FRAME_INTERVAL_SECONDS = 1800
+    TRACK_MAX_DISTANCE = 20.0
+    TRACK_MAX_MISSED = 2
+
+# Tracking of cloud clusters across half-hourly frames.
+#
+# Each frame's clusters (labels.label_clusters: a label image and the columnar properties) are matched to the
+# active tracks in one assignment. The pixel overlap between the previous frame's clusters and the new ones
+# is counted with a single bincount over label pairs, giving an IoU matrix; every track's centroid is
+# predicted by a constant-velocity Kalman filter run on all tracks at once (stacked state vectors and
+# covariances, batched matrix products). A track/cluster pair is allowed if the clusters overlap or the
+# centroid is within max_distance of the prediction; the cost is (1 - IoU) + distance / max_distance, and
+# scipy's linear_sum_assignment picks the optimal one-to-one matching.
+#
+# Overlaps left over after the matching are merges and splits: an unmatched track that overlaps a cluster
+# taken by another track has merged into it (the track ends), and an unmatched cluster that overlaps a
+# previous cluster whose track continued elsewhere has split off (a new track with that track as parent).
+# Other unmatched tracks coast on their prediction for up to max_missed frames.
+#
+# Everything is kept in columns: the active-track state is a handful of arrays, and the history is an
+# append-only TrackStore (one growable array per column, capacity doubling), so replaying months of frames
+# with hundreds of clusters each does no per-cluster Python work beyond the assignment itself.
+
+EVENT_KINDS = ("start", "split", "merge", "end")
+_START, _SPLIT, _MERGE, _END = range(len(EVENT_KINDS))
+_INFEASIBLE = 1e6
+
+
+class ColumnTable:
+    """Append-only table of named NumPy columns; capacity doubles as rows are added."""
+
+    def __init__(self, dtypes, capacity=1024):
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+        self.size = 0
+
+    def append(self, **values):
+        n = len(next(iter(values.values())))
+        if self.size + n > len(next(iter(self._columns.values()))):
+            capacity = max(2 * (self.size + n), 1024)
+            for name, column in self._columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                self._columns[name] = grown
+        for name, column in self._columns.items():
+            column[self.size:self.size + n] = values[name]
+        self.size += n
+
+    def __getitem__(self, name):
+        return self._columns[name][:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def to_dict(self):
+        return {name: self[name] for name in self._columns}
+
+
+class TrackStore:
+    """History of a tracking run: one row per (track, frame) observation, plus start/split/merge/end events."""
+
+    OBSERVATION_DTYPES = {"track": np.int64, "frame": np.int64, "time": np.float64, "label": np.int32, "area": np.int64,
+                          "centroid_row": np.float64, "centroid_col": np.float64, "velocity_row": np.float32,
+                          "velocity_col": np.float32, "eccentricity": np.float32, "min_bt": np.float32, "mean_bt": np.float32}
+    EVENT_DTYPES = {"frame": np.int64, "kind": np.int8, "track": np.int64, "other": np.int64}
+
+    def __init__(self):
+        self.observations = ColumnTable(self.OBSERVATION_DTYPES)
+        self.events = ColumnTable(self.EVENT_DTYPES, capacity=256)
+
+    def tracks(self):
+        """Per-track summary columns: track, first/last frame, observations, max area, min BT, parent, merged_into."""
+        obs = self.observations
+        ids, inverse, counts = np.unique(obs["track"], return_inverse=True, return_counts=True)
+        first = np.full(len(ids), np.iinfo(np.int64).max)
+        last = np.full(len(ids), -1)
+        max_area = np.zeros(len(ids), dtype=np.int64)
+        min_bt = np.full(len(ids), np.inf, dtype=np.float32)
+        np.minimum.at(first, inverse, obs["frame"])
+        np.maximum.at(last, inverse, obs["frame"])
+        np.maximum.at(max_area, inverse, obs["area"])
+        np.minimum.at(min_bt, inverse, obs["min_bt"])
+
+        parent = np.zeros(len(ids), dtype=np.int64)
+        merged_into = np.zeros(len(ids), dtype=np.int64)
+        events = self.events
+        for kind, target, column in ((_SPLIT, parent, "other"), (_MERGE, merged_into, "other")):
+            selected = events["kind"] == kind
+            positions = np.searchsorted(ids, events["track"][selected])
+            target[positions] = events[column][selected]
+        return {"track": ids, "first_frame": first, "last_frame": last, "observations": counts, "max_area": max_area,
+                "min_bt": min_bt, "parent": parent, "merged_into": merged_into}
+
+    def save(self, path):
+        columns = {f"obs_{name}": values for name, values in self.observations.to_dict().items()}
+        columns.update({f"event_{name}": values for name, values in self.events.to_dict().items()})
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **columns)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        with np.load(path) as data:
+            store.observations.append(**{name: data[f"obs_{name}"] for name in cls.OBSERVATION_DTYPES})
+            store.events.append(**{name: data[f"event_{name}"] for name in cls.EVENT_DTYPES})
+        return store
+
+
+def overlap_matrix(previous_labels, labels, n_previous, n_current):
+    """(n_previous, n_current) pixel counts shared by cluster i of the previous frame and cluster j of this one."""
+    both = (previous_labels > 0) & (labels > 0)
+    pairs = previous_labels[both].astype(np.int64) * (n_current + 1) + labels[both]
+    counts = np.bincount(pairs, minlength=(n_previous + 1) * (n_current + 1))
+    return counts.reshape(n_previous + 1, n_current + 1)[1:, 1:]
+
+
+class ClusterTracker:
+    """
+    Frame-by-frame tracker; update() takes one frame's label image and cluster properties (ids 1..n, as
+    from labels.label_clusters) and returns the track id of every cluster. History is in `self.store`.
+    """
+
+    def __init__(self, max_distance=TRACK_MAX_DISTANCE, max_missed=TRACK_MAX_MISSED, interval=FRAME_INTERVAL_SECONDS,
+                 process_noise=1.0, measurement_noise=1.0):
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.interval = interval
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.store = TrackStore()
+        self.frame = -1
+        self._next_id = 1
+        self._time = None
+        self._previous_labels = None
+        self._n_previous = 0
+        # Active tracks, one row each
+        self._ids = np.empty(0, dtype=np.int64)
+        self._x = np.empty((0, 4))  # row, col, row velocity, col velocity (pixels per interval)
+        self._P = np.empty((0, 4, 4))
+        self._label = np.empty(0, dtype=np.int32)  # Cluster id in the previous frame (0 = not seen there)
+        self._missed = np.empty(0, dtype=np.int32)
+
+    @property
+    def active_tracks(self):
+        return self._ids.copy()
+
+    def _predict(self, dt):
+        F = np.eye(4)
+        F[0, 2] = F[1, 3] = dt
+        q = self.process_noise * np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]])
+        Q = np.zeros((4, 4))
+        Q[np.ix_([0, 2], [0, 2])] = q
+        Q[np.ix_([1, 3], [1, 3])] = q
+        self._x = self._x @ F.T
+        self._P = F @ self._P @ F.T + Q
+
+    def _correct(self, rows, measurements):
+        P = self._P[rows]
+        innovation = measurements - self._x[rows, :2]
+        S = P[:, :2, :2] + self.measurement_noise * np.eye(2)
+        K = P[:, :, :2] @ np.linalg.inv(S)
+        self._x[rows] += (K @ innovation[..., None])[..., 0]
+        self._P[rows] = P - K @ P[:, :2, :]
+
+    def _start_tracks(self, centroids):
+        n = len(centroids)
+        ids = np.arange(self._next_id, self._next_id + n, dtype=np.int64)
+        self._next_id += n
+        x = np.zeros((n, 4))
+        x[:, :2] = centroids
+        P = np.tile(np.diag([self.measurement_noise, self.measurement_noise,
+                             (self.max_distance / 2) ** 2, (self.max_distance / 2) ** 2]), (n, 1, 1))
+        self._ids = np.concatenate([self._ids, ids])
+        self._x = np.concatenate([self._x, x])
+        self._P = np.concatenate([self._P, P])
+        self._label = np.concatenate([self._label, np.zeros(n, dtype=np.int32)])
+        self._missed = np.concatenate([self._missed, np.zeros(n, dtype=np.int32)])
+        return ids
+
+    def _event(self, kind, tracks, others=None):
+        tracks = np.asarray(tracks, dtype=np.int64)
+        if len(tracks):
+            self.store.events.append(frame=np.full(len(tracks), self.frame), kind=np.full(len(tracks), kind),
+                                     track=tracks, other=np.zeros(len(tracks), dtype=np.int64) if others is None else others)
+
+    def update(self, labels, props, timestamp=None):
+        """labels: (H, W) cluster ids; props: columnar properties of clusters 1..n; returns (n,) track ids."""
+        from scipy.optimize import linear_sum_assignment
+
+        self.frame += 1
+        dt = 1.0
+        if timestamp is not None:
+            if self._time is not None:
+                dt = (timestamp - self._time) / self.interval
+            self._time = timestamp
+        n_current = len(props["label"])
+        centroids = np.stack([props["centroid_row"], props["centroid_col"]], axis=1).astype(np.float64)
+        area = np.asarray(props["area"], dtype=np.float64)
+        self._predict(dt)
+
+        # Cost of every (active track, cluster) pair
+        n_tracks = len(self._ids)
+        iou = np.zeros((n_tracks, n_current))
+        overlap = np.zeros((self._n_previous, n_current), dtype=np.int64)
+        owner = np.zeros(self._n_previous + 1, dtype=np.int64)  # Previous cluster id -> track id
+        if self._previous_labels is not None and n_current and self._n_previous:
+            overlap = overlap_matrix(self._previous_labels, labels, self._n_previous, n_current)
+            previous_area = np.bincount(self._previous_labels.ravel(), minlength=self._n_previous + 1)[1:]
+            union = previous_area[:, None] + area[None, :] - overlap
+            seen = self._label > 0
+            iou[seen] = (overlap / np.maximum(union, 1))[self._label[seen] - 1]
+            owner[self._label[seen]] = self._ids[seen]
+        distance = np.sqrt(((self._x[:, None, :2] - centroids[None]) ** 2).sum(axis=2))
+        feasible = (iou > 0) | (distance <= self.max_distance * max(dt, 1.0))
+        cost = np.where(feasible, (1 - iou) + distance / self.max_distance, _INFEASIBLE)
+
+        track_rows, cluster_rows = linear_sum_assignment(cost) if n_tracks and n_current else (np.empty(0, int),) * 2
+        keep = cost[track_rows, cluster_rows] < _INFEASIBLE
+        track_rows, cluster_rows = track_rows[keep], cluster_rows[keep]
+        track_of = np.zeros(n_current, dtype=np.int64)
+        track_of[cluster_rows] = self._ids[track_rows]
+        self._correct(track_rows, centroids[cluster_rows])
+
+        unmatched = np.ones(n_tracks, dtype=bool)
+        unmatched[track_rows] = False
+        new_label = np.zeros(n_tracks, dtype=np.int32)
+        new_label[track_rows] = cluster_rows + 1
+
+        # Merges: an unmatched track whose cluster flowed mostly into a cluster another track took
+        ended = np.zeros(n_tracks, dtype=bool)
+        if overlap.size:
+            candidates = np.flatnonzero(unmatched & (self._label > 0))
+            rows = overlap[self._label[candidates] - 1]
+            target = rows.argmax(axis=1)
+            merged = (rows[np.arange(len(candidates)), target] > 0) & (track_of[target] > 0)
+            self._event(_MERGE, self._ids[candidates[merged]], track_of[target[merged]])
+            ended[candidates[merged]] = True
+
+        self._missed[unmatched] += 1
+        self._missed[~unmatched] = 0
+        self._label = new_label
+        ended |= self._missed > self.max_missed
+        self._event(_END, self._ids[ended & (self._missed > self.max_missed)])
+
+        # New tracks; a new cluster overlapping a previous cluster whose track continued elsewhere split off it
+        new_clusters = np.flatnonzero(track_of == 0)
+        if len(new_clusters):
+            ids = self._start_tracks(centroids[new_clusters])
+            self._label[-len(ids):] = new_clusters + 1
+            track_of[new_clusters] = ids
+            parent = np.zeros(len(ids), dtype=np.int64)
+            if overlap.size:
+                columns = overlap[:, new_clusters]
+                source = columns.argmax(axis=0)
+                parent = np.where(columns[source, np.arange(len(ids))] > 0, owner[source + 1], 0)
+                continued = np.isin(parent, track_of[cluster_rows])
+                parent[~continued] = 0
+            self._event(_SPLIT, ids[parent > 0], parent[parent > 0])
+            self._event(_START, ids[parent == 0])
+            ended = np.concatenate([ended, np.zeros(len(ids), dtype=bool)])
+
+        # Retire ended tracks
+        alive = ~ended
+        self._ids, self._x, self._P = self._ids[alive], self._x[alive], self._P[alive]
+        self._label, self._missed = self._label[alive], self._missed[alive]
+
+        # Record this frame's observations
+        velocity = self._x[np.searchsorted(self._ids, track_of), 2:]  # Track ids stay sorted
+        self.store.observations.append(
+            track=track_of, frame=np.full(n_current, self.frame), time=np.full(n_current, np.nan if timestamp is None else timestamp),
+            label=props["label"], area=props["area"], centroid_row=props["centroid_row"], centroid_col=props["centroid_col"],
+            velocity_row=velocity[:, 0], velocity_col=velocity[:, 1], eccentricity=props["eccentricity"],
+            min_bt=props["min_bt"], mean_bt=props["mean_bt"])
+
+        self._previous_labels = labels
+        self._n_previous = n_current
+        return track_of
+
+
+_SCENE_TIME_PATTERNS = (
+    (re.compile(r"(\d{2}[A-Za-z]{3}\d{4})_(\d{4})"), "%d%b%Y%H%M"),  # INSAT: 3DIMG_01JUN2025_0030_L1B_STD.h5
+    (re.compile(r"s(\d{7})(\d{4})"), "%Y%j%H%M"),  # GOES ABI: ..._s20251520030...
+    (re.compile(r"A(\d{7})\.(\d{4})"), "%Y%j%H%M"),  # MODIS: MOD021KM.A2025152.0030...
+    (re.compile(r"(\d{8})[T_]?(\d{4})"), "%Y%m%d%H%M"),  # Generic YYYYMMDD[T_]HHMM
+)
+
+
+def scene_time(name):
+    """Acquisition time (UTC epoch seconds) parsed from a raw or product file name, or None."""
+    name = os.path.basename(name)
+    for pattern, fmt in _SCENE_TIME_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            try:
+                return float(calendar.timegm(time.strptime("".join(match.groups()), fmt)))
+            except ValueError:
+                continue
+    return None
+
+
+def product_time(path):
+    """Scene time of an ingest.py product: stored in the file, else parsed from its name, else its mtime."""
+    with np.load(path) as data:
+        if "scene_time" in data.files:
+            return float(data["scene_time"])
+    parsed = scene_time(path)
+    return parsed if parsed is not None else os.path.getmtime(path)
+
+
+def load_product(path):
+    """(labels, props) from an ingest.py .clusters.npz product."""
+    with np.load(path) as data:
+        return data["labels"], {key: data[f"cluster_{key}"] for key in CLUSTER_FIELDS}
+
+
+def synthetic_clusters(n_clusters, n_frames, size, radius=(4, 12), speed=3.0, seed=0):
+    """Frames of drifting disks as (H, W) labels + properties, with each disk's centre per frame for checking."""
+    rng = np.random.default_rng(seed)
+    position = rng.uniform(radius[1], size - radius[1], (n_clusters, 2))
+    velocity = rng.normal(0, speed, (n_clusters, 2))
+    radii = rng.uniform(*radius, n_clusters)
+    rows, cols = np.ogrid[:size, :size]
+    for _ in range(n_frames):
+        mask = np.zeros((size, size), dtype=bool)
+        for (r, c), rad in zip(position, radii):
+            r0, r1, c0, c1 = int(max(r - rad, 0)), int(min(r + rad + 1, size)), int(max(c - rad, 0)), int(min(c + rad + 1, size))
+            mask[r0:r1, c0:c1] |= (rows[r0:r1] - r) ** 2 + (cols[:, c0:c1] - c) ** 2 <= rad ** 2
+        bt = np.where(mask, 210.0, 290.0).astype(np.float32)
+        labels, props = label_clusters(mask, bt)
+        yield labels, props, position.copy()
+        position = np.clip(position + velocity, 0, size - 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track cloud clusters across frames (ingest products or a synthetic replay).")
+    parser.add_argument("--products", type=str, default=None, help="Directory of ingest.py .clusters.npz products, replayed in scene-time order")
+    parser.add_argument("--clusters", type=int, default=300, help="Synthetic clusters")
+    parser.add_argument("--frames", type=int, default=48, help="Synthetic frames")
+    parser.add_argument("--size", type=int, default=1024, help="Synthetic frame size")
+    parser.add_argument("--max_distance", type=float, default=TRACK_MAX_DISTANCE)
+    parser.add_argument("--max_missed", type=int, default=TRACK_MAX_MISSED)
+    parser.add_argument("--output", type=str, default=None, help="Save the track history (.npz)")
+    args = parser.parse_args()
+
+    tracker = ClusterTracker(args.max_distance, args.max_missed)
+    seconds, switches, checked = 0.0, 0, 0
+    if args.products:
+        # Replay in acquisition order: products of a backfill are written in bursts, not in scene order
+        products = sorted((product_time(path), path) for path in glob.glob(os.path.join(args.products, "*.clusters.npz")))
+        for timestamp, path in products:
+            labels, props = load_product(path)
+            start = time.perf_counter()
+            tracker.update(labels, props, timestamp=timestamp)
+            seconds += time.perf_counter() - start
+    else:
+        previous = None
+        for labels, props, centres in synthetic_clusters(args.clusters, args.frames, args.size):
+            start = time.perf_counter()
+            track_of = tracker.update(labels, props)
+            seconds += time.perf_counter() - start
+            # Identity check: the track under each disk's centre, for disks alone in their cluster
+            r, c = np.clip(np.round(centres).astype(int), 0, args.size - 1).T
+            cluster = labels[r, c]
+            alone = (cluster > 0) & (np.bincount(cluster, minlength=len(track_of) + 1)[cluster] == 1)
+            current = np.where(alone, np.concatenate([[0], track_of])[cluster], 0)
+            if previous is not None:
+                both = (current > 0) & (previous > 0)
+                switches += int((current[both] != previous[both]).sum())
+                checked += int(both.sum())
+            previous = current
+
+    store = tracker.store
+    tracks = store.tracks()
+    events = {kind: int((store.events["kind"] == k).sum()) for k, kind in enumerate(EVENT_KINDS)}
+    print(f"{tracker.frame + 1} frames, {len(store.observations)} cluster observations, {len(tracks['track'])} tracks, "
+          f"{len(tracker.active_tracks)} active at the end")
+    print(f"Events: {events}")
+    print(f"Tracking: {1000 * seconds / max(tracker.frame + 1, 1):.2f} ms per frame")
+    if checked:
+        print(f"Identity switches for isolated clusters: {switches} of {checked} frame-to-frame links")
+    if len(tracks["track"]):
+        longest = np.argmax(tracks["observations"])
+        print(f"Longest track {tracks['track'][longest]}: frames {tracks['first_frame'][longest]}-{tracks['last_frame'][longest]}")
+    if args.output:
+        store.save(args.output)
+        print(f"Track history: {args.output}")
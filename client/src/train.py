@@ -1,22 +1,37 @@
 import argparse
 import torch
-from torch.utils.data import DataLoader, Dataset, Subset
+from torch.utils.data import Dataset
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
 from torch import nn, optim
 import numpy as np
 import os
 import logging
+import time
+import contextlib
 from sklearn.model_selection import train_test_split
 # Assuming models are in client/src/models/
 from models.unet import UNet
+from patch_store import PatchShardStore, is_patch_store
+from augment import SegmentationAugmenter, AugmentingCollate, seed_worker
+from data_loading import make_loader, probe_loader_config, StepTimer
+from checkpoints import CheckpointManager, training_state, restore_training_state, atomic_torch_save, capture_rng_state
+from distributed import (init_distributed, cleanup_distributed, is_main_process, main_process_first, all_reduce_sum,
+                         broadcast_object, gather_object, barrier, ShardSampler, launch_local)
+from metrics import SegmentationMetrics
 # from models.vit import VisionTransformer # Keep if ViT training is also a goal
 
 # Assuming config.py is in client/src/
 try:
-    from config import PROCESSED_DATA_DIR, MODEL_DIR
+    from config import PROCESSED_DATA_DIR, MODEL_DIR, PATCH_STORE_DIR
 except ImportError:
     print("Warning: config.py not found or PROCESSED_DATA_DIR/MODEL_DIR not defined. Using placeholders.")
     PROCESSED_DATA_DIR = "data/processed_placeholder" # Should match process.py
     MODEL_DIR = "models_placeholder"
+    PATCH_STORE_DIR = os.path.join(PROCESSED_DATA_DIR, "patch_store")
+
+def ensure_dir(directory_path):
+    os.makedirs(directory_path, exist_ok=True)
 
 # --- Configure Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -84,42 +99,42 @@ class CloudSegmentationDataset(Dataset):
             return torch.zeros(dummy_img_shape, dtype=torch.float32), torch.zeros(dummy_mask_shape, dtype=torch.float32)
 
 
-# --- Metrics ---
-def dice_coefficient(preds, targets, smooth=1e-6):
-    preds = torch.sigmoid(preds) # Apply sigmoid if model outputs logits
-    preds = (preds > 0.5).float() # Binarize
+class ShardedCloudSegmentationDataset(Dataset):
+    """
+    Same samples as CloudSegmentationDataset, but read from a PatchShardStore (see patch_store.py).
+    Images are zero-copy views into the memory-mapped shards; `indices` selects a subset (train/val split).
+    """
+    def __init__(self, store, indices=None, transform=None, target_transform=None):
+        self.store = store
+        self.indices = np.arange(len(store)) if indices is None else np.asarray(indices)
+        self.transform = transform
+        self.target_transform = target_transform
 
-    intersection = (preds * targets).sum(dim=(1,2,3) if preds.ndim == 4 else (1,2)) # Sum over H, W, (and C if present)
-    union = preds.sum(dim=(1,2,3) if preds.ndim == 4 else (1,2)) + targets.sum(dim=(1,2,3) if preds.ndim == 4 else (1,2))
-    dice = (2. * intersection + smooth) / (union + smooth)
-    return dice.mean() # Average over batch
+        if len(self.indices) == 0:
+            raise ValueError("No samples selected from patch store.")
+        logging.info(f"Sharded dataset initialized with {len(self.indices)} samples from {store.store_dir}.")
 
-def iou_score(preds, targets, smooth=1e-6):
-    preds = torch.sigmoid(preds) # Apply sigmoid if model outputs logits
-    preds = (preds > 0.5).float() # Binarize
+    def __len__(self):
+        return len(self.indices)
 
-    intersection = (preds * targets).sum(dim=(1,2,3) if preds.ndim == 4 else (1,2))
-    union = preds.sum(dim=(1,2,3) if preds.ndim == 4 else (1,2)) + targets.sum(dim=(1,2,3) if preds.ndim == 4 else (1,2)) - intersection
-    iou = (intersection + smooth) / (union + smooth)
-    return iou.mean()
+    def __getitem__(self, idx):
+        image, mask = self.store.get(int(self.indices[idx]))  # Already (C, H, W) and (1, H, W)
 
+        image = torch.from_numpy(image)
+        if image.dtype != torch.float32:
+            image = image.float()
+        mask = torch.from_numpy(mask).float()  # Masks are stored compactly (uint8); BCEWithLogitsLoss wants float
 
-# --- Training Function ---
-def train_model(
-    model_type="unet",
-    n_channels=1, # Number of input channels for the model
-    n_classes=1,  # Number of output classes (1 for binary segmentation)
-    epochs=25,
-    batch_size=4,
-    lr=1e-4,
-    val_split=0.2,
-    device_str="cuda" if torch.cuda.is_available() else "cpu",
-    save_checkpoint=True
-    ):
+        if self.transform:
+            image = self.transform(image)
+        if self.target_transform:
+            mask = self.target_transform(mask)
+
+        return image, mask
 
-    ensure_dir(MODEL_DIR)
-    ensure_dir(PROCESSED_DATA_DIR) # process.py should create subdirs like /images and /masks
 
+def _build_file_datasets(n_channels, val_split):
+    """Legacy layout: one .npy per image/mask under all_sources_images/all_sources_masks."""
     # Assuming PROCESSED_DATA_DIR contains subdirs 'images' and 'masks'
     # These subdirs are expected to be populated by process.py with .npy files
     images_base_dir = os.path.join(PROCESSED_DATA_DIR, "all_sources_images") # Example, adjust if process.py saves differently
@@ -155,7 +170,7 @@ def train_model(
 
     if not all_image_files:
         logging.error("No training data found after matching. Please check data processing and paths.")
-        return
+        return None
 
     # Split data
     img_train, img_val, mask_train, mask_val = train_test_split(
@@ -164,23 +179,99 @@ def train_model(
 
     train_dataset = CloudSegmentationDataset(image_paths=img_train, mask_paths=mask_train) # Add transforms later
     val_dataset = CloudSegmentationDataset(image_paths=img_val, mask_paths=mask_val)
+    return train_dataset, val_dataset
 
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=2, pin_memory=True)
-    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=2, pin_memory=True)
 
-    logging.info(f"Training with {len(train_dataset)} samples, Validating with {len(val_dataset)} samples.")
+# --- Training Function ---
+def train_model(
+    model_type="unet",
+    n_channels=1, # Number of input channels for the model
+    n_classes=1,  # Number of output classes (1 for binary segmentation)
+    epochs=25,
+    batch_size=4,
+    lr=1e-4,
+    val_split=0.2,
+    device_str="cuda" if torch.cuda.is_available() else "cpu",
+    save_checkpoint=True,
+    amp=False, # Autocast forward passes to amp_dtype (bf16 runs natively on recent CPUs)
+    amp_dtype="bfloat16",
+    channels_last=False, # NHWC memory format for the convolutions
+    grad_accum_steps=1, # Optimizer step every N batches: effective batch = batch_size * grad_accum_steps
+    checkpointing="none", # UNet gradient checkpointing policy (see UNet.CHECKPOINT_POLICIES) for large tiles
+    augment=False, # Random flips/rotations/crops (image+mask) and noise/brightness (image) in the loader workers
+    seed=42,
+    num_workers=2, # Loader workers; "auto" (opt-in) probes loader-only throughput for a few worker/prefetch settings
+    prefetch_factor=2, # Batches prefetched per worker (ignored with "auto")
+    probe_batch_sizes=None, # With "auto", also probe these batch sizes and train with the fastest
+    resume=None, # "latest", "best" or a checkpoint path to continue from
+    keep_last=3, # Checkpoints retained: the most recent keep_last plus the best keep_best by val Dice
+    keep_best=1,
+    distributed=False # Data-parallel over a gloo process group (torchrun or launch_local); batch_size is per process
+    ):
+
+    rank, world_size = init_distributed("gloo") if distributed else (0, 1)
+    distributed = world_size > 1
+    # Seeds weight init and, with num_workers=0, augmentation (SegmentationAugmenter follows torch.initial_seed())
+    torch.manual_seed(seed + rank)
+    np.random.seed((seed + rank) % 2 ** 32)
+
+    ensure_dir(MODEL_DIR)
+    ensure_dir(PROCESSED_DATA_DIR) # process.py should create subdirs like /images and /masks
+
+    with main_process_first(): # Rank 0 creates any placeholder data before the others look for it
+        if is_patch_store(PATCH_STORE_DIR):
+            # Preferred layout: packed shards written by process.py or patch_store.py's converter
+            store = PatchShardStore(PATCH_STORE_DIR)
+            idx_train, idx_val = train_test_split(np.arange(len(store)), test_size=val_split, random_state=42)
+            train_dataset = ShardedCloudSegmentationDataset(store, indices=idx_train)
+            val_dataset = ShardedCloudSegmentationDataset(store, indices=idx_val)
+        else:
+            datasets = _build_file_datasets(n_channels, val_split)
+            if datasets is None:
+                return
+            train_dataset, val_dataset = datasets
+
+    collate_fn = AugmentingCollate(SegmentationAugmenter()) if augment else None
+    if num_workers == "auto":
+        loader_config = None
+        if is_main_process(): # All ranks must agree on the batch size; rank 0 probes for everyone
+            loader_config = probe_loader_config(train_dataset, probe_batch_sizes or [batch_size], collate_fn=collate_fn,
+                                                worker_init_fn=seed_worker)
+        loader_config = broadcast_object(loader_config)
+        num_workers, prefetch_factor, batch_size = (loader_config["num_workers"], loader_config["prefetch_factor"],
+                                                    loader_config["batch_size"])
+    num_workers = int(num_workers)
+
+    # Seeded loader: shuffling and per-worker augmentation streams repeat run to run. Workers persist across epochs.
+    # Distributed: each rank reads its own shard of every epoch's permutation; validation shards don't overlap.
+    loader_generator = torch.Generator().manual_seed(seed + rank)
+    train_sampler = DistributedSampler(train_dataset, world_size, rank, shuffle=True, seed=seed) if distributed else None
+    val_sampler = ShardSampler(val_dataset, world_size, rank) if distributed else None
+    train_loader = make_loader(train_dataset, batch_size, num_workers, prefetch_factor, shuffle=True, collate_fn=collate_fn,
+                               worker_init_fn=seed_worker, generator=loader_generator, sampler=train_sampler)
+    val_loader = make_loader(val_dataset, batch_size, num_workers, prefetch_factor, shuffle=False, sampler=val_sampler)
+
+    logging.info(f"Training with {len(train_dataset)} samples, Validating with {len(val_dataset)} samples"
+                 + (f" ({world_size} processes, {len(train_sampler)} training samples each)." if distributed else "."))
 
     device = torch.device(device_str)
 
     if model_type.lower() == "unet":
         model = UNet(n_channels=n_channels, n_classes=n_classes, bilinear=False) # bilinear can be an arg
+        model.use_checkpointing(checkpointing)
     # elif model_type.lower() == "vit":
     #     model = VisionTransformer(img_size=256, patch_size=16, in_chans=n_channels, num_classes=n_classes) # Example ViT init
     else:
         logging.error(f"Invalid model_type: {model_type}. Choose 'unet'.") # or 'vit'
         return
 
-    model = model.to(device)
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    model = model.to(device, memory_format=memory_format)
+    if distributed:
+        model = DistributedDataParallel(model, device_ids=[device.index] if device.type == "cuda" else None)
+    autocast_dtype = getattr(torch, amp_dtype)
+    # Loss scaling only matters for float16; bfloat16 has fp32's exponent range
+    scaler = torch.amp.GradScaler(device.type, enabled=amp and autocast_dtype == torch.float16)
 
     # Loss and Optimizer
     # For binary segmentation (n_classes=1), BCEWithLogitsLoss is common.
@@ -193,78 +284,117 @@ def train_model(
         criterion = nn.BCEWithLogitsLoss() # Placeholder, needs adjustment for multi-class
 
     optimizer = optim.AdamW(model.parameters(), lr=lr, weight_decay=1e-5)
-    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=3, factor=0.1, verbose=True)
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=3, factor=0.1)
 
     best_val_metric = -float('inf') # Or float('inf') if using loss
-
-    logging.info(f"Starting training: {epochs} epochs, Batch size: {batch_size}, LR: {lr}, Device: {device_str}")
-
-    for epoch in range(epochs):
+    start_epoch = 0
+    checkpoints = CheckpointManager(MODEL_DIR, prefix=model_type, keep_last=keep_last, keep_best=keep_best, mode="max")
+    run_config = {"model_type": model_type, "n_channels": n_channels, "n_classes": n_classes, "batch_size": batch_size,
+                  "lr": lr, "val_split": val_split, "seed": seed}
+
+    if not resume and rank == 0:
+        checkpoints.start_new_run()  # Never mix this run's checkpoints with an earlier run's index
+    if resume:
+        resume_path = {"latest": checkpoints.latest, "best": checkpoints.best}.get(resume, lambda: resume)()
+        if resume_path is None or not os.path.isfile(resume_path):
+            logging.error(f"No checkpoint to resume from ({resume}) in {MODEL_DIR}.")
+            return
+        # Every rank restores the same weights and optimizer state, and its own RNG streams and loader generator
+        start_epoch, best_val_metric = restore_training_state(resume_path, model, optimizer, scheduler, scaler,
+                                                              loader_generator, map_location=device, rank=rank)
+        logging.info(f"Resumed from {resume_path}: continuing at epoch {start_epoch + 1}, best Val Dice {best_val_metric:.4f}")
+
+    logging.info(f"Starting training: {epochs} epochs, Batch size: {batch_size} (x{grad_accum_steps} accumulation), LR: {lr}, "
+                 f"Device: {device_str}, AMP: {amp_dtype if amp else 'off'}, Channels-last: {channels_last}, "
+                 f"Checkpointing: {checkpointing}, Augmentation: {augment}")
+
+    for epoch in range(start_epoch, epochs):
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch) # New permutation each epoch, the same one on every rank
         model.train()
-        epoch_train_loss = 0.0
-        epoch_train_dice = 0.0
-        epoch_train_iou = 0.0
-
-        for i, (images, masks) in enumerate(train_loader):
-            images, masks = images.to(device), masks.to(device)
-
-            optimizer.zero_grad()
-            outputs = model(images) # Model output: (B, n_classes, H, W)
-
-            loss = criterion(outputs, masks) # BCEWithLogitsLoss expects logits and float targets
-
-            loss.backward()
-            optimizer.step()
-
-            epoch_train_loss += loss.item()
-            # Metrics calculated on logits for binary case
-            epoch_train_dice += dice_coefficient(outputs, masks).item()
-            epoch_train_iou += iou_score(outputs, masks).item()
-
-            if (i + 1) % 2 == 0: # Log every 20 batches
+        train_metrics = SegmentationMetrics(n_classes, device=device)
+        epoch_samples = 0
+        epoch_start = time.perf_counter()
+        step_timer = StepTimer()
+
+        optimizer.zero_grad(set_to_none=True)
+        for i, (images, masks) in enumerate(step_timer.wrap(train_loader)):
+            images = images.to(device, memory_format=memory_format, non_blocking=True)
+            masks = masks.to(device, non_blocking=True)
+
+            step_now = (i + 1) % grad_accum_steps == 0 or (i + 1) == len(train_loader)
+            # Micro-batches in this accumulation group: the epoch's last group may be partial
+            group_size = min(grad_accum_steps, len(train_loader) - (i - i % grad_accum_steps))
+            # Distributed: only all-reduce gradients on the micro-batch that steps the optimizer
+            sync_context = model.no_sync() if distributed and not step_now else contextlib.nullcontext()
+            with sync_context:
+                with torch.autocast(device_type=device.type, dtype=autocast_dtype, enabled=amp):
+                    logits = model(images, return_logits=True) # Model output: (B, n_classes, H, W)
+                logits = logits.float() # Loss and metrics in fp32
+
+                loss = criterion(logits, masks) # BCEWithLogitsLoss expects logits and float targets
+
+                scaler.scale(loss / group_size).backward()
+            if step_now:
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad(set_to_none=True)
+            epoch_samples += images.size(0)
+
+            # Confusion counts on the model's probabilities, accumulated on the device
+            train_metrics.update(torch.sigmoid(logits.detach()), masks, loss)
+
+            if (i + 1) % 20 == 0: # Log every 20 batches
                  logging.info(f"Epoch [{epoch+1}/{epochs}], Batch [{i+1}/{len(train_loader)}], Batch Loss: {loss.item():.4f}")
 
-        avg_train_loss = epoch_train_loss / len(train_loader)
-        avg_train_dice = epoch_train_dice / len(train_loader)
-        avg_train_iou = epoch_train_iou / len(train_loader)
-        logging.info(f"--- Epoch {epoch+1} Train Summary --- Loss: {avg_train_loss:.4f}, Dice: {avg_train_dice:.4f}, IoU: {avg_train_iou:.4f}")
+        train_seconds = time.perf_counter() - epoch_start
+        # Counts summed over all ranks: scores are exact for the whole epoch, throughput is the global rate
+        train_scores = train_metrics.all_reduce().compute()
+        epoch_samples = all_reduce_sum([epoch_samples]).item()
+        logging.info(f"--- Epoch {epoch+1} Train Summary --- Loss: {train_scores['loss']:.4f}, Dice: {train_scores['dice']:.4f}, "
+                     f"IoU: {train_scores['iou']:.4f}, Precision: {train_scores['precision']:.4f}, Recall: {train_scores['recall']:.4f}, "
+                     f"Throughput: {epoch_samples / train_seconds:.2f} samples/sec")
+        logging.info(f"--- Epoch {epoch+1} Step Timing --- {step_timer.summary()}")
 
         # Validation phase
         model.eval()
-        epoch_val_loss = 0.0
-        epoch_val_dice = 0.0
-        epoch_val_iou = 0.0
-        with torch.no_grad():
+        val_metrics = SegmentationMetrics(n_classes, device=device)
+        with torch.inference_mode():
             for images, masks in val_loader:
-                images, masks = images.to(device), masks.to(device)
-                outputs = model(images)
-                loss = criterion(outputs, masks)
-
-                epoch_val_loss += loss.item()
-                epoch_val_dice += dice_coefficient(outputs, masks).item()
-                epoch_val_iou += iou_score(outputs, masks).item()
-
-        avg_val_loss = epoch_val_loss / len(val_loader)
-        avg_val_dice = epoch_val_dice / len(val_loader)
-        avg_val_iou = epoch_val_iou / len(val_loader)
-        logging.info(f"--- Epoch {epoch+1} Val Summary --- Loss: {avg_val_loss:.4f}, Dice: {avg_val_dice:.4f}, IoU: {avg_val_iou:.4f}")
-
-        scheduler.step(avg_val_loss) # Or another metric like avg_val_dice if maximizing
-
-        # Save checkpoint
+                images = images.to(device, memory_format=memory_format, non_blocking=True)
+                masks = masks.to(device, non_blocking=True)
+                with torch.autocast(device_type=device.type, dtype=autocast_dtype, enabled=amp):
+                    logits = model(images, return_logits=True)
+                logits = logits.float()
+                val_metrics.update(torch.sigmoid(logits), masks, criterion(logits, masks))
+
+        val_scores = val_metrics.all_reduce().compute()
+        avg_val_loss, avg_val_dice = val_scores["loss"], val_scores["dice"]
+        logging.info(f"--- Epoch {epoch+1} Val Summary --- Loss: {avg_val_loss:.4f}, Dice: {avg_val_dice:.4f}, IoU: {val_scores['iou']:.4f}, "
+                     f"Precision: {val_scores['precision']:.4f}, Recall: {val_scores['recall']:.4f}")
+        if n_classes > 1:
+            logging.info(f"--- Epoch {epoch+1} Val Per-class Dice --- " +
+                         ", ".join(f"{name}: {scores['dice']:.4f}" for name, scores in val_scores["per_class"].items()))
+
+        scheduler.step(avg_val_loss) # Or another metric like avg_val_dice if maximizing (same reduced value on every rank)
+
+        # Save checkpoint (every epoch, atomically; retention keeps the last few and the best by val Dice)
         current_val_metric = avg_val_dice # Using Dice for saving best model
-        if current_val_metric > best_val_metric:
-            best_val_metric = current_val_metric
-            if save_checkpoint:
-                checkpoint_path = os.path.join(MODEL_DIR, f"{model_type}_best_epoch{epoch+1}_dice{best_val_metric:.4f}.pth")
-                torch.save(model.state_dict(), checkpoint_path)
-                logging.info(f"Checkpoint saved: {checkpoint_path} (Best Val Dice: {best_val_metric:.4f})")
-
-    # Save final model
-    if save_checkpoint:
+        best_val_metric = max(best_val_metric, current_val_metric)
+        if save_checkpoint:
+            rank_rng = gather_object(capture_rng_state(loader_generator))  # Every rank's RNG streams, on rank 0
+        if save_checkpoint and is_main_process():
+            state = training_state(model, optimizer, scheduler, epoch, best_val_metric, scaler, loader_generator, run_config,
+                                   rank_rng)
+            checkpoint_path = checkpoints.save(state, epoch, current_val_metric)
+            logging.info(f"Checkpoint saved: {checkpoint_path} (Val Dice: {current_val_metric:.4f}, Best: {best_val_metric:.4f})")
+
+    # Save final model (weights only, for export/inference)
+    if save_checkpoint and is_main_process():
         final_model_path = os.path.join(MODEL_DIR, f"{model_type}_final_cloud_segmentation.pth")
-        torch.save(model.state_dict(), final_model_path)
+        atomic_torch_save((model.module if distributed else model).state_dict(), final_model_path)
         logging.info(f"Training complete. Final model saved to {final_model_path}")
+    barrier() # Nobody leaves (and tears down the process group) before rank 0 has written its files
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Train a segmentation model for cloud detection.")
@@ -276,10 +406,30 @@ if __name__ == "__main__":
     parser.add_argument("--lr", type=float, default=1e-4, help="Learning rate")
     parser.add_argument("--val_split", type=float, default=0.2, help="Proportion of data for validation (0.0 to 1.0)")
     parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", help="Device: 'cuda' or 'cpu'")
+    parser.add_argument("--amp", action="store_true", help="Mixed precision: autocast forward passes to --amp_dtype")
+    parser.add_argument("--amp_dtype", type=str, default="bfloat16", choices=["bfloat16", "float16"], help="Autocast dtype (float16 enables gradient scaling)")
+    parser.add_argument("--channels_last", action="store_true", help="Use channels-last (NHWC) memory format for model and inputs")
+    parser.add_argument("--grad_accum_steps", type=int, default=1, help="Batches accumulated per optimizer step")
+    parser.add_argument("--checkpointing", type=str, default="none", choices=list(UNet.CHECKPOINT_POLICIES),
+                        help="Recompute these UNet stages' activations in backward to fit larger tiles")
+    parser.add_argument("--augment", action="store_true", help="Augment training batches in the DataLoader workers")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for shuffling and augmentation")
+    parser.add_argument("--num_workers", type=str, default="2",
+                        help="DataLoader workers, or 'auto' to probe loader throughput (times loading only, so it favours "
+                             "many workers; they then share the cores with training)")
+    parser.add_argument("--prefetch_factor", type=int, default=2, help="Batches prefetched per worker (when not 'auto')")
+    parser.add_argument("--resume", type=str, default=None, help="Continue training from 'latest', 'best' or a checkpoint path")
+    parser.add_argument("--keep_last", type=int, default=3, help="Most recent checkpoints to keep")
+    parser.add_argument("--keep_best", type=int, default=1, help="Best (by val Dice) checkpoints to keep")
+    parser.add_argument("--distributed", action="store_true", help="Join the torch.distributed (gloo) group set up by torchrun")
+    parser.add_argument("--nproc", type=int, default=1, help="Spawn this many local training processes (implies --distributed)")
+    parser.add_argument("--probe_batch_sizes", type=int, nargs="+", default=None, help="With --num_workers auto, also pick the batch size from these")
 
     args = parser.parse_args()
 
-    train_model(
+    launch_local(
+        train_model,
+        args.nproc,
         model_type=args.model_type,
         n_channels=args.n_channels,
         n_classes=args.n_classes,
@@ -287,6 +437,21 @@ if __name__ == "__main__":
         batch_size=args.batch_size,
         lr=args.lr,
         val_split=args.val_split,
-        device_str=args.device
+        device_str=args.device,
+        amp=args.amp,
+        amp_dtype=args.amp_dtype,
+        channels_last=args.channels_last,
+        grad_accum_steps=args.grad_accum_steps,
+        checkpointing=args.checkpointing,
+        augment=args.augment,
+        seed=args.seed,
+        num_workers=args.num_workers,
+        prefetch_factor=args.prefetch_factor,
+        probe_batch_sizes=args.probe_batch_sizes,
+        resume=args.resume,
+        keep_last=args.keep_last,
+        keep_best=args.keep_best,
+        distributed=args.distributed or args.nproc > 1
     )
+    cleanup_distributed()
     logging.info("--- Training script finished ---")
@@ -1,6 +1,215 @@
-def validate():
-    # TODO: Fill in with model loading and validation logic
-    print("Validation routine not yet implemented.")
+import os
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.model_selection import train_test_split
+
+from inference import load_model as load_model_file, configure_threads
+from patch_store import PatchShardStore, is_patch_store
+from metrics import SegmentationMetrics
+from checkpoints import resolve_checkpoint
+from scheduler import run_per_source_pool
+
+try:
+    from config import MODEL_DIR, PATCH_STORE_DIR, PREPROCESS_WORKERS
+except ImportError:
+    print("Warning: config.py not found, using placeholder paths.")
+    MODEL_DIR = "models_placeholder"
+    PATCH_STORE_DIR = "data/processed_placeholder/patch_store"
+    PREPROCESS_WORKERS = None
+
+# Validation runner: scores a trained model on the held-out patches and writes a JSON report.
+#
+# The held-out set is the validation split train.py uses (same seed), or the whole store. Its indices are
+# grouped by source and cut into chunks; chunks run on the per-source process pool (scheduler.py), each
+# worker with an even share of the cores. A worker loads the model once, gathers each batch straight from
+# the memory-mapped shards (the next batch is read on a thread while the model runs on the current one),
+# and accumulates a confusion matrix per source. The parent merges the counts, so Dice/IoU/precision/recall
+# are exact for every source and overall, and reports per-batch latency percentiles and throughput.
+
+_MODELS = {}  # Per worker process: model path -> loaded model
+
+
+def load_model(path):
+    """See inference.load_model; cached per worker process."""
+    if path not in _MODELS:
+        _MODELS[path] = load_model_file(path)
+    return _MODELS[path]
+
+
+def held_out_indices(store, split="val", val_split=0.2):
+    if split == "all":
+        return np.arange(len(store))
+    _, idx_val = train_test_split(np.arange(len(store)), test_size=val_split, random_state=42)  # As in train.py
+    return np.sort(idx_val)
+
+
+def make_tasks(store, indices, chunk_size):
+    """(source, (indices,)) tasks: each source's indices in store order, chunk_size at a time."""
+    sources = np.array([source or "unknown" for source in store.sources], dtype=object)[indices]
+    tasks = []
+    for source in dict.fromkeys(sources):
+        source_indices = indices[sources == source]
+        for first in range(0, len(source_indices), chunk_size):
+            tasks.append((source, (source_indices[first:first + chunk_size],)))
+    return tasks
+
+
+def evaluate_chunk(indices, model_path, store_dir, batch_size, threshold, num_threads):
+    """Worker: {"metrics": {source: SegmentationMetrics}, "batch_ms": [...], "batch_sizes": [...], "samples": n}."""
+    configure_threads(num_threads)
+    model = load_model(model_path)
+    store = PatchShardStore(store_dir)
+    sources = np.array([source or "unknown" for source in store.sources], dtype=object)
+    metrics = {}
+    batch_ms, batch_sizes = [], []
+    batches = [indices[first:first + batch_size] for first in range(0, len(indices), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=1) as reader, torch.inference_mode():
+        pending = reader.submit(store.get_batch, batches[0]) if batches else None
+        for i, batch in enumerate(batches):
+            images, masks = pending.result()
+            if i + 1 < len(batches):
+                pending = reader.submit(store.get_batch, batches[i + 1])
+            images = torch.from_numpy(np.asarray(images, dtype=np.float32))
+            masks = torch.from_numpy(np.asarray(masks, dtype=np.float32))
+
+            start = time.perf_counter()
+            probs = model(images)
+            batch_ms.append(1000 * (time.perf_counter() - start))
+            batch_sizes.append(len(batch))
+
+            batch_sources = sources[batch]
+            for source in dict.fromkeys(batch_sources):
+                if source not in metrics:
+                    metrics[source] = SegmentationMetrics(model.n_classes, threshold)
+                selected = torch.from_numpy(batch_sources == source)
+                metrics[source].update(probs[selected], masks[selected])
+    return {"metrics": metrics, "batch_ms": batch_ms, "batch_sizes": batch_sizes, "samples": int(len(indices))}
+
+
+def print_chunk_progress(done, total, result):
+    """run_per_source_pool progress: the chunk's source and patch index range (not the index array)."""
+    indices = result.args[0]
+    status = "ok" if result.ok else "FAILED"
+    span = f"patches {indices[0]}-{indices[-1]} ({len(indices)})" if len(indices) else "no patches"
+    print(f"[{done}/{total}] {result.source}: {span} - {status} ({result.elapsed:.1f}s)")
+
+
+def _scores(metrics, samples):
+    scores = metrics.compute()
+    scores.pop("loss")
+    scores["samples"] = samples
+    return scores
+
+
+def latency_summary(batch_ms, batch_sizes):
+    batch_ms = np.asarray(batch_ms, dtype=np.float64)
+    per_sample = batch_ms / np.maximum(np.asarray(batch_sizes), 1)
+    if not len(batch_ms):
+        return {}
+    percentiles = lambda values: {f"p{p}": float(np.percentile(values, p)) for p in (50, 90, 95, 99)}
+    return {"per_batch_ms": dict(percentiles(batch_ms), mean=float(batch_ms.mean()), max=float(batch_ms.max())),
+            "per_sample_ms": dict(percentiles(per_sample), mean=float(per_sample.mean()))}
+
+
+def validate(checkpoint="latest", store_dir=PATCH_STORE_DIR, split="val", val_split=0.2, batch_size=16, threshold=0.5,
+             workers=PREPROCESS_WORKERS, chunk_size=1024, output=None):
+    """Evaluates the model on the held-out patches; returns the report dict (also written as JSON), or None."""
+    model_path = resolve_checkpoint(checkpoint, MODEL_DIR)
+    if not model_path or not os.path.isfile(model_path):
+        print(f"No model to validate ({checkpoint}) in {MODEL_DIR}. Train a model first.")
+        return None
+    if not is_patch_store(store_dir):
+        print(f"No patch store at {store_dir}. Run process.py first.")
+        return None
+
+    start = time.perf_counter()
+    store = PatchShardStore(store_dir)
+    indices = held_out_indices(store, split, val_split)
+    tasks = make_tasks(store, indices, chunk_size)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, len(tasks)))
+    num_threads = max(1, cpus // workers)
+    print(f"Validating {model_path} on {len(indices)} {split} patches of {store_dir}: "
+          f"{len(tasks)} chunks, {workers} workers x {num_threads} threads, batch {batch_size}")
+
+    results = run_per_source_pool(
+        [(source, (chunk, model_path, store_dir, batch_size, threshold, num_threads)) for source, (chunk,) in tasks],
+        evaluate_chunk, max_workers=workers, progress=print_chunk_progress)
+    wall_seconds = time.perf_counter() - start
+    failed = [r for r in results if not r.ok]
+    for r in failed:
+        print(f"Chunk of {r.source} failed:\n{r.error}")
+
+    per_source, samples, overall = {}, {}, None
+    batch_ms, batch_sizes = [], []
+    for r in results:
+        if not r.ok:
+            continue
+        for source, metrics in r.value["metrics"].items():
+            per_source[source] = per_source[source].merge(metrics) if source in per_source else metrics
+            overall = SegmentationMetrics(metrics.n_classes, threshold) if overall is None else overall
+            overall.merge(metrics)
+        samples[r.source] = samples.get(r.source, 0) + r.value["samples"]
+        batch_ms += r.value["batch_ms"]
+        batch_sizes += r.value["batch_sizes"]
+
+    evaluated = sum(samples.values())
+    model_seconds = sum(batch_ms) / 1000
+    report = {
+        "checkpoint": os.path.abspath(model_path), "store": os.path.abspath(store_dir), "split": split,
+        "val_split": val_split if split == "val" else None, "threshold": threshold, "batch_size": batch_size,
+        "workers": workers, "threads_per_worker": num_threads, "samples": evaluated, "failed_chunks": len(failed),
+        "overall": _scores(overall, evaluated) if overall is not None else None,
+        "per_source": {source: _scores(metrics, samples[source]) for source, metrics in sorted(per_source.items())},
+        "latency": latency_summary(batch_ms, batch_sizes),
+        "throughput": {"wall_seconds": wall_seconds, "samples_per_sec": evaluated / wall_seconds if wall_seconds else 0.0,
+                       "model_samples_per_sec_per_worker": evaluated / model_seconds / workers if model_seconds else 0.0},
+    }
+
+    output = output or os.path.join(MODEL_DIR, os.path.splitext(os.path.basename(model_path))[0] + ".validation.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Validation report: {output}")
+    return report
+
+
+def print_report(report):
+    def line(name, scores):
+        print(f"  {name:<14} n={scores['samples']:<8} Dice {scores['dice']:.4f}  IoU {scores['iou']:.4f}  "
+              f"Precision {scores['precision']:.4f}  Recall {scores['recall']:.4f}")
+    if report["overall"] is not None:
+        line("overall", report["overall"])
+    for source, scores in report["per_source"].items():
+        line(source, scores)
+    latency = report["latency"].get("per_batch_ms")
+    if latency:
+        print(f"  Latency per batch of {report['batch_size']}: p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, "
+              f"p99 {latency['p99']:.1f} ms")
+    print(f"  Throughput: {report['throughput']['samples_per_sec']:.1f} samples/sec "
+          f"({report['throughput']['wall_seconds']:.1f} s wall)")
+
 
 if __name__ == "__main__":
-    validate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Validate a trained segmentation model on the held-out patch set.")
+    parser.add_argument("--checkpoint", type=str, default="latest",
+                        help="'latest', 'best', or a model path (.pth/.ckpt, export .json, .int8.pt)")
+    parser.add_argument("--patch_store", type=str, default=PATCH_STORE_DIR)
+    parser.add_argument("--split", type=str, default="val", choices=["val", "all"], help="train.py's validation split, or every patch")
+    parser.add_argument("--val_split", type=float, default=0.2, help="Validation fraction used for training")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=PREPROCESS_WORKERS, help="Worker processes (default: all cores)")
+    parser.add_argument("--chunk_size", type=int, default=1024, help="Patches per worker task")
+    parser.add_argument("--output", type=str, default=None, help="Report path (default: next to the model in MODEL_DIR)")
+    args = parser.parse_args()
+
+    report = validate(args.checkpoint, args.patch_store, args.split, args.val_split, args.batch_size, args.threshold,
+                      args.workers, args.chunk_size, args.output)
+    if report is not None:
+        print_report(report)